@@ -0,0 +1,69 @@
+"""
+Snapshot Analysis Benchmark
+Times the cross-device anomaly analysis (mikrotik/analysis.py) over one router's tables, with a
+handful of planted anomalies so every check has something to find
+
+Usage: python benchmarks/analysis_bench.py [devices] [rounds]
+"""
+
+import logging as log
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_router import make_tables, LEASE_PATH, ARP_PATH, BRIDGE_HOST_PATH
+from mikrotik.snapshot import RouterSnapshot, MacTable
+from mikrotik import analysis
+
+
+def planted_snapshot(count):
+    tables = make_tables(count)
+    arp, bridge_hosts = tables[ARP_PATH], tables[BRIDGE_HOST_PATH]
+    # Device 5 answers ARP with device 6's address: an IP mismatch and a duplicate IP
+    arp[5]['address'] = arp[6]['address']
+    # A static host with no lease
+    arp.append({'id': '*F0001', 'address': '10.200.0.1', 'mac-address': 'DE:AD:BE:EF:00:01', 'interface': 'bridge'})
+    # Device 7 also learned on a second port
+    bridge_hosts.append({'id': '*F0002', 'mac-address': bridge_hosts[7]['mac-address'], 'bridge': 'bridge', 'interface': 'ether99', 'local': 'false'})
+
+    snapshot = RouterSnapshot(connection=object(), router='bench')
+    snapshot.leases = MacTable(tables[LEASE_PATH])
+    snapshot.arp = MacTable(arp)
+    snapshot.bridge_hosts = MacTable(bridge_hosts)
+    return snapshot
+
+
+def best_of(rounds, function, *args):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    log.basicConfig(level=log.ERROR)
+
+    snapshot = planted_snapshot(count)
+    devices_dict = snapshot.build_devices()
+    columns = analysis.SnapshotColumns.from_snapshot(snapshot, devices_dict)
+
+    print(f"{count} devices, best of {rounds}")
+    print(f"  columns          {best_of(rounds, analysis.SnapshotColumns.from_snapshot, snapshot, devices_dict):8.1f} ms")
+    print(f"  ip mismatches    {best_of(rounds, analysis.find_ip_mismatches, columns):8.1f} ms")
+    print(f"  duplicate IPs    {best_of(rounds, analysis.find_duplicate_ips, columns):8.1f} ms")
+    print(f"  multi-port MACs  {best_of(rounds, analysis.find_multi_port_macs, columns):8.1f} ms")
+    print(f"  analyze_snapshot {best_of(rounds, analysis.analyze_snapshot, snapshot, devices_dict):8.1f} ms")
+    for anomaly in snapshot.anomalies:
+        print(f"  found: {anomaly}")
+
+
+if __name__ == "__main__":
+    main()
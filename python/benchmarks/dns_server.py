@@ -0,0 +1,140 @@
+"""
+DNS Server
+A local UDP stand-in for the DNS server answering reverse lookups (enrich.py), so enrichment can be
+exercised without a real resolver: PTR queries for known addresses get a name, anything else gets
+NXDOMAIN, and every query is counted
+
+It can answer slowly (--delay) or not at all for some addresses (drop) to check timeouts, retries
+and negative caching
+
+Usage: python benchmarks/dns_server.py [--port P] [--delay SECONDS] [--hosts N]
+Then run the collector with --enrich dns --dns-server 127.0.0.1:P
+"""
+
+import threading
+import argparse
+import socket
+import struct
+import time
+
+HEADER = struct.Struct('!HHHHHH')
+TYPE_PTR = 12
+RCODE_NXDOMAIN = 3
+
+
+def read_question(message):
+    """
+    Returns:
+        tuple: (name, end offset of the question including type and class)
+    """
+    labels = []
+    offset = HEADER.size
+    while message[offset]:
+        length = message[offset]
+        labels.append(message[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += 1 + length
+    return '.'.join(labels), offset + 5
+
+
+def address_of(name):
+    """'23.5.0.10.in-addr.arpa' => '10.0.5.23', None for other names"""
+    if not name.lower().endswith('.in-addr.arpa'):
+        return None
+    return '.'.join(reversed(name[:-len('.in-addr.arpa')].split('.')))
+
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.')) + b'\0'
+
+
+class DnsServer:
+    def __init__(self, names=None, host='127.0.0.1', port=0, delay=0.0, ttl=3600):
+        """
+        Args:
+            names (dict): Dotted IPv4 => PTR name; other addresses are answered with NXDOMAIN
+        """
+        self.names = dict(names or {})
+        self.delay = delay
+        self.ttl = ttl
+        # Dotted IPv4 addresses whose queries are never answered
+        self.drop = set()
+        self.queries = 0
+        self._lock = threading.Lock()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.thread = threading.Thread(target=self.serve_forever, name=f"dns-{self.port}", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    @property
+    def server(self):
+        return f"127.0.0.1:{self.port}"
+
+    def serve_forever(self):
+        while True:
+            try:
+                message, client = self.socket.recvfrom(512)
+            except OSError:
+                return
+            with self._lock:
+                self.queries += 1
+            if self.delay:
+                # Answered from a thread each, so a slow answer does not hold up the rest
+                threading.Thread(target=self._answer, args=(message, client, self.delay), daemon=True).start()
+            else:
+                self._answer(message, client)
+
+    def _answer(self, message, client, delay=0.0):
+        try:
+            query_id, _, _, _, _, _ = HEADER.unpack_from(message)
+            name, end = read_question(message)
+        except (struct.error, IndexError, UnicodeDecodeError):
+            return
+        address = address_of(name)
+        if address in self.drop:
+            return
+        if delay:
+            time.sleep(delay)
+        question = message[HEADER.size:end]
+        answer = self.names.get(address)
+        if answer is None:
+            reply = HEADER.pack(query_id, 0x8180 | RCODE_NXDOMAIN, 1, 0, 0, 0) + question
+        else:
+            data = encode_name(answer)
+            # The answer's name points back at the question's (offset 12)
+            record = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_PTR, 1, self.ttl, len(data)) + data
+            reply = HEADER.pack(query_id, 0x8180, 1, 1, 0, 0) + question + record
+        try:
+            self.socket.sendto(reply, client)
+        except OSError:
+            pass
+
+    def close(self):
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer reverse DNS lookups for a fake network")
+    parser.add_argument("--port", type=int, default=5353, help="Port to listen on (default: 5353)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering each query")
+    parser.add_argument("--hosts", type=int, default=1000, help="Name the addresses of benchmarks/fake_router.py's first N devices host-N.lan (default: 1000)")
+    args = parser.parse_args()
+
+    names = {f"10.{index >> 16 & 0xFF}.{index >> 8 & 0xFF}.{index & 0xFF}": f"host-{index}.lan" for index in range(args.hosts)}
+    server = DnsServer(names, port=args.port, delay=args.delay)
+    print(f"Answering PTR queries on {server.server}, Ctrl+C to stop", flush=True)
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{server.queries} queries so far", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Fake RouterOS API Server
+A local stand-in for a router's plain API service (no TLS) serving synthetic DHCP lease, ARP and
+bridge host tables, so the collector can be run and measured without real hardware
+
+Supports login, print (with ?key=value queries and .proplist), listen (with .proplist), cancel, ping
+(count=1: addresses in `unreachable` time out after `interval`, others answer after `ping_rtt`), /interface
+print (counters advancing at `interface_rates` bytes per second, received, half that sent) and the
+/fake/stats/print command which reports what the server has answered so far
+
+Point a router config at it with MIKROTIK_HOST/MIKROTIK_PORT and "MIKROTIK_SSL": false
+
+Usage: python benchmarks/fake_router.py [--devices N] [--routers R] [--port P] [--latency SECONDS]
+"""
+
+from routeros_api.base_api import encode_length, decode_length
+import socketserver
+import random
+import threading
+import argparse
+import time
+import sys
+
+LEASE_PATH = '/ip/dhcp-server/lease'
+ARP_PATH = '/ip/arp'
+BRIDGE_HOST_PATH = '/interface/bridge/host'
+INTERFACE_PATH = '/interface'
+STATS_PATH = '/fake/stats'
+
+
+def make_tables(count, ports=8):
+    """Lease, ARP and bridge host rows for `count` devices, shaped like RouterOS 7 replies"""
+    leases, arp, bridge_hosts = [], [], []
+    for index in range(count):
+        mac = f"AA:BB:CC:{index >> 16 & 0xFF:02X}:{index >> 8 & 0xFF:02X}:{index & 0xFF:02X}"
+        ip = f"10.{index >> 16 & 0xFF}.{index >> 8 & 0xFF}.{index & 0xFF}"
+        row_id = f"*{index + 1:X}"
+        leases.append({
+            'id': row_id, 'address': ip, 'mac-address': mac, 'client-id': f"1:{mac.lower()}",
+            'address-lists': '', 'server': 'defconf', 'dhcp-option': '', 'status': 'bound',
+            'expires-after': '9m41s', 'last-seen': '19s', 'active-address': ip, 'active-mac-address': mac,
+            'active-client-id': f"1:{mac.lower()}", 'active-server': 'defconf', 'host-name': f"host-{index}",
+            'radius': 'false', 'dynamic': 'true', 'blocked': 'false', 'disabled': 'false', 'comment': '',
+        })
+        arp.append({
+            'id': row_id, 'address': ip, 'mac-address': mac, 'interface': 'bridge', 'published': 'false',
+            'invalid': 'false', 'DHCP': 'true', 'dynamic': 'true', 'complete': 'true', 'disabled': 'false',
+            'status': 'reachable',
+        })
+        bridge_hosts.append({
+            'id': row_id, 'mac-address': mac, 'on-interface': f"ether{index % ports + 1}",
+            'interface': f"ether{index % ports + 1}", 'bridge': 'bridge', 'age': '12s', 'local': 'false',
+            'external': 'false', 'disabled': 'false', 'dynamic': 'true', 'invalid': 'false', 'on-bridge': 'true',
+        })
+    return {LEASE_PATH: leases, ARP_PATH: arp, BRIDGE_HOST_PATH: bridge_hosts}
+
+
+def read_sentence(rfile):
+    words = []
+    while True:
+        length = decode_length(rfile.read)
+        if length == 0:
+            return words
+        words.append(rfile.read(length))
+
+
+def encode_sentence(words):
+    return b''.join(encode_length(len(word)) + word for word in words) + b'\x00'
+
+
+def interval_seconds(value):
+    """The '1s' / '250ms' forms the collector sends as a ping interval"""
+    if value.endswith('ms'):
+        return int(value[:-2]) / 1000
+    return float(value.rstrip('s'))
+
+
+def row_words(row, proplist=None):
+    if proplist is not None:
+        proplist = ['id' if key == '.id' else key for key in proplist]
+    items = row.items() if proplist is None else ((key, row[key]) for key in proplist if key in row)
+    return [f"={'.id' if key == 'id' else key}={value}".encode() for key, value in items]
+
+
+class FakeSession(socketserver.StreamRequestHandler):
+    """One API connection; prints are answered on their own threads so pipelined commands overlap"""
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.listens = {}
+        self.server.sessions.append(self)
+
+    def finish(self):
+        self.server.sessions.remove(self)
+        super().finish()
+
+    def send(self, words, counted=True):
+        sentence = encode_sentence(words)
+        with self.write_lock:
+            self.wfile.write(sentence)
+            self.wfile.flush()
+        if not counted:
+            return
+        self.server.count('sentences', 1)
+        self.server.count('bytes', len(sentence))
+
+    def handle(self):
+        try:
+            while True:
+                words = read_sentence(self.rfile)
+                if words:
+                    self.dispatch(words)
+        except (EOFError, ConnectionError, TypeError, ValueError):
+            # TypeError: ord() of the empty read at end of stream
+            pass
+
+    def dispatch(self, words):
+        command = words[0].decode()
+        arguments, queries, tag = {}, {}, None
+        for word in words[1:]:
+            word = word.decode()
+            if word.startswith('.tag='):
+                tag = word[5:]
+            elif word.startswith('='):
+                key, _, value = word[1:].partition('=')
+                arguments[key] = value
+            elif word.startswith('?'):
+                key, _, value = word[1:].partition('=')
+                queries[key] = value
+        tag_words = [f".tag={tag}".encode()] if tag else []
+        path, _, verb = command.rpartition('/')
+
+        if path == STATS_PATH:
+            self.send([b'!re', *row_words(self.server.stats_row())] + tag_words, counted=False)
+            self.send([b'!done'] + tag_words, counted=False)
+            return
+
+        if verb == 'login':
+            self.server.count('logins', 1)
+            self.send([b'!done'] + tag_words, counted=False)
+            return
+        self.server.count('commands', 1)
+        if self.server.first_command_at is None:
+            self.server.first_command_at = time.perf_counter()
+        if command == '/ping':
+            threading.Thread(target=self.ping, args=(arguments, tag_words), daemon=True).start()
+        elif verb == 'cancel':
+            cancelled = arguments.get('tag')
+            if self.listens.pop(cancelled, None):
+                self.send([b'!trap', b'=category=2', b'=message=interrupted', f".tag={cancelled}".encode()])
+                self.send([b'!done', f".tag={cancelled}".encode()])
+            self.send([b'!done'] + tag_words)
+        elif path == INTERFACE_PATH and verb == 'print':
+            proplist = arguments.get('.proplist')
+            for row in self.server.interface_rows():
+                self.send([b'!re', *row_words(row, proplist.split(',') if proplist else None)] + tag_words)
+            self.send([b'!done'] + tag_words)
+        elif path not in self.server.tables:
+            self.send([b'!trap', b'=message=no such command prefix'] + tag_words)
+            self.send([b'!done'] + tag_words)
+        elif verb == 'print':
+            threading.Thread(target=self.print_rows, args=(path, arguments, queries, tag_words), daemon=True).start()
+        elif verb == 'listen':
+            proplist = arguments.get('.proplist')
+            self.listens[tag] = (path, proplist.split(',') if proplist else None)
+        else:
+            self.send([b'!trap', b'=message=no such command'] + tag_words)
+            self.send([b'!done'] + tag_words)
+
+    def print_rows(self, path, arguments, queries, tag_words):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        proplist = arguments.get('.proplist')
+        proplist = proplist.split(',') if proplist else None
+        sent = 0
+        try:
+            for row in self.server.tables[path]:
+                if all(row.get(key) == value for key, value in queries.items()):
+                    self.send([b'!re', *row_words(row, proplist)] + tag_words)
+                    sent += 1
+            self.send([b'!done'] + tag_words)
+        except (ConnectionError, ValueError):
+            return
+        self.server.count('rows', sent)
+
+    def ping(self, arguments, tag_words):
+        address = arguments.get('address', '')
+        reply = [b'!re', b'=seq=0', f"=host={address}".encode(), b'=sent=1']
+        try:
+            if address in self.server.unreachable:
+                time.sleep(interval_seconds(arguments.get('interval', '1s')))
+                self.send(reply + [b'=status=timeout', b'=received=0', b'=packet-loss=100'] + tag_words)
+            else:
+                rtt = self.server.ping_rtt * random.uniform(0.5, 1.5)
+                time.sleep(rtt)
+                self.send(reply + [b'=size=56', b'=ttl=64', f"=time={round(rtt * 1000000)}us".encode(), b'=received=1', b'=packet-loss=0'] + tag_words)
+            self.send([b'!done'] + tag_words)
+        except (ConnectionError, ValueError):
+            return
+
+    def push(self, path, row, dead=False):
+        for tag, (listened_path, proplist) in list(self.listens.items()):
+            if listened_path == path:
+                self.send([b'!re', *row_words(row, proplist), *([b'=.dead=true'] if dead else []), f".tag={tag}".encode()])
+
+
+class FakeRouter(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tables, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), FakeSession)
+        self.tables = tables
+        self.latency = latency
+        # Dotted addresses that never answer a ping, and the round trip of those that do
+        self.unreachable = set()
+        self.ping_rtt = 0.002
+        # Interface name => bytes per second received (half that is sent): the bridge and every port hosts are seen on
+        ports = {row.get('interface') for row in tables.get(BRIDGE_HOST_PATH, ())} - {None}
+        self.interface_rates = {name: 125000.0 for name in ['bridge', *sorted(ports)]}
+        # Interface name => [bytes received, bytes sent, packets received, packets sent] so far
+        self.interface_counters = {}
+        self.counters_at = time.monotonic()
+        self.sessions = []
+        # perf_counter() of the first command after login, for startup measurements
+        self.first_command_at = None
+        self.stats = {'logins': 0, 'commands': 0, 'sentences': 0, 'rows': 0, 'bytes': 0}
+        self._stats_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, name=f"fake-router-{self.port}", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, key, amount):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def stats_row(self):
+        with self._stats_lock:
+            return {key: str(value) for key, value in self.stats.items()}
+
+    def interface_rows(self):
+        """/interface rows with every counter advanced by the time since the last print"""
+        with self._stats_lock:
+            now = time.monotonic()
+            elapsed, self.counters_at = now - self.counters_at, now
+            rows = []
+            for index, (name, rate) in enumerate(self.interface_rates.items()):
+                counters = self.interface_counters.setdefault(name, [0, 0, 0, 0])
+                counters[0] += int(rate * elapsed)
+                counters[1] += int(rate * elapsed / 2)
+                counters[2] += int(rate * elapsed / 1000)
+                counters[3] += int(rate * elapsed / 2000)
+                rows.append({
+                    'id': f"*{index + 1:X}", 'name': name, 'type': 'bridge' if name == 'bridge' else 'ether',
+                    'rx-byte': str(counters[0]), 'tx-byte': str(counters[1]), 'rx-packet': str(counters[2]),
+                    'tx-packet': str(counters[3]), 'rx-error': '0', 'tx-error': '0', 'rx-drop': '0', 'tx-drop': '0',
+                    'running': 'true', 'disabled': 'false',
+                })
+            return rows
+
+    def push(self, path, row, dead=False):
+        """Send a row (or a removal, with dead=True) to every session listening on `path`"""
+        for session in list(self.sessions):
+            session.push(path, row, dead)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic RouterOS tables on the plain API protocol")
+    parser.add_argument("--devices", type=int, default=1000, help="Devices per router (default: 1000)")
+    parser.add_argument("--routers", type=int, default=1, help="Routers to serve, on consecutive ports when --port is set")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=0, help="First port, 0 picks free ports")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each print waits before answering")
+    args = parser.parse_args()
+
+    tables = make_tables(args.devices)
+    routers = [
+        FakeRouter(tables, host=args.host, port=args.port + index if args.port else 0, latency=args.latency)
+        for index in range(args.routers)
+    ]
+    # First line is machine readable so benchmarks can find the ports
+    print(' '.join(str(router.port) for router in routers), flush=True)
+    print(f"Serving {args.devices} devices on {len(routers)} router(s), Ctrl+C to stop", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for router in routers:
+            router.close()
+
+
+if __name__ == "__main__":
+    main()
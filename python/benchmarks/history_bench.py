@@ -0,0 +1,76 @@
+"""
+History Store Benchmark
+Fills a scratch database with simulated polls (a fleet of devices with some churn every poll)
+and times the per-poll write and the lookup queries against it
+
+Usage: python benchmarks/history_bench.py [devices] [days] [polls per hour]
+"""
+
+from types import SimpleNamespace
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mikrotik.parse import format_mac, format_ipv4
+from history import HistoryStore
+
+
+def make_device(index, ip_offset=0, port=None):
+    return SimpleNamespace(
+        mac_address=0xAABBCC000000 + index,
+        ip_address=0x0A000000 + (index + ip_offset) % 65000,
+        dhcp_host_name=f"host-{index}",
+        dhcp_status='bound',
+        arp_status=random.choice(('reachable', 'stale')),
+        arp_interface='bridge',
+        bridge_bridge='bridge',
+        bridge_interface=port or f"ether{index % 8 + 1}",
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+    per_hour = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(os.path.join(directory, 'history.db'), retention_days=None)
+        devices = {('r', format_mac(0xAABBCC000000 + index)): make_device(index) for index in range(count)}
+        start = time.time() - days * 86400
+        polls = days * 24 * per_hour
+        write_time = 0.0
+        for poll in range(polls):
+            # A few percent of devices flap, move port or get a new lease each poll
+            for key in random.sample(list(devices), max(1, count // 50)):
+                index = devices[key].mac_address - 0xAABBCC000000
+                devices[key] = make_device(index, ip_offset=random.randrange(3), port=f"ether{random.randrange(1, 9)}")
+            started = time.perf_counter()
+            store.record(devices, polled_at=start + poll * 3600 / per_hour)
+            write_time += time.perf_counter() - started
+
+        rows = store.db.execute("SELECT COUNT(*) FROM device_states").fetchone()[0]
+        size = os.path.getsize(store.path) / 1e6
+        print(f"{count} devices, {polls} polls over {days} days: {rows} state intervals, {size:.1f} MB")
+        print(f"record():          {write_time / polls * 1000:8.2f} ms per poll")
+
+        queries = (
+            ("macs_for_ip(1 day)", lambda: store.macs_for_ip(format_ipv4(0x0A000000 + 17), start + 7 * 86400, start + 8 * 86400)),
+            ("macs_for_ip(all)", lambda: store.macs_for_ip(format_ipv4(0x0A000000 + 17))),
+            ("seen_range()", lambda: store.seen_range(format_mac(0xAABBCC000000 + 17))),
+            ("device_history()", lambda: store.device_history(format_mac(0xAABBCC000000 + 17))),
+        )
+        for name, query in queries:
+            started = time.perf_counter()
+            for _ in range(100):
+                result = query()
+            print(f"{name + ':':<19}{(time.perf_counter() - started) * 10:8.2f} ms ({len(result)} rows)")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Logging Cost Benchmark
+Compares the per-poll logging cost of the old eager f-string/json.dumps calls against the
+lazy %-style calls and batched report, per 1,000 devices, with LOG_LEVEL=INFO
+
+Usage: python benchmarks/logging_bench.py [devices] [rounds]
+"""
+
+import io
+import json
+import logging as log
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mikrotik.network_device import NetworkDevice
+import network
+
+
+def make_rows(count):
+    leases, arp, bridge = [], [], []
+    for index in range(count):
+        mac = f"AA:BB:CC:{index >> 16 & 0xFF:02X}:{index >> 8 & 0xFF:02X}:{index & 0xFF:02X}"
+        ip = f"10.{index >> 16 & 0xFF}.{index >> 8 & 0xFF}.{index & 0xFF}"
+        leases.append({
+            'id': f"*{index:X}", 'address': ip, 'mac-address': mac, 'client-id': f"1:{mac}",
+            'server': 'defconf', 'status': 'bound', 'host-name': f"host-{index}",
+            'last-seen': '1m2s', 'dynamic': 'true', 'comment': '',
+        })
+        arp.append({
+            'id': f"*{index:X}", 'address': ip, 'mac-address': mac, 'interface': 'bridge',
+            'published': 'false', 'invalid': 'false', 'status': 'reachable', 'dynamic': 'true',
+        })
+        bridge.append({
+            'id': f"*{index:X}", 'mac-address': mac, 'on-bridge': 'true', 'interface': f"ether{index % 8 + 1}",
+            'bridge': 'bridge', 'local': 'false',
+        })
+    return leases, arp, bridge
+
+
+def build_lazy(rows):
+    """The current code path: every debug call is %-style and skipped at INFO"""
+    devices = {}
+    for lease, arp_entry, bridge_host in zip(*rows):
+        device = NetworkDevice(lease['mac-address'])
+        device.add_dhcp_data(lease)
+        device.add_arp_data(arp_entry)
+        device.add_bridge_data(bridge_host)
+        devices[lease['mac-address']] = device
+    return devices
+
+
+def build_eager(rows):
+    """The same work with the debug calls the device path used to make, formatted before the level check"""
+    devices = {}
+    for lease, arp_entry, bridge_host in zip(*rows):
+        device = NetworkDevice(lease['mac-address'])
+        log.debug(f"NetworkDevice.add_dhcp_data({device}) with lease data: {json.dumps(lease, indent=2)}")
+        device.add_dhcp_data(lease)
+        log.debug(f"NetworkDevice._check_conflicts({device})")
+        log.debug(f"Merged device info for {device.identifier}: {json.dumps(device.get_dhcp_data(), indent=2)}")
+        log.debug(f"NetworkDevice.add_arp_data({device}) with ARP data: {json.dumps(arp_entry, indent=2)}")
+        device.add_arp_data(arp_entry)
+        log.debug(f"NetworkDevice.add_bridge_data({device}) with bridge data: {json.dumps(bridge_host, indent=2)}")
+        device.add_bridge_data(bridge_host)
+        devices[lease['mac-address']] = device
+    return devices
+
+
+def report_eager(devices_dict):
+    """The old report: one record per device plus eager conflict JSON"""
+    log.info(f"Compiled information for {len(devices_dict)} devices.")
+    log.info(f"\n{'=' * 80}\nNetwork Devices Information: \n{'=' * 80}\n")
+    for key, device in devices_dict.items():
+        device_info = device.get_merged_data()
+        log.info(
+            f"Device Details:\n{'-' * 40}\n"
+            f"Router:\t\t{device_info.get('router')}\n"
+            f"IP Address:\t{device_info.get('ip_address')}\n"
+            f"MAC Address:\t{device_info.get('mac_address')}\n"
+            f"Hostname:\t{device_info.get('hostname')}\n"
+            f"Interface:\t{device_info.get('interface')}\n"
+            f"DHCP Status:\t{device_info.get('dhcp_status')}\n"
+            f"ARP Status:\t{device_info.get('arp_status')}\n"
+            f"Last Seen:\t{device_info.get('last_seen')}\n"
+            f"Dynamic:\t{device_info.get('dynamic')}\n"
+            f"Static Lease:\t{device_info.get('static_lease')}\n"
+            f"Bridge:\t\t{device_info.get('bridge')}\n"
+            f"Bridge Port:\t{device_info.get('bridge_interface')}\n"
+            f"Bridge Status:\t{device_info.get('bridge_status')}\n"
+            f"On Bridge:\t{device_info.get('on_bridge')}\n"
+            f"Bridge Local:\t{device_info.get('bridge_local')}\n"
+            f"Comment:\t{device_info.get('comment')}"
+        )
+        if device_info.get('conflicts'):
+            log.warning(f"Conflicts detected:\n{json.dumps(device_info.get('conflict_details'), indent=2)}")
+        log.info(f"\n{'-' * 40}")
+
+
+def measure(function, argument, rounds):
+    return min(timeit.repeat(lambda: function(argument), number=1, repeat=rounds))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    scale = 1000 / count
+
+    # Formatting still happens for emitted records, so send them somewhere cheap rather than the terminal
+    log.basicConfig(level=log.INFO, stream=io.StringIO(), format="[%(levelname)s]\t%(message)s")
+    rows = make_rows(count)
+    devices = build_lazy(rows)
+
+    results = (
+        ("build devices", measure(build_eager, rows, rounds), measure(build_lazy, rows, rounds)),
+        ("device report", measure(report_eager, devices, rounds), measure(network.report_devices, devices, rounds)),
+    )
+
+    print(f"{count} devices, best of {rounds}, LOG_LEVEL=INFO, milliseconds per 1,000 devices")
+    print(f"{'':<16}{'eager':>10}{'lazy':>10}{'speedup':>10}")
+    for name, eager, lazy in results:
+        print(f"{name:<16}{eager * scale * 1000:>10.2f}{lazy * scale * 1000:>10.2f}{eager / lazy:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Memory Benchmark
+Peak collector memory while fetching one router's lease, ARP and bridge host tables, materialized
+the way the managers used to (each table a complete resource.call('print') list, all three held
+while they are indexed) against streamed (rows indexed as their sentences arrive, see
+PipelinedFetch.stream()), and streamed then joined into the final NetworkDevice records
+
+Each mode runs in its own process against benchmarks/fake_router.py, so peak resident memory
+(ru_maxrss) belongs to that mode alone; the growth over the process's size just before fetching is
+reported, along with what is still resident once the fetch is done
+
+Usage: python benchmarks/memory_bench.py [--sizes 50000,100000] [--modes materialized,streamed,devices]
+"""
+
+import subprocess
+import argparse
+import resource
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+MODES = ('materialized', 'streamed', 'devices')
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(port, mode):
+    """Runs inside the collector process; prints one JSON line of results"""
+    from mikrotik.login import RouterLogin
+    from mikrotik.snapshot import RouterSnapshot, MacTable
+
+    login = RouterLogin({'MIKROTIK_HOST': '127.0.0.1', 'MIKROTIK_PORT': port, 'MIKROTIK_SSL': False, 'MIKROTIK_USER': 'bench', 'MIKROTIK_PASS': 'bench'})
+    api, connection = login.open_session()
+    snapshot = RouterSnapshot(connection, router='bench')
+    before = current_rss_mb()
+    started = time.perf_counter()
+    if mode == 'materialized':
+        tables = {}
+        for name, path in snapshot.RESOURCE_PATHS.items():
+            query = snapshot.queries[name]
+            tables[name] = connection.get_resource(path).call('print', query.arguments(), query.queries())
+        held = {name: MacTable(rows) for name, rows in tables.items()}
+        rows = sum(map(len, tables.values()))
+        del tables
+    else:
+        snapshot.fetch()
+        held = snapshot
+        rows = len(snapshot.leases) + len(snapshot.arp) + len(snapshot.bridge_hosts)
+        if mode == 'devices':
+            held = snapshot.build_devices()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'rows': rows,
+        'seconds': elapsed,
+        'peak_mb': peak_rss_mb() - before,
+        'held_mb': current_rss_mb() - before,
+    }))
+    # What the fetch produced stays referenced until here, so held_mb measures it rather than garbage
+    del held
+    api.disconnect()
+
+
+def run_mode(port, mode):
+    collector = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', f"{port}:{mode}"], capture_output=True, text=True)
+    if collector.returncode != 0:
+        raise RuntimeError(collector.stderr.strip().splitlines()[-1] if collector.stderr.strip() else "collector failed")
+    return json.loads(collector.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare collector memory for materialized and streamed table fetches")
+    parser.add_argument("--sizes", default="50000", help="Comma separated devices per router, three rows each (default: 50000)")
+    parser.add_argument("--modes", default=','.join(MODES), help=f"Comma separated modes (default: {','.join(MODES)})")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        port, _, mode = args.measure.partition(':')
+        measure(int(port), mode)
+        return
+
+    print(f"{'devices':>9}{'rows':>9}  {'mode':<14}{'fetch ms':>9}{'peak MB':>9}{'held MB':>9}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        server = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, 'fake_router.py'), '--devices', str(size)], stdout=subprocess.PIPE, text=True)
+        try:
+            port = int(server.stdout.readline().split()[0])
+            for mode in args.modes.split(','):
+                result = run_mode(port, mode)
+                print(f"{size:>9}{result['rows']:>9}  {mode:<14}{result['seconds'] * 1000:>9.0f}{result['peak_mb']:>9.1f}{result['held_mb']:>9.1f}", flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Value Parsing Benchmark
+Times the hot RouterOS string conversions (mikrotik/parse.py) with and without their memo caches,
+over the lease, ARP and bridge rows of one router polled several times, then the full row to
+NetworkDevice path that every poll takes
+
+Usage: python benchmarks/parse_bench.py [devices] [polls]
+"""
+
+import logging as log
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_router import make_tables, LEASE_PATH, ARP_PATH, BRIDGE_HOST_PATH
+from mikrotik import parse
+from mikrotik.network_device import NetworkDevice
+
+
+def column(tables, key):
+    return [row[key] for rows in tables.values() for row in rows if row.get(key)]
+
+
+def timed(function, values, polls):
+    started = time.perf_counter()
+    for _ in range(polls):
+        for value in values:
+            function(value)
+    return time.perf_counter() - started
+
+
+def build_devices(tables):
+    devices = {}
+    for path, add in ((LEASE_PATH, NetworkDevice.add_dhcp_data), (ARP_PATH, NetworkDevice.add_arp_data), (BRIDGE_HOST_PATH, NetworkDevice.add_bridge_data)):
+        for row in tables[path]:
+            mac_address = row['mac-address']
+            device = devices.get(mac_address)
+            if device is None:
+                device = devices[mac_address] = NetworkDevice(mac_address, 'bench')
+            add(device, row)
+    return devices
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    polls = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    log.basicConfig(level=log.ERROR)
+    tables = make_tables(count)
+    # The fake tables share one duration per column; vary them like a real lease table does
+    for index, row in enumerate(tables[LEASE_PATH]):
+        row['last-seen'] = f"{index % 60}m{index % 59}s"
+
+    conversions = (
+        ('parse_mac', parse.parse_mac, column(tables, 'mac-address')),
+        ('parse_ipv4', parse.parse_ipv4, column(tables, 'address')),
+        ('parse_duration', parse.parse_duration, column(tables, 'last-seen') + column(tables, 'expires-after')),
+        ('parse_bool', parse.parse_bool, column(tables, 'dynamic') + column(tables, 'local')),
+    )
+    print(f"{count} devices, {polls} polls; ns per conversion")
+    print(f"  {'conversion':<16}{'values':>8}{'uncached':>11}{'cached':>9}")
+    for name, function, values in conversions:
+        # __wrapped__ is the plain function underneath lru_cache
+        uncached = timed(getattr(function, '__wrapped__', function), values, polls)
+        if hasattr(function, 'cache_clear'):
+            function.cache_clear()
+        cached = timed(function, values, polls)
+        calls = len(values) * polls
+        print(f"  {name:<16}{len(values):>8}{uncached / calls * 1e9:>11.0f}{cached / calls * 1e9:>9.0f}")
+
+    started = time.perf_counter()
+    for _ in range(polls):
+        devices = build_devices(tables)
+        for device in devices.values():
+            device.get_merged_data()
+    elapsed = time.perf_counter() - started
+    print(f"  rows to merged device dicts: {elapsed / polls * 1000:.1f} ms per poll")
+    for name, info in parse.cache_info().items():
+        print(f"  {name:<16}hits {info.hits:>9}  misses {info.misses:>7}  size {info.currsize}/{info.maxsize}")
+
+
+if __name__ == "__main__":
+    main()
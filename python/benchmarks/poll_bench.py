@@ -0,0 +1,137 @@
+"""
+Poll Benchmark
+Runs the collector against benchmarks/fake_router.py at several table sizes and reports, per size:
+first poll wall time (connect included), warm poll wall time, client CPU time, API round trips,
+rows and bytes received, and peak resident memory of the collector
+
+Each size runs the server and the collector in their own processes so CPU and memory belong to the collector alone
+
+Usage: python benchmarks/poll_bench.py [--sizes 100,1000,10000,100000] [--routers R] [--latency SECONDS] [--polls N]
+"""
+
+from routeros_api import RouterOsApiPool
+import subprocess
+import argparse
+import resource
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+
+def router_configs(ports):
+    return [
+        {
+            'NAME': f"fake{index}",
+            'MIKROTIK_HOST': '127.0.0.1',
+            'MIKROTIK_PORT': port,
+            'MIKROTIK_SSL': False,
+            'MIKROTIK_USER': 'bench',
+            'MIKROTIK_PASS': 'bench',
+        }
+        for index, port in enumerate(ports)
+    ]
+
+
+def server_stats(port):
+    api = RouterOsApiPool('127.0.0.1', 'bench', 'bench', port=port, plaintext_login=True)
+    try:
+        return {key: int(value) for key, value in api.get_api().get_resource('/fake/stats').get()[0].items()}
+    finally:
+        api.disconnect()
+
+
+def measure(ports, polls):
+    """Runs inside the collector process; prints one JSON line of results"""
+    from network import RouterFleet
+
+    fleet = RouterFleet(router_configs(ports), max_workers=len(ports))
+    before = [server_stats(port) for port in ports]
+    timings = []
+    devices = 0
+    try:
+        for _ in range(polls):
+            cpu_started = time.process_time()
+            started = time.perf_counter()
+            inventory, events, baselines = fleet.poll_changes()
+            timings.append((time.perf_counter() - started, time.process_time() - cpu_started))
+            devices = len(inventory)
+    finally:
+        fleet.close()
+    after = [server_stats(port) for port in ports]
+    # Stats queries are not counted by the server, so the difference is the collector's traffic alone
+    traffic = {key: sum(end[key] - start[key] for start, end in zip(before, after)) for key in after[0]}
+
+    print(json.dumps({
+        'devices': devices,
+        'first_wall': timings[0][0],
+        'first_cpu': timings[0][1],
+        'warm_wall': min(wall for wall, _ in timings[1:]) if polls > 1 else None,
+        'warm_cpu': min(cpu for _, cpu in timings[1:]) if polls > 1 else None,
+        'round_trips': traffic['commands'] / polls,
+        'rows': traffic['rows'] / polls,
+        'bytes': traffic['bytes'] / polls,
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def run_size(size, routers, latency, polls):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARK_DIR, 'fake_router.py'), '--devices', str(size), '--routers', str(routers), '--latency', str(latency)],
+        stdout=subprocess.PIPE,
+        text=True
+    )
+    try:
+        ports = server.stdout.readline().split()
+        collector = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--measure', ','.join(ports), '--polls', str(polls)],
+            capture_output=True,
+            text=True
+        )
+        if collector.returncode != 0:
+            raise RuntimeError(collector.stderr.strip().splitlines()[-1] if collector.stderr.strip() else "collector failed")
+        return json.loads(collector.stdout.strip().splitlines()[-1])
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a poll against the fake RouterOS API server")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma separated devices per router (default: 100,1000,10000)")
+    parser.add_argument("--routers", type=int, default=1, help="Routers polled together (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server waits before each print")
+    parser.add_argument("--polls", type=int, default=3, help="Polls per size; the first includes connecting (default: 3)")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per size instead of a table")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure([int(port) for port in args.measure.split(',')], args.polls)
+        return
+
+    if not args.json:
+        print(f"{args.routers} router(s), {args.latency * 1000:.0f}ms server latency, {args.polls} poll(s) per size")
+        print(f"{'devices':>9}{'first ms':>10}{'warm ms':>9}{'cpu ms':>8}{'trips':>7}{'rows':>9}{'KiB':>9}{'peak MB':>9}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        result = run_size(size, args.routers, args.latency, args.polls)
+        if args.json:
+            print(json.dumps({'size': size, 'routers': args.routers, **result}))
+            continue
+        print(
+            f"{result['devices']:>9}{format_ms(result['first_wall']):>10}{format_ms(result['warm_wall']):>9}"
+            f"{format_ms(result['warm_cpu'] if result['warm_cpu'] is not None else result['first_cpu']):>8}"
+            f"{result['round_trips']:>7.0f}{result['rows']:>9.0f}{result['bytes'] / 1024:>9.0f}{result['peak_rss_mb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
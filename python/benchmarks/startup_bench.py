@@ -0,0 +1,104 @@
+"""
+Startup Benchmark
+Times a single run of python/main.py from process spawn to the first RouterOS command it sends
+(after login), against benchmarks/fake_router.py running in this process, plus the total run time
+
+The collector runs from a scratch directory holding only configuration/info.json, so the numbers
+cover interpreter start, imports, config parsing and connecting; bytecode is cached between runs
+(--no-bytecode-cache measures the old `python -B` behaviour instead)
+
+Usage: python benchmarks/startup_bench.py [--runs N] [--devices N] [--no-bytecode-cache] [--imports N]
+"""
+
+from fake_router import FakeRouter, make_tables
+import subprocess
+import statistics
+import argparse
+import tempfile
+import json
+import time
+import sys
+import os
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(os.path.dirname(BENCHMARK_DIR), 'main.py')
+
+
+def write_config(directory, port):
+    os.makedirs(os.path.join(directory, 'configuration'), exist_ok=True)
+    with open(os.path.join(directory, 'configuration', 'info.json'), 'w', encoding='utf-8') as config_file:
+        json.dump({
+            'MIKROTIK_HOST': '127.0.0.1',
+            'MIKROTIK_PORT': port,
+            'MIKROTIK_SSL': False,
+            'MIKROTIK_USER': 'bench',
+            'MIKROTIK_PASS': 'bench',
+        }, config_file)
+
+
+def collector_environment(directory, bytecode_cache):
+    environment = dict(os.environ, LOG_LEVEL='WARNING', LOG_LOCATION='')
+    environment.pop('PYTHONDONTWRITEBYTECODE', None)
+    if bytecode_cache:
+        environment['PYTHONPYCACHEPREFIX'] = os.path.join(directory, 'pycache')
+    else:
+        environment['PYTHONDONTWRITEBYTECODE'] = '1'
+    return environment
+
+
+def run_once(server, directory, environment):
+    """(seconds to the first command, seconds to exit) for one collector run"""
+    server.first_command_at = None
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-u', MAIN, '--no-report'], cwd=directory, env=environment, check=True, capture_output=True)
+    finished = time.perf_counter()
+    if server.first_command_at is None:
+        raise RuntimeError("The collector exited without querying the router")
+    return server.first_command_at - started, finished - started
+
+
+def slowest_imports(directory, environment, count):
+    """Top `count` modules by cumulative import time in one collector run"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', MAIN, '--no-report'], cwd=directory, env=environment, capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = (part.strip() for part in line[len('import time:'):].split('|'))
+            if cumulative.isdigit():
+                # Nesting is shown by indentation; only top-level imports of main.py sum to the total
+                timings.append((int(cumulative), name))
+    return sorted(timings, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark collector startup against the fake RouterOS API server")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs after one warm-up run (default: 10)")
+    parser.add_argument("--devices", type=int, default=100, help="Devices on the fake router (default: 100)")
+    parser.add_argument("--no-bytecode-cache", dest="bytecode_cache", action="store_false", help="Run without writing bytecode, like `python -B`")
+    parser.add_argument("--imports", type=int, default=0, help="Also list the N slowest imports")
+    args = parser.parse_args()
+
+    server = FakeRouter(make_tables(args.devices))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            write_config(directory, server.port)
+            environment = collector_environment(directory, args.bytecode_cache)
+            # The warm-up run fills the bytecode cache (when enabled) and the OS file cache
+            run_once(server, directory, environment)
+            runs = [run_once(server, directory, environment) for _ in range(args.runs)]
+
+            first_command = sorted(first for first, _ in runs)
+            total = sorted(total for _, total in runs)
+            print(f"{args.runs} runs, {args.devices} devices, bytecode cache {'on' if args.bytecode_cache else 'off'}")
+            print(f"  spawn to first query  median {statistics.median(first_command) * 1000:6.0f} ms   min {first_command[0] * 1000:6.0f} ms")
+            print(f"  spawn to exit         median {statistics.median(total) * 1000:6.0f} ms   min {total[0] * 1000:6.0f} ms")
+            if args.imports:
+                print("  slowest imports (cumulative):")
+                for microseconds, name in slowest_imports(directory, environment, args.imports):
+                    print(f"    {microseconds / 1000:7.1f} ms  {name}")
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
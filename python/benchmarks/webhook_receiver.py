@@ -0,0 +1,89 @@
+"""
+Webhook Receiver
+A local HTTP stand-in for a notification webhook (notify.py), recording every batch POSTed to it so
+alert delivery can be exercised without an external service
+
+It can answer slowly (--delay) or with an error status (--status) to check that a slow or failing
+target never holds up polling
+
+Usage: python benchmarks/webhook_receiver.py [--port P] [--delay SECONDS] [--status CODE]
+Then run the collector with --notify http://127.0.0.1:P/
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import argparse
+import json
+import time
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.server.record(json.loads(body or b'{}'))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, status=204, on_batch=None):
+        super().__init__((host, port), WebhookHandler)
+        self.delay = delay
+        self.status = status
+        self.on_batch = on_batch
+        # Every batch received, in arrival order, with the perf_counter() it arrived at
+        self.batches = []
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, name=f"webhook-{self.port}", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/"
+
+    def record(self, batch):
+        with self._lock:
+            self.batches.append((time.perf_counter(), batch))
+        if self.on_batch:
+            self.on_batch(batch)
+
+    def notifications(self):
+        with self._lock:
+            return [notification for _, batch in self.batches for notification in batch.get('notifications', [])]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive and print notification webhook batches")
+    parser.add_argument("--port", type=int, default=8099, help="Port to listen on (default: 8099)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering each batch")
+    parser.add_argument("--status", type=int, default=204, help="HTTP status to answer with (default: 204)")
+    args = parser.parse_args()
+
+    receiver = WebhookReceiver(port=args.port, delay=args.delay, status=args.status, on_batch=lambda batch: print(json.dumps(batch, indent=2), flush=True))
+    print(f"Receiving webhooks on {receiver.url}, Ctrl+C to stop", flush=True)
+    try:
+        receiver.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Checkpoint Module
+Saves what the daemon knows about each router's devices to a compact binary file, so a restarted
+collector diffs its first poll against the devices it knew instead of reporting every one as new
+
+The file is rewritten whole at intervals and on shutdown: written beside the old one, fsynced and
+renamed over it, so a crash mid-save leaves the previous checkpoint intact. It is read back through
+mmap before the first poll.
+
+Layout (little-endian), version 2:
+    header     HEADER: magic, version, schema CRC, saved at, payload length, payload CRC
+    strings    u32 count, u32 byte length, then a u32 byte length per string and the strings
+               UTF-8 encoded back to back (any character, NUL included, may appear in them);
+               string 0 is None and is not stored
+    routers    u32 count, then per router ROUTER (name, devices, anomalies) followed by that
+               many RECORD device rows and ANOMALY (kind, subject) rows
+Device rows are fixed width, with one column per NetworkDevice field; the column types come from
+each field's parser, see COLUMN_CODES. A checkpoint whose version or schema differs from this
+build's is ignored and the collector starts cold.
+"""
+
+from mikrotik.network_device import NetworkDevice, DHCP_FIELDS, ARP_FIELDS, BRIDGE_FIELDS
+from mikrotik.parse import parse_mac, parse_ipv4, parse_bool, parse_name, parse_duration
+from mikrotik.analysis import Anomaly
+from operator import attrgetter
+from itertools import accumulate
+import logging as log
+import struct
+import mmap
+import math
+import time
+import zlib
+import os
+
+MAGIC = b'NMCP'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHHIdQI')
+COUNT = struct.Struct('<I')
+ROUTER = struct.Struct('<III')
+ANOMALY = struct.Struct('<II')
+
+# Stands in for None in integer columns
+NO_INT = 2 ** 64 - 1
+# Stands in for None in boolean columns
+NO_BOOL = -1
+
+# Field parser => struct code of its column
+COLUMN_CODES = {
+    str: 'I',
+    parse_name: 'I',
+    parse_mac: 'Q',
+    parse_ipv4: 'Q',
+    parse_bool: 'b',
+    parse_duration: 'd',
+}
+
+FIELDS = DHCP_FIELDS + ARP_FIELDS + BRIDGE_FIELDS
+ATTRIBUTES = tuple(attribute for _, attribute, _, _ in FIELDS)
+CODES = tuple(COLUMN_CODES[parse] for _, _, parse, _ in FIELDS)
+# tracker key (MAC), identifier, seen at, flags (1: has DHCP, 2: has ARP), then one column per field
+RECORD = struct.Struct('<IIdB' + ''.join(CODES))
+# Changes whenever a field is added, removed, reordered or changes type
+SCHEMA = zlib.crc32(','.join(f"{attribute}:{code}" for attribute, code in zip(ATTRIBUTES, CODES)).encode())
+
+HAS_DHCP = 1
+HAS_ARP = 2
+
+# Column positions by type, for converting a row a type at a time
+STRING_COLUMNS = tuple(index for index, code in enumerate(CODES) if code == 'I')
+INT_COLUMNS = tuple(index for index, code in enumerate(CODES) if code == 'Q')
+BOOL_COLUMNS = tuple(index for index, code in enumerate(CODES) if code == 'b')
+DURATION_COLUMNS = tuple(index for index, code in enumerate(CODES) if code == 'd')
+# NetworkDevice => its field values in column order
+FIELD_VALUES = attrgetter(*ATTRIBUTES)
+
+
+class StringTable(dict):
+    """String => index, assigning the next index on first lookup so repeated names and statuses are stored once"""
+    def __init__(self):
+        super().__init__({None: 0})
+        self.strings = []
+
+    def __missing__(self, value):
+        self.strings.append(value)
+        position = self[value] = len(self.strings)
+        return position
+
+    def encode(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        blob = b''.join(encoded)
+        lengths = struct.pack(f'<{len(encoded)}I', *map(len, encoded))
+        return COUNT.pack(len(encoded)) + COUNT.pack(len(blob)) + lengths + blob
+
+
+def decode_device(row, strings, router):
+    mac_address, identifier, seen, flags, *columns = row
+    for index in STRING_COLUMNS:
+        columns[index] = strings[columns[index]]
+    for index in INT_COLUMNS:
+        if columns[index] == NO_INT:
+            columns[index] = None
+    for index in BOOL_COLUMNS:
+        value = columns[index]
+        columns[index] = None if value == NO_BOOL else value == 1
+    for index in DURATION_COLUMNS:
+        value = columns[index]
+        if value != value:
+            columns[index] = None
+        elif value.is_integer():
+            # parse_duration() keeps whole seconds as ints
+            columns[index] = int(value)
+    # Every slot is assigned below, so NetworkDevice.__init__ (which sets them all to None first) is skipped
+    device = NetworkDevice.__new__(NetworkDevice)
+    device.identifier = strings[identifier]
+    device.router = router
+    for attribute, value in zip(ATTRIBUTES, columns):
+        setattr(device, attribute, value)
+    device._has_dhcp = bool(flags & HAS_DHCP)
+    device._has_arp = bool(flags & HAS_ARP)
+    device._has_conflicts = False
+    device._conflict_details = {}
+    device._conflicts_checked = False
+    # Probe verdicts, enrichment and port traffic are not checkpointed, the next poll refreshes them
+    device._reachable = None
+    device._rtt = None
+    device._vendor = None
+    device._dns_name = None
+    device._port_rx = None
+    device._port_tx = None
+    return strings[mac_address], device, seen
+
+
+def encode_device(mac_address, device, seen, string):
+    """string is StringTable.__getitem__"""
+    columns = list(FIELD_VALUES(device))
+    for index in STRING_COLUMNS:
+        columns[index] = string(columns[index])
+    for index in INT_COLUMNS:
+        if columns[index] is None:
+            columns[index] = NO_INT
+    for index in BOOL_COLUMNS:
+        value = columns[index]
+        columns[index] = NO_BOOL if value is None else int(value)
+    for index in DURATION_COLUMNS:
+        if columns[index] is None:
+            columns[index] = math.nan
+    flags = (HAS_DHCP if device._has_dhcp else 0) | (HAS_ARP if device._has_arp else 0)
+    return RECORD.pack(string(mac_address), string(device.identifier), seen, flags, *columns)
+
+
+class RouterState:
+    """One router's devices and open anomalies as read from a checkpoint"""
+    def __init__(self, name):
+        self.name = name
+        # MAC address => NetworkDevice
+        self.devices = {}
+        # MAC address => epoch seconds last seen
+        self.seen = {}
+        # Anomaly.key() => Anomaly, without details
+        self.anomalies = {}
+
+
+def encode(monitors, saved_at):
+    """
+    Args:
+        monitors (iterable): NetworkMonitor objects
+    Returns:
+        bytes: The whole checkpoint file
+    """
+    monitors = list(monitors)
+    table = StringTable()
+    string = table.__getitem__
+    sections = []
+    for monitor in monitors:
+        tracker = monitor.tracker
+        # Copy first, a listener thread may be folding updates into the tracker
+        devices = dict(tracker.devices)
+        seen = dict(tracker.seen)
+        anomalies = list(monitor.anomalies.values())
+        sections.append(ROUTER.pack(string(monitor.name), len(devices), len(anomalies)))
+        sections.extend(encode_device(mac_address, device, seen.get(mac_address, saved_at), string) for mac_address, device in devices.items())
+        sections.extend(ANOMALY.pack(string(anomaly.kind), string(anomaly.subject)) for anomaly in anomalies)
+    payload = table.encode() + COUNT.pack(len(monitors)) + b''.join(sections)
+    return HEADER.pack(MAGIC, VERSION, 0, SCHEMA, saved_at, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(view):
+    """
+    Args:
+        view (memoryview): A whole checkpoint file
+    Returns:
+        tuple: (saved_at, {router name: RouterState})
+    Raises:
+        ValueError: The file is not a checkpoint this build can read
+    """
+    if len(view) < HEADER.size:
+        raise ValueError("file is truncated")
+    magic, version, _, schema, saved_at, length, checksum = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a checkpoint file")
+    if version != VERSION or schema != SCHEMA:
+        raise ValueError(f"written by another version (format {version}, this build reads {VERSION})")
+    if len(view) != HEADER.size + length:
+        raise ValueError("file is truncated")
+    with view[HEADER.size:] as payload:
+        if zlib.crc32(payload) != checksum:
+            raise ValueError("checksum mismatch")
+
+    offset = HEADER.size
+    (count,) = COUNT.unpack_from(view, offset)
+    (size,) = COUNT.unpack_from(view, offset + COUNT.size)
+    offset += 2 * COUNT.size
+    ends = list(accumulate(struct.unpack_from(f'<{count}I', view, offset)))
+    offset += count * COUNT.size
+    if (ends[-1] if ends else 0) != size:
+        raise ValueError("string table is damaged")
+    with view[offset:offset + size] as blob:
+        strings = [None] + [str(blob[start:end], 'utf-8') for start, end in zip([0] + ends, ends)]
+    offset += size
+
+    routers = {}
+    (count,) = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    for _ in range(count):
+        name, devices, anomalies = ROUTER.unpack_from(view, offset)
+        offset += ROUTER.size
+        state = routers[strings[name]] = RouterState(strings[name])
+        with view[offset:offset + devices * RECORD.size] as records:
+            for row in RECORD.iter_unpack(records):
+                mac_address, device, seen = decode_device(row, strings, state.name)
+                state.devices[mac_address] = device
+                state.seen[mac_address] = seen
+        offset += devices * RECORD.size
+        for _ in range(anomalies):
+            kind, subject = ANOMALY.unpack_from(view, offset)
+            offset += ANOMALY.size
+            anomaly = Anomaly(strings[kind], strings[subject], router=state.name)
+            state.anomalies[anomaly.key()] = anomaly
+    return saved_at, routers
+
+
+class CheckpointStore:
+    def __init__(self, path, interval=300.0):
+        """
+        Args:
+            path (str): Checkpoint file; a temporary file beside it is used while saving
+            interval (float): Seconds between periodic saves, 0 only saves on shutdown
+        """
+        log.debug("CheckpointStore.__init__(%s) with path: %s", self, path)
+        self.path = path
+        self.interval = interval
+        self.last_saved = time.monotonic()
+
+    def load(self):
+        """
+        Returns:
+            tuple: (saved_at, {router name: RouterState}), (None, {}) when there is no usable checkpoint
+        """
+        try:
+            with open(self.path, 'rb') as checkpoint_file:
+                if os.fstat(checkpoint_file.fileno()).st_size == 0:
+                    raise ValueError("file is empty")
+                with mmap.mmap(checkpoint_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as view:
+                        return decode(view)
+        except FileNotFoundError:
+            log.info("[CHECKPOINT] No checkpoint at %s, starting cold", self.path)
+        except (OSError, ValueError, struct.error, IndexError) as e:
+            log.warning("[CHECKPOINT] Ignoring unreadable checkpoint %s: %s", self.path, str(e))
+        return None, {}
+
+    def restore(self, fleet):
+        """
+        Seed every monitor's change tracker and anomalies from the checkpoint
+        Returns:
+            int: Devices restored
+        """
+        started = time.perf_counter()
+        saved_at, routers = self.load()
+        restored = 0
+        for monitor in fleet.monitors:
+            state = routers.get(monitor.name)
+            if state is None:
+                continue
+            monitor.tracker.restore(state.devices, state.seen)
+            monitor.anomalies = state.anomalies
+            if monitor.notifier:
+                monitor.notifier.restore(monitor.name, state.devices)
+            restored += len(state.devices)
+        if saved_at is not None:
+            log.info(
+                "[CHECKPOINT] Restored %s device(s) on %s router(s) saved %.0fs ago in %.1f ms",
+                restored, len(routers), time.time() - saved_at, (time.perf_counter() - started) * 1000
+            )
+        return restored
+
+    def save(self, fleet):
+        """Write the fleet's devices atomically: a reader (or a crash) sees the old file or the new one, never part of one"""
+        started = time.perf_counter()
+        saved_at = time.time()
+        data = encode(fleet.monitors, saved_at)
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, 'wb') as checkpoint_file:
+                checkpoint_file.write(data)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(temporary, self.path)
+            # Persist the rename itself
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        except OSError as e:
+            log.error("[CHECKPOINT] Could not save %s: %s", self.path, str(e))
+            return False
+        self.last_saved = time.monotonic()
+        log.debug("[CHECKPOINT] Saved %s bytes to %s in %.1f ms", len(data), self.path, (time.perf_counter() - started) * 1000)
+        return True
+
+    def save_due(self, fleet):
+        """Save if `interval` seconds have passed since the last save"""
+        if self.interval > 0 and time.monotonic() - self.last_saved >= self.interval:
+            return self.save(fleet)
+        return False
@@ -0,0 +1,419 @@
+"""
+Device Enrichment Module
+Adds what the router does not know to each device: the vendor behind its MAC address, from the IEEE
+OUI registry, and the name its address resolves back to in DNS, for devices that never send a DHCP
+host name
+
+Vendors come from an in-memory index of the registry's MA-L (24-bit) assignments, read on first
+use: one sorted array of prefixes, searched with bisect, beside an array of indexes into the
+distinct vendor names. Reverse lookups are PTR queries sent concurrently over one UDP socket
+with asyncio; answers are cached for their TTL and failures for a shorter negative TTL in a
+bounded LRU cache, so once warm a poll only queries addresses it has not seen recently.
+
+The registry is not shipped in the repository; fetch it with the update-oui command below (the
+Docker image does so when it is built).
+
+Usage: python enrich.py update-oui [PATH]
+       python enrich.py vendor MAC [--oui-file PATH]
+       python enrich.py ptr IP [--dns-server HOST[:PORT]]
+"""
+
+from mikrotik.parse import parse_mac, format_ipv4, parse_ipv4
+from collections import OrderedDict
+from array import array
+import logging as log
+import threading
+import itertools
+import argparse
+import asyncio
+import bisect
+import struct
+import socket
+import random
+import time
+import csv
+import os
+
+DEFAULT_OUI_FILE = 'configuration/oui.csv'
+OUI_URL = 'https://standards-oui.ieee.org/oui/oui.csv'
+# Second bit of the first octet: the address was not assigned by a vendor (e.g. a phone's private Wi-Fi MAC)
+LOCALLY_ADMINISTERED = 0x02 << 40
+LOCALLY_ADMINISTERED_VENDOR = 'Locally administered'
+
+DNS_PORT = 53
+DNS_HEADER = struct.Struct('!HHHHHH')
+DNS_RECORD = struct.Struct('!HHIH')
+DNS_TYPE_PTR = 12
+DNS_CLASS_IN = 1
+DNS_NXDOMAIN = 3
+DEFAULT_DNS_TIMEOUT = 1.0
+DEFAULT_DNS_CONCURRENCY = 64
+DEFAULT_CACHE_SIZE = 16384
+# Bounds on how long a name is trusted, whatever TTL the server gave
+MIN_TTL = 60.0
+MAX_TTL = 86400.0
+# Addresses with no PTR record, and failed lookups (timeouts, server errors), are retried after these
+NEGATIVE_TTL = 600.0
+FAILURE_TTL = 60.0
+
+
+class OuiIndex:
+    """
+    MAC prefix => vendor over the IEEE MA-L registry CSV (Registry,Assignment,Organization Name,...),
+    also accepting plain 'AABBCC,Vendor' lines; loaded on the first lookup
+    """
+    def __init__(self, path=DEFAULT_OUI_FILE):
+        log.debug("OuiIndex.__init__(%s) with path: %s", self, path)
+        self.path = path
+        self._lock = threading.Lock()
+        self.prefixes = None
+        # Index into `vendors` for each prefix
+        self.vendor_indexes = None
+        self.vendors = None
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.prefixes)
+
+    def _ensure_loaded(self):
+        if self.prefixes is not None:
+            return
+        with self._lock:
+            if self.prefixes is None:
+                self._load()
+
+    def _load(self):
+        started = time.perf_counter()
+        assignments = {}
+        vendors = {}
+        try:
+            with open(self.path, newline='', encoding='utf-8') as oui_file:
+                for row in csv.reader(oui_file):
+                    if len(row) >= 3 and row[0] == 'MA-L':
+                        assignment, vendor = row[1], row[2]
+                    elif len(row) >= 2 and len(row[0]) == 6:
+                        assignment, vendor = row[0], row[1]
+                    else:
+                        continue
+                    try:
+                        prefix = int(assignment, 16)
+                    except ValueError:
+                        continue
+                    vendor = vendor.strip()
+                    assignments[prefix] = vendors.setdefault(vendor, len(vendors))
+        except OSError as e:
+            log.warning("[ENRICH] No OUI registry at %s (%s), vendors will be unknown; fetch it with: python python/enrich.py update-oui", self.path, str(e))
+        prefixes = sorted(assignments)
+        self.vendor_indexes = array('I', (assignments[prefix] for prefix in prefixes))
+        self.vendors = list(vendors)
+        # Assigned last: a lookup on another thread only reads once this is set
+        self.prefixes = array('I', prefixes)
+        log.info("[ENRICH] Loaded %s OUI assignments (%s vendors) from %s in %.1f ms", len(prefixes), len(vendors), self.path, (time.perf_counter() - started) * 1000)
+
+    def lookup(self, mac):
+        """
+        Args:
+            mac (int): 48-bit MAC address, see mikrotik/parse.py
+        Returns:
+            str: Vendor name, None if the prefix is not in the registry
+        """
+        if mac is None:
+            return None
+        if mac & LOCALLY_ADMINISTERED:
+            return LOCALLY_ADMINISTERED_VENDOR
+        self._ensure_loaded()
+        prefix = mac >> 24
+        position = bisect.bisect_left(self.prefixes, prefix)
+        if position < len(self.prefixes) and self.prefixes[position] == prefix:
+            return self.vendors[self.vendor_indexes[position]]
+        return None
+
+
+class TtlCache:
+    """Bounded LRU mapping whose entries also expire, safe to share between poll threads"""
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns:
+            tuple: (True, value) for a live entry, (False, None) otherwise
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return True, entry[1]
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+def ptr_name(address):
+    """'10.0.5.23' => '23.5.0.10.in-addr.arpa'"""
+    return '.'.join(reversed(address.split('.'))) + '.in-addr.arpa'
+
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label for label in (part.encode('idna') for part in name.rstrip('.').split('.'))) + b'\0'
+
+
+def ptr_query(query_id, address):
+    return DNS_HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + encode_name(ptr_name(address)) + struct.pack('!HH', DNS_TYPE_PTR, DNS_CLASS_IN)
+
+
+def read_name(message, offset):
+    """
+    Decode a possibly compressed name
+    Returns:
+        tuple: (name, offset just past the name where it started)
+    """
+    labels = []
+    end = None
+    for _ in range(128):
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            continue
+        if length == 0:
+            return '.'.join(labels), end if end is not None else offset + 1
+        labels.append(message[offset + 1:offset + 1 + length].decode('ascii', errors='replace'))
+        offset += 1 + length
+    raise ValueError("DNS name compression loop")
+
+
+def parse_ptr_reply(message):
+    """
+    Returns:
+        tuple: (query id, rcode, name or None, ttl or None)
+    """
+    query_id, flags, questions, answers, _, _ = DNS_HEADER.unpack_from(message)
+    offset = DNS_HEADER.size
+    for _ in range(questions):
+        _, offset = read_name(message, offset)
+        offset += 4
+    for _ in range(answers):
+        _, offset = read_name(message, offset)
+        record_type, _, ttl, length = DNS_RECORD.unpack_from(message, offset)
+        offset += DNS_RECORD.size
+        if record_type == DNS_TYPE_PTR:
+            name, _ = read_name(message, offset)
+            return query_id, flags & 0x0F, name, ttl
+        offset += length
+    return query_id, flags & 0x0F, None, None
+
+
+def default_dns_server(path='/etc/resolv.conf'):
+    try:
+        with open(path, encoding='utf-8') as resolv_conf:
+            for line in resolv_conf:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+class _ReplyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, waiting, server):
+        self.waiting = waiting
+        self.server = server
+
+    def datagram_received(self, data, address):
+        if address[:2] != self.server:
+            return
+        try:
+            reply = parse_ptr_reply(data)
+        except (ValueError, IndexError, struct.error):
+            return
+        future = self.waiting.get(reply[0])
+        if future is not None and not future.done():
+            future.set_result(reply)
+
+
+class ReverseResolver:
+    """
+    Bulk PTR lookups against one DNS server with a shared TTL/LRU cache
+        concurrency  queries outstanding at once
+        timeout      seconds to wait for each answer (one retry before the address counts as failed)
+    """
+    def __init__(self, server=None, port=DNS_PORT, timeout=DEFAULT_DNS_TIMEOUT, concurrency=DEFAULT_DNS_CONCURRENCY, cache_size=DEFAULT_CACHE_SIZE):
+        server = server or default_dns_server()
+        log.debug("ReverseResolver.__init__(%s) with server: %s:%s", self, server, port)
+        if not server:
+            raise ValueError("No DNS server configured and none found in /etc/resolv.conf")
+        self.server = (socket.gethostbyname(server), int(port))
+        self.timeout = float(timeout)
+        self.concurrency = max(1, int(concurrency))
+        self.cache = TtlCache(cache_size)
+        self.stats = {'queries': 0, 'answers': 0, 'negative': 0, 'failures': 0}
+
+    def resolve_many(self, addresses, metrics=None):
+        """
+        Args:
+            addresses (iterable): Packed IPv4 addresses
+            metrics (PollMetrics): Counts the addresses that were not cached
+        Returns:
+            dict: Packed IPv4 => name, None where there is none
+        """
+        names = {}
+        missing = []
+        for address in addresses:
+            found, name = self.cache.get(address)
+            if found:
+                names[address] = name
+            else:
+                missing.append(address)
+        if missing:
+            names.update(asyncio.run(self._resolve_all(missing)))
+        if metrics:
+            metrics.count('dns_lookups', len(missing))
+        return names
+
+    async def _resolve_all(self, addresses):
+        loop = asyncio.get_running_loop()
+        waiting = {}
+        transport, _ = await loop.create_datagram_endpoint(lambda: _ReplyProtocol(waiting, self.server), remote_addr=self.server)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Random starting id so replies to an earlier round's timed-out queries are not mistaken for these
+        ids = itertools.count(random.randrange(0x10000))
+
+        async def resolve(address):
+            async with semaphore:
+                for _ in range(2):
+                    query_id = next(ids) & 0xFFFF
+                    future = waiting[query_id] = loop.create_future()
+                    self.stats['queries'] += 1
+                    try:
+                        transport.sendto(ptr_query(query_id, format_ipv4(address)))
+                        return self._settle(address, await asyncio.wait_for(future, self.timeout))
+                    except (asyncio.TimeoutError, OSError):
+                        continue
+                    finally:
+                        waiting.pop(query_id, None)
+                self.stats['failures'] += 1
+                self.cache.put(address, None, FAILURE_TTL)
+                return None
+
+        try:
+            names = await asyncio.gather(*(resolve(address) for address in addresses))
+        finally:
+            transport.close()
+        return dict(zip(addresses, names))
+
+    def _settle(self, address, reply):
+        _, rcode, name, ttl = reply
+        if name:
+            self.stats['answers'] += 1
+            self.cache.put(address, name, min(max(ttl, MIN_TTL), MAX_TTL))
+        elif rcode in (0, DNS_NXDOMAIN):
+            self.stats['negative'] += 1
+            self.cache.put(address, None, NEGATIVE_TTL)
+        else:
+            self.stats['failures'] += 1
+            self.cache.put(address, None, FAILURE_TTL)
+        return name
+
+
+class Enricher:
+    """Shared by every router's monitor, so the vendor index and the DNS cache are too"""
+    def __init__(self, oui=None, resolver=None):
+        log.debug("Enricher.__init__(%s)", self)
+        self.oui = oui
+        self.resolver = resolver
+
+    def enrich(self, devices_dict, metrics=None):
+        """
+        Args:
+            devices_dict (dict): MAC address => NetworkDevice
+        """
+        names = {}
+        if self.resolver:
+            addresses = {device.ip_address for device in devices_dict.values() if device.ip_address is not None}
+            names = self.resolver.resolve_many(addresses, metrics)
+        for device in devices_dict.values():
+            device.set_enrichment(
+                vendor=self.oui.lookup(device.mac_address) if self.oui else None,
+                dns_name=names.get(device.ip_address)
+            )
+
+
+def create_enricher(kinds, oui_file=DEFAULT_OUI_FILE, dns_server=None, dns_timeout=DEFAULT_DNS_TIMEOUT):
+    """
+    Args:
+        kinds (list): Any of 'vendor' and 'dns'
+        dns_server (str): HOST or HOST:PORT, defaults to the first nameserver in /etc/resolv.conf
+    Returns:
+        Enricher: None when nothing is enabled
+    """
+    kinds = {kind.strip().lower() for spec in kinds for kind in spec.split(',') if kind.strip()}
+    unknown = kinds - {'vendor', 'dns'}
+    if unknown:
+        raise ValueError(f"Unknown enrichment(s): {', '.join(sorted(unknown))}, expected vendor and/or dns")
+    if not kinds:
+        return None
+    oui = OuiIndex(oui_file) if 'vendor' in kinds else None
+    resolver = None
+    if 'dns' in kinds:
+        host, _, port = (dns_server or '').partition(':')
+        try:
+            resolver = ReverseResolver(host or None, int(port or DNS_PORT), timeout=dns_timeout)
+            log.info("[ENRICH] Reverse DNS through %s:%s", *resolver.server)
+        except (ValueError, OSError) as e:
+            log.error("[ENRICH] Reverse DNS disabled: %s", str(e))
+    return Enricher(oui, resolver)
+
+
+def update_oui(path=DEFAULT_OUI_FILE, url=OUI_URL):
+    """Download the IEEE registry beside `path` and rename it into place once complete"""
+    from urllib.request import urlopen
+    temporary = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with urlopen(url, timeout=60) as response, open(temporary, 'wb') as oui_file:
+        while True:
+            chunk = response.read(1 << 16)
+            if not chunk:
+                break
+            oui_file.write(chunk)
+    os.replace(temporary, path)
+    return len(OuiIndex(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MAC vendor and reverse DNS lookups")
+    parser.add_argument("command", choices=("update-oui", "vendor", "ptr"))
+    parser.add_argument("value", nargs='?', help="Output path for update-oui, a MAC for vendor, an IP for ptr")
+    parser.add_argument("--oui-file", default=DEFAULT_OUI_FILE)
+    parser.add_argument("--dns-server", default=None, help="HOST[:PORT], defaults to /etc/resolv.conf")
+    args = parser.parse_args()
+    log.basicConfig(level='INFO', format="[%(levelname)s]\t%(message)s")
+
+    if args.command == 'update-oui':
+        print(f"{update_oui(args.value or DEFAULT_OUI_FILE)} assignments saved to {args.value or DEFAULT_OUI_FILE}")
+    elif args.command == 'vendor':
+        print(OuiIndex(args.oui_file).lookup(parse_mac(args.value)))
+    else:
+        host, _, port = (args.dns_server or '').partition(':')
+        address = parse_ipv4(args.value)
+        print(ReverseResolver(host or None, int(port or DNS_PORT)).resolve_many([address]).get(address))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Device History Module
+Keeps every device state change in a local SQLite database (WAL mode) so past polls can be queried
+
+A device's history is a list of state intervals: a row is only written when the device appears,
+changes IP/hostname/status/port, or disappears. An open interval (valid_to IS NULL) lasts until the
+router's most recent poll, which is tracked once per router instead of once per device.
+
+Usage: python history.py DATABASE ip 10.0.5.23 [--since 2026-10-13] [--until 2026-10-14]
+       python history.py DATABASE mac AA:BB:CC:DD:EE:FF
+"""
+
+from mikrotik.parse import parse_mac, format_mac, parse_ipv4, format_ipv4
+from datetime import datetime
+import logging as log
+import argparse
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_states (
+    id INTEGER PRIMARY KEY,
+    router TEXT NOT NULL,
+    mac INTEGER NOT NULL,
+    ip INTEGER,
+    hostname TEXT,
+    dhcp_status TEXT,
+    arp_status TEXT,
+    interface TEXT,
+    bridge TEXT,
+    bridge_interface TEXT,
+    valid_from REAL NOT NULL,
+    valid_to REAL
+);
+CREATE INDEX IF NOT EXISTS device_states_mac ON device_states (mac, valid_from);
+CREATE INDEX IF NOT EXISTS device_states_ip ON device_states (ip, valid_from);
+CREATE INDEX IF NOT EXISTS device_states_time ON device_states (valid_from);
+CREATE INDEX IF NOT EXISTS device_states_open ON device_states (router, mac) WHERE valid_to IS NULL;
+CREATE TABLE IF NOT EXISTS router_polls (
+    router TEXT PRIMARY KEY,
+    polled_at REAL NOT NULL
+);
+"""
+
+# Stored alongside router/mac, in the order of HistoryStore.device_state()
+STATE_COLUMNS = ('ip', 'hostname', 'dhcp_status', 'arp_status', 'interface', 'bridge', 'bridge_interface')
+
+# An open interval ends at its router's last poll
+VALID_TO = "COALESCE(s.valid_to, (SELECT p.polled_at FROM router_polls p WHERE p.router = s.router))"
+
+
+def to_timestamp(value):
+    """Accepts None, epoch seconds, a datetime or an ISO date/time string"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class HistoryStore:
+    def __init__(self, path, retention_days=180, maintenance_interval=3600):
+        log.debug("HistoryStore.__init__(%s) with path: %s", self, path)
+        self.path = path
+        self.retention_days = retention_days
+        self.maintenance_interval = maintenance_interval
+        self.last_maintenance = 0.0
+        self.db = sqlite3.connect(path)
+        # Has to be set before the first table exists to take effect
+        self.db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        # WAL keeps the database consistent on a crash; NORMAL only risks the last commit on power loss
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+        # router => {mac: (row id, state)} for every open interval, so a poll is diffed without reading the table
+        self._open = {}
+        for row_id, router, mac, *state in self.db.execute(
+            f"SELECT id, router, mac, {', '.join(STATE_COLUMNS)} FROM device_states WHERE valid_to IS NULL"
+        ):
+            self._open.setdefault(router, {})[mac] = (row_id, tuple(state))
+        self._polled_at = dict(self.db.execute("SELECT router, polled_at FROM router_polls"))
+
+    def close(self):
+        log.debug("HistoryStore.close(%s)", self)
+        self.db.close()
+
+    @staticmethod
+    def device_state(device):
+        return (
+            device.ip_address,
+            device.dhcp_host_name,
+            device.dhcp_status,
+            device.arp_status,
+            device.arp_interface,
+            device.bridge_bridge,
+            device.bridge_interface,
+        )
+
+    def record(self, inventory, routers=None, polled_at=None):
+        """
+        Store what changed since each router's previous poll, in one transaction
+        Args:
+            inventory (dict): (router, MAC) => NetworkDevice
+            routers (iterable): Routers this inventory is complete for, defaults to every router in it;
+                                devices of these routers missing from the inventory are closed as gone
+            polled_at (float): Epoch seconds of the poll, defaults to now
+        Returns:
+            int: Number of intervals opened or closed
+        """
+        polled_at = polled_at or time.time()
+        current = {}
+        for (router, mac_key), device in inventory.items():
+            mac = device.mac_address if device.mac_address is not None else parse_mac(mac_key)
+            if mac is not None:
+                current.setdefault(router, {})[mac] = self.device_state(device)
+        routers = set(current) if routers is None else set(routers)
+
+        closes, opens = [], []
+        for router in routers:
+            devices = current.get(router, {})
+            open_states = self._open.setdefault(router, {})
+            # The interval being closed was last confirmed by the previous poll
+            closed_at = self._polled_at.get(router, polled_at)
+            for mac, (row_id, state) in list(open_states.items()):
+                if devices.get(mac) != state:
+                    closes.append((closed_at, row_id))
+                    del open_states[mac]
+            for mac, state in devices.items():
+                if mac not in open_states:
+                    opens.append((router, mac, state))
+
+        with self.db:
+            self.db.executemany("UPDATE device_states SET valid_to = ? WHERE id = ?", closes)
+            for router, mac, state in opens:
+                cursor = self.db.execute(
+                    f"INSERT INTO device_states (router, mac, {', '.join(STATE_COLUMNS)}, valid_from) "
+                    f"VALUES (?, ?, {', '.join('?' * len(STATE_COLUMNS))}, ?)",
+                    (router, mac, *state, polled_at)
+                )
+                self._open[router][mac] = (cursor.lastrowid, state)
+            self.db.executemany(
+                "INSERT INTO router_polls (router, polled_at) VALUES (?, ?) "
+                "ON CONFLICT (router) DO UPDATE SET polled_at = excluded.polled_at",
+                [(router, polled_at) for router in routers]
+            )
+        for router in routers:
+            self._polled_at[router] = polled_at
+
+        log.debug("HistoryStore.record(%s) closed %s and opened %s intervals", self, len(closes), len(opens))
+        if time.monotonic() - self.last_maintenance >= self.maintenance_interval:
+            self.maintain()
+        return len(closes) + len(opens)
+
+    def maintain(self):
+        """Drop intervals that ended before the retention window and give the space back"""
+        self.last_maintenance = time.monotonic()
+        if not self.retention_days:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        with self.db:
+            deleted = self.db.execute(
+                "DELETE FROM device_states WHERE valid_to IS NOT NULL AND valid_to < ?", (cutoff,)
+            ).rowcount
+        if deleted:
+            self.db.execute("PRAGMA incremental_vacuum")
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            log.info("[HISTORY] Pruned %s state intervals older than %s days", deleted, self.retention_days)
+        return deleted
+
+    def macs_for_ip(self, ip_address, since=None, until=None):
+        """
+        Which devices held an IP address during [since, until]
+        Returns:
+            list: dicts with router, mac_address, first_seen, last_seen, sorted by first_seen
+        """
+        rows = self.db.execute(
+            f"SELECT s.router, s.mac, MIN(s.valid_from), MAX({VALID_TO}) FROM device_states s "
+            f"WHERE s.ip = ? AND s.valid_from <= ? AND {VALID_TO} >= ? "
+            f"GROUP BY s.router, s.mac ORDER BY MIN(s.valid_from)",
+            (parse_ipv4(ip_address), to_timestamp(until) or float('inf'), to_timestamp(since) or 0.0)
+        )
+        return [
+            {'router': router, 'mac_address': format_mac(mac), 'first_seen': first_seen, 'last_seen': last_seen}
+            for router, mac, first_seen, last_seen in rows
+        ]
+
+    def seen_range(self, mac_address):
+        """
+        First and last time a MAC address was seen on each router
+        Returns:
+            list: dicts with router, first_seen, last_seen
+        """
+        rows = self.db.execute(
+            f"SELECT s.router, MIN(s.valid_from), MAX({VALID_TO}) FROM device_states s "
+            f"WHERE s.mac = ? GROUP BY s.router",
+            (parse_mac(mac_address),)
+        )
+        return [
+            {'router': router, 'first_seen': first_seen, 'last_seen': last_seen}
+            for router, first_seen, last_seen in rows
+        ]
+
+    def device_history(self, mac_address, since=None, until=None):
+        """
+        Every state interval of a MAC address overlapping [since, until], oldest first
+        Returns:
+            list: dicts with router, STATE_COLUMNS, valid_from and valid_to (None while still current)
+        """
+        rows = self.db.execute(
+            f"SELECT s.router, {', '.join('s.' + column for column in STATE_COLUMNS)}, s.valid_from, s.valid_to "
+            f"FROM device_states s WHERE s.mac = ? AND s.valid_from <= ? AND {VALID_TO} >= ? ORDER BY s.valid_from",
+            (parse_mac(mac_address), to_timestamp(until) or float('inf'), to_timestamp(since) or 0.0)
+        )
+        history = []
+        for router, ip, *rest in rows:
+            entry = dict(zip(('router', 'ip_address', *STATE_COLUMNS[1:], 'valid_from', 'valid_to'), (router, format_ipv4(ip), *rest)))
+            history.append(entry)
+        return history
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(sep=' ', timespec='seconds') if timestamp else 'now'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the device history database")
+    parser.add_argument("database", help="Path to the history database (HISTORY_DB)")
+    parser.add_argument("kind", choices=("ip", "mac"), help="Look up which MACs held an IP, or one MAC's history")
+    parser.add_argument("value", help="IPv4 or MAC address")
+    parser.add_argument("--since", help="ISO date/time, default: the beginning")
+    parser.add_argument("--until", help="ISO date/time, default: now")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.database, retention_days=None)
+    started = time.perf_counter()
+    if args.kind == "ip":
+        rows = store.macs_for_ip(args.value, args.since, args.until)
+        for row in rows:
+            print(f"[{row['router']}] {row['mac_address']}\t{format_time(row['first_seen'])} -> {format_time(row['last_seen'])}")
+    else:
+        for row in store.seen_range(args.value):
+            print(f"[{row['router']}] first seen {format_time(row['first_seen'])}, last seen {format_time(row['last_seen'])}")
+        rows = store.device_history(args.value, args.since, args.until)
+        for row in rows:
+            print(
+                f"[{row['router']}] {format_time(row['valid_from'])} -> {format_time(row['valid_to'])}\t"
+                f"{row['ip_address']}\t{row['hostname']}\t{row['dhcp_status']}/{row['arp_status']}\t"
+                f"{row['bridge']}:{row['bridge_interface']}"
+            )
+    print(f"{len(rows)} row(s) in {(time.perf_counter() - started) * 1000:.1f}ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Inventory HTTP API Module
+Serves the daemon's latest merged inventory over a small asyncio HTTP/1.1 server, so dashboards and
+scripts can look devices up without triggering router polls of their own
+
+write() builds an immutable DeviceIndex on the poll thread and swaps it in; requests only read the
+current index, so a lookup never waits on a poll. Responses carry an ETag derived from the inventory
+content and the request, and a matching If-None-Match is answered with an empty 304
+
+Routes (GET or HEAD):
+    /                        device count, last update and inventory ETag
+    /devices                 paginated listing (limit, offset) with optional filters:
+                             router, mac, ip, hostname, interface, bridge_port, dhcp_server (exact, case-insensitive),
+                             subnet (CIDR), hostname_prefix, mac_prefix
+    /devices/<MAC or IP>     every device (one per router) with that MAC or IP address
+"""
+
+from urllib.parse import urlsplit, parse_qs, unquote
+from http import HTTPStatus
+from bisect import bisect_left, bisect_right
+from sinks import OutputSink, device_rows
+from mikrotik.parse import parse_ipv4
+import logging as log
+import ipaddress
+import threading
+import hashlib
+import asyncio
+import json
+import time
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 30.0
+# Rendered responses kept per index; repeated dashboard queries are answered from here
+RESPONSE_CACHE_SIZE = 256
+
+# Query parameter => merged device field with an exact-match index
+EXACT_FILTERS = {
+    'router': 'router',
+    'mac': 'mac_address',
+    'ip': 'ip_address',
+    'hostname': 'hostname',
+    'interface': 'interface',
+    'bridge_port': 'bridge_interface',
+    'dhcp_server': 'dhcp_server',
+}
+
+
+class QueryError(ValueError):
+    """A request the index cannot answer; reported to the client as 400"""
+
+
+def normalize_mac(value):
+    return value.strip().upper().replace('-', ':')
+
+
+def etag_of(*parts):
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
+
+
+class DeviceIndex:
+    """
+    One inventory, merged and serialized once, with secondary indexes
+        records   merged device dicts sorted by IP address
+        encoded   the same records as compact JSON bytes, so responses are joined instead of re-serialized
+        by_field  field => lower-cased value => record positions
+        ip_keys   packed IPv4 of each record (sorted), for subnet ranges
+        hostnames / macs  sorted (value, position) pairs, for prefix ranges
+    """
+    def __init__(self, inventory=None, updated_at=None):
+        records = []
+        for device_info in device_rows(inventory or {}):
+            # The poll time is carried by the index, so an unchanged inventory keeps its ETag
+            device_info.pop('polled_at', None)
+            records.append((parse_ipv4(device_info['ip_address']), device_info['router'] or '', device_info))
+        records.sort(key=lambda record: record[:2])
+
+        self.updated_at = updated_at
+        self.ip_keys = [ip for ip, _, _ in records]
+        self.records = [device_info for _, _, device_info in records]
+        self.encoded = [json.dumps(device_info, separators=(',', ':'), default=str).encode() for device_info in self.records]
+        self.etag = etag_of(b'\n'.join(self.encoded))
+
+        self.by_field = {field: {} for field in EXACT_FILTERS.values()}
+        for position, device_info in enumerate(self.records):
+            for field, index in self.by_field.items():
+                index.setdefault(str(device_info[field]).lower(), []).append(position)
+        self.hostnames = sorted((device_info['hostname'].lower(), position) for position, device_info in enumerate(self.records))
+        self.macs = sorted((device_info['mac_address'], position) for position, device_info in enumerate(self.records))
+        # target => (status, etag, body); only ever touched from the server's event loop
+        self.responses = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def _prefix_range(pairs, prefix):
+        start = bisect_left(pairs, (prefix,))
+        end = bisect_left(pairs, (prefix + '\uffff',))
+        return {position for _, position in pairs[start:end]}
+
+    def select(self, params):
+        """
+        Args:
+            params (dict): Query parameter => value, see the module docstring
+        Returns:
+            list: Matching record positions in IP address order
+        """
+        matches = None
+
+        def narrow(positions):
+            nonlocal matches
+            matches = set(positions) if matches is None else matches.intersection(positions)
+
+        for name, field in EXACT_FILTERS.items():
+            if name in params:
+                value = normalize_mac(params[name]) if name == 'mac' else params[name].strip()
+                narrow(self.by_field[field].get(value.lower(), ()))
+        if 'subnet' in params:
+            try:
+                network = ipaddress.IPv4Network(params['subnet'].strip(), strict=False)
+            except ValueError as e:
+                raise QueryError(f"Invalid subnet: {e}")
+            start = bisect_left(self.ip_keys, int(network.network_address))
+            end = bisect_right(self.ip_keys, int(network.broadcast_address))
+            narrow(range(start, end))
+        if 'hostname_prefix' in params:
+            narrow(self._prefix_range(self.hostnames, params['hostname_prefix'].strip().lower()))
+        if 'mac_prefix' in params:
+            narrow(self._prefix_range(self.macs, normalize_mac(params['mac_prefix'])))
+
+        if matches is None:
+            return range(len(self.records))
+        return sorted(matches)
+
+    def lookup(self, key):
+        """Positions of the devices with this IP or MAC address"""
+        key = unquote(key).strip()
+        if ':' not in key and '-' not in key:
+            return self.by_field['ip_address'].get(key, [])
+        return self.by_field['mac_address'].get(normalize_mac(key).lower(), [])
+
+    def body(self, positions, **fields):
+        """JSON object with `fields` plus a devices array spliced from the pre-encoded records"""
+        head = json.dumps(fields, separators=(',', ':'))[:-1].encode()
+        return b''.join((head, b',"devices":[' if fields else b'"devices":[', b','.join(self.encoded[position] for position in positions), b']}'))
+
+
+class InventoryAPI(OutputSink):
+    """Output sink that serves the latest inventory over HTTP; see the module docstring for routes"""
+    DAEMON_ONLY = True
+
+    def __init__(self, port=80, host='0.0.0.0'):
+        log.debug("InventoryAPI.__init__(%s) on %s:%s", self, host, port)
+        self.index = DeviceIndex()
+        self.loop = asyncio.new_event_loop()
+        # Bind here so a busy port fails at startup like the other sinks
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, int(port)))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="inventory-api", daemon=True)
+        self.thread.start()
+        log.info("[API] Serving the device inventory on http://%s:%s/devices", host, self.server.sockets[0].getsockname()[1])
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    def write(self, inventory):
+        index = DeviceIndex(inventory, updated_at=time.time())
+        # A single reference swap; requests in flight keep the index they started with
+        self.index = index
+        log.debug("InventoryAPI.write(%s) indexed %s devices, ETag %s", self, len(index), index.etag)
+
+    def close(self):
+        log.debug("InventoryAPI.close(%s)", self)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    def respond(self, method, target, headers):
+        """
+        Returns:
+            tuple: (status, extra headers, body bytes)
+        """
+        if method not in ('GET', 'HEAD'):
+            return self.error(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported", Allow='GET, HEAD')
+
+        index = self.index
+        cached = index.responses.get(target)
+        if cached is None:
+            try:
+                cached = self.render(index, target)
+            except QueryError as e:
+                return self.error(HTTPStatus.BAD_REQUEST, str(e))
+            if len(index.responses) >= RESPONSE_CACHE_SIZE:
+                index.responses.clear()
+            index.responses[target] = cached
+
+        status, etag, body = cached
+        extra = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if status == HTTPStatus.OK and etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+            return HTTPStatus.NOT_MODIFIED, extra, b''
+        return status, extra, body
+
+    def render(self, index, target):
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if path == '/':
+            # The only response that changes with every poll, even when the devices did not
+            body = json.dumps({'devices': len(index), 'updated_at': index.updated_at, 'etag': index.etag}).encode()
+            return HTTPStatus.OK, etag_of(index.etag, index.updated_at, target), body
+        elif path == '/devices':
+            try:
+                limit = min(int(params.pop('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+                offset = max(int(params.pop('offset', 0)), 0)
+            except ValueError:
+                raise QueryError("limit and offset must be integers")
+            if limit < 1:
+                raise QueryError("limit must be at least 1")
+            positions = index.select(params)
+            page = positions[offset:offset + limit]
+            next_offset = offset + limit if offset + limit < len(positions) else None
+            body = index.body(page, total=len(positions), offset=offset, limit=limit, next_offset=next_offset)
+        elif path.startswith('/devices/'):
+            positions = index.lookup(path[len('/devices/'):])
+            if not positions:
+                return HTTPStatus.NOT_FOUND, etag_of(index.etag, target), json.dumps({'error': "No such device"}).encode()
+            body = index.body(positions)
+        else:
+            return HTTPStatus.NOT_FOUND, etag_of(index.etag, target), json.dumps({'error': f"No route for {path}"}).encode()
+        return HTTPStatus.OK, etag_of(index.etag, target), body
+
+    @staticmethod
+    def error(status, message, **headers):
+        return status, headers, json.dumps({'error': message}).encode()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                request = lines[0].split(' ')
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+
+                if len(request) != 3:
+                    status, extra, body = self.error(HTTPStatus.BAD_REQUEST, "Malformed request line")
+                    method, version = 'GET', 'HTTP/1.0'
+                else:
+                    method, target, version = request
+                    # No route takes a body; read past one so the next request on the connection parses
+                    if headers.get('content-length', '0').isdigit() and int(headers.get('content-length', '0')):
+                        await reader.readexactly(int(headers['content-length']))
+                    status, extra, body = self.respond(method, target, headers)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                response = [f"HTTP/1.1 {status.value} {status.phrase}"]
+                if status != HTTPStatus.NOT_MODIFIED:
+                    response.append("Content-Type: application/json")
+                    response.append(f"Content-Length: {len(body)}")
+                response.extend(f"{name}: {value}" for name, value in extra.items())
+                response.append("Connection: keep-alive" if keep_alive else "Connection: close")
+                writer.write(('\r\n'.join(response) + '\r\n\r\n').encode('latin-1'))
+                if method != 'HEAD':
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            log.debug("[API] Connection dropped: %s", str(e))
+        except Exception as e:
+            log.error("[API] Error handling request: %s", str(e))
+        finally:
+            writer.close()
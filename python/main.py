@@ -1,15 +1,18 @@
 from os import environ as osEnviron
-import platform
-import socket
+import os
 import logging as log
-from pathlib import Path
+import argparse
 from network import main as network
+from network import run_daemon
+from sinks import create_sinks
 
 ################
 ## Executions ##
 ################
 
 def main():
+    args = parse_args()
+
     # Set the logging level for python
     LOG_LOCATION = str(osEnviron.get("LOG_LOCATION", ""))
     LOG_LEVEL = str(osEnviron.get("LOG_LEVEL", "INFO")).upper()
@@ -17,6 +20,7 @@ def main():
     log.root.handlers = []
     basicConfigHandler = [log.StreamHandler()]
     if LOG_LOCATION:
+        from pathlib import Path
         logLocationPath = Path(LOG_LOCATION)
         logLocationPath.parent.absolute().mkdir(
             parents=True, 
@@ -38,26 +42,273 @@ def main():
     system_info()
     log.info('[SCRIPT] Completed Environmental Setup!')
 
-    network()
+    sinks = create_sinks(args.output, daemon=args.daemon)
+    history = None
+    if args.history:
+        # sqlite3 is only imported when history is kept
+        from history import HistoryStore
+        history = HistoryStore(args.history, retention_days=args.history_retention)
+    notifier = None
+    if args.notify:
+        # Only imported when alerts are configured
+        from notify import create_dispatcher
+        notifier = create_dispatcher(args.notify, known_macs_path=args.known_macs, window=args.notify_window, ttl=args.notify_ttl)
+
+    prober = None
+    if args.probe:
+        from mikrotik.probe import prober_factory
+        prober = prober_factory(args.probe, concurrency=args.probe_concurrency, timeout=args.probe_timeout, interval=args.probe_interval)
+
+    enricher = None
+    if args.enrich:
+        # Only imported when enrichment is on
+        from enrich import create_enricher
+        enricher = create_enricher(args.enrich, oui_file=args.oui_file, dns_server=args.dns_server)
+
+    traffic = None
+    if args.traffic:
+        if args.daemon:
+            from mikrotik.traffic import traffic_factory
+            traffic = traffic_factory(samples=args.traffic_samples, interval=args.traffic_interval, window=args.traffic_window)
+        else:
+            log.warning("[SCRIPT] Traffic rates need two samples, they are only collected in daemon mode, ignoring --traffic")
+
+    checkpoint = None
+    if args.checkpoint:
+        if args.daemon:
+            from checkpoint import CheckpointStore
+            checkpoint = CheckpointStore(args.checkpoint, interval=args.checkpoint_interval)
+        else:
+            log.warning("[SCRIPT] Checkpoints only apply in daemon mode, ignoring --checkpoint")
+
+    if args.daemon:
+        run_daemon(
+            args.interval,
+            max_backoff=args.max_backoff,
+            listen=args.listen,
+            max_workers=args.max_workers,
+            timeout=args.timeout,
+            sinks=sinks,
+            report=args.report,
+            history=history,
+            profile_dir=args.profile_dir,
+            adaptive=(args.min_interval, args.max_interval) if args.adaptive else None,
+            notifier=notifier,
+            checkpoint=checkpoint,
+            prober=prober,
+            enricher=enricher,
+            traffic=traffic
+        )
+    else:
+        network(max_workers=args.max_workers, timeout=args.timeout, sinks=sinks, report=args.report, history=history, profile_dir=args.profile_dir, notifier=notifier, prober=prober, enricher=enricher)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MikroTik router LAN monitoring utility")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=str(osEnviron.get("DAEMON_MODE", "")).upper() == "TRUE",
+        help="Keep the router connection open and poll on a fixed interval"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=float(osEnviron.get("POLL_INTERVAL", 60)),
+        help="Seconds between polls in daemon mode (default: POLL_INTERVAL or 60)"
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        default=str(osEnviron.get("ADAPTIVE_POLLING", "")).upper() == "TRUE",
+        help="In daemon mode, poll each table faster while it churns and slower while it is quiet, within --min-interval/--max-interval"
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=float(osEnviron.get("POLL_INTERVAL_MIN", 10)),
+        help="Shortest adaptive poll interval in seconds (default: POLL_INTERVAL_MIN or 10)"
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=float(osEnviron.get("POLL_INTERVAL_MAX", 600)),
+        help="Longest adaptive poll interval in seconds (default: POLL_INTERVAL_MAX or 600)"
+    )
+    parser.add_argument(
+        "--listen",
+        action="store_true",
+        default=str(osEnviron.get("LISTEN_MODE", "")).upper() == "TRUE",
+        help="In daemon mode, stream table changes with RouterOS listen instead of polling"
+    )
+    parser.add_argument(
+        "--max-backoff",
+        type=float,
+        default=float(osEnviron.get("RECONNECT_MAX_BACKOFF", 60)),
+        help="Upper bound in seconds for the reconnect backoff in daemon mode"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=int(osEnviron.get("MAX_WORKERS", 8)),
+        help="Maximum number of routers queried at the same time (default: MAX_WORKERS or 8)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=float(osEnviron["POLL_TIMEOUT"]) if osEnviron.get("POLL_TIMEOUT") else None,
+        help="Seconds to wait for all routers in one poll before moving on without the stragglers"
+    )
+    parser.add_argument(
+        "--output",
+        action="append",
+        default=[spec for spec in str(osEnviron.get("OUTPUT_SINKS", "")).split(",") if spec.strip()],
+        help="Structured output sink, repeatable: ndjson[:PATH], csv[:PATH], prometheus[:[HOST:]PORT] or api[:[HOST:]PORT] (PATH '-' is stdout)"
+    )
+    parser.add_argument(
+        "--no-report",
+        dest="report",
+        action="store_false",
+        default=str(osEnviron.get("DEVICE_REPORT", "TRUE")).upper() != "FALSE",
+        help="Skip the per-device log report, e.g. when an output sink already has the inventory"
+    )
+    parser.add_argument(
+        "--history",
+        default=osEnviron.get("HISTORY_DB") or None,
+        help="SQLite database that keeps every device state change, see python/history.py for queries"
+    )
+    parser.add_argument(
+        "--history-retention",
+        type=float,
+        default=float(osEnviron.get("HISTORY_RETENTION_DAYS", 180)),
+        help="Days of closed device history to keep, 0 keeps everything (default: HISTORY_RETENTION_DAYS or 180)"
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=osEnviron.get("PROFILE_DIR") or None,
+        help="Capture cProfile/tracemalloc output here: for the single pass, or on SIGUSR1 in daemon mode"
+    )
+    parser.add_argument(
+        "--notify",
+        action="append",
+        default=[spec for spec in str(osEnviron.get("NOTIFY_TARGETS", "")).split(",") if spec.strip()],
+        help="Alert target, repeatable: webhook:URL (or a bare http(s) URL), unix:SOCKET_PATH or spool:DIRECTORY, see python/notify.py"
+    )
+    parser.add_argument(
+        "--known-macs",
+        default=osEnviron.get("KNOWN_MACS_FILE") or None,
+        help="File of known MAC addresses, one per line; others joining raise an unknown_device alert"
+    )
+    parser.add_argument(
+        "--notify-window",
+        type=float,
+        default=float(osEnviron.get("NOTIFY_WINDOW", 10)),
+        help="Seconds alerts are coalesced into one delivery (default: NOTIFY_WINDOW or 10)"
+    )
+    parser.add_argument(
+        "--notify-ttl",
+        type=float,
+        default=float(osEnviron.get("NOTIFY_DEDUP_TTL", 3600)),
+        help="Seconds an alert suppresses identical ones for the same device (default: NOTIFY_DEDUP_TTL or 3600)"
+    )
+    parser.add_argument(
+        "--probe",
+        choices=("router", "local"),
+        default=osEnviron.get("PROBE_MODE") or None,
+        help="Actively check every device answers after each poll: 'router' pings from the router, 'local' probes from this host (ICMP, else TCP)"
+    )
+    parser.add_argument(
+        "--probe-interval",
+        type=float,
+        default=float(osEnviron.get("PROBE_INTERVAL", 0)),
+        help="Least seconds between probe rounds, polls in between keep the last results (default: PROBE_INTERVAL or 0, every poll)"
+    )
+    parser.add_argument(
+        "--probe-timeout",
+        type=float,
+        default=float(osEnviron.get("PROBE_TIMEOUT", 1)),
+        help="Seconds to wait for each host to answer (default: PROBE_TIMEOUT or 1)"
+    )
+    parser.add_argument(
+        "--probe-concurrency",
+        type=int,
+        default=int(osEnviron.get("PROBE_CONCURRENCY", 128)),
+        help="Hosts probed at the same time per router (default: PROBE_CONCURRENCY or 128)"
+    )
+    parser.add_argument(
+        "--enrich",
+        action="append",
+        default=[spec for spec in str(osEnviron.get("ENRICH", "")).split(",") if spec.strip()],
+        help="Add to every device: 'vendor' from the IEEE OUI registry and/or 'dns' reverse lookups, repeatable or comma separated"
+    )
+    parser.add_argument(
+        "--oui-file",
+        default=osEnviron.get("OUI_FILE") or "configuration/oui.csv",
+        help="IEEE OUI registry CSV for vendor lookups, fetch it with `python python/enrich.py update-oui` (default: OUI_FILE or configuration/oui.csv)"
+    )
+    parser.add_argument(
+        "--dns-server",
+        default=osEnviron.get("DNS_SERVER") or None,
+        help="HOST[:PORT] answering reverse lookups (default: DNS_SERVER or the first nameserver in /etc/resolv.conf)"
+    )
+    parser.add_argument(
+        "--traffic",
+        action="store_true",
+        default=str(osEnviron.get("TRAFFIC", "")).upper() == "TRUE",
+        help="In daemon mode, sample /interface counters with each poll and add each device's port rates"
+    )
+    parser.add_argument(
+        "--traffic-interval",
+        type=float,
+        default=float(osEnviron.get("TRAFFIC_INTERVAL", 0)),
+        help="Least seconds between counter samples (default: TRAFFIC_INTERVAL or 0, every poll)"
+    )
+    parser.add_argument(
+        "--traffic-samples",
+        type=int,
+        default=int(osEnviron.get("TRAFFIC_SAMPLES", 720)),
+        help="Rates kept per interface and counter, older ones are overwritten (default: TRAFFIC_SAMPLES or 720)"
+    )
+    parser.add_argument(
+        "--traffic-window",
+        type=float,
+        default=float(osEnviron.get("TRAFFIC_WINDOW", 3600)),
+        help="Seconds the p95 rate gauges cover (default: TRAFFIC_WINDOW or 3600)"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=osEnviron.get("CHECKPOINT_FILE") or None,
+        help="In daemon mode, file the known devices are saved to and restored from across restarts"
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=float,
+        default=float(osEnviron.get("CHECKPOINT_INTERVAL", 300)),
+        help="Seconds between checkpoint saves, 0 only saves on shutdown (default: CHECKPOINT_INTERVAL or 300)"
+    )
+    return parser.parse_args()
 
 
 
 
 def system_info():
     try:
+        # os.uname() is one system call; platform.processor() can shell out to `uname -p`, which on Linux
+        # reports the machine type anyway
+        uname = os.uname()
         sys_info = {}
-        sys_info.update(Platform = platform.system())
-        sys_info.update(Platform_release = platform.release())
-        sys_info.update(Platform_version = platform.version())
-        sys_info.update(Architecture = platform.machine())
-        sys_info.update(Hostname = socket.gethostname())
-        sys_info.update(Processor = platform.processor())
-        log.info(f'[PY_ENV] System Information:')
+        sys_info.update(Platform = uname.sysname)
+        sys_info.update(Platform_release = uname.release)
+        sys_info.update(Platform_version = uname.version)
+        sys_info.update(Architecture = uname.machine)
+        sys_info.update(Hostname = uname.nodename)
+        sys_info.update(Processor = uname.machine)
+        log.info("[PY_ENV] System Information:")
         for key, value in sys_info.items():
-            log.info(f'[PY_ENV] >>\t{key}: {value}')
+            log.info("[PY_ENV] >>\t%s: %s", key, value)
         return sys_info
     except Exception as e:
-        log.error(f'{e}')
+        log.error("%s", e)
         exit(1)
 
 
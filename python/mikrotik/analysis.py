@@ -0,0 +1,204 @@
+"""
+MikroTik Snapshot Analysis Module
+Cross-device checks run once per snapshot over flat integer columns instead of device by device
+
+Each table is reduced to parallel array() columns of packed integers (MAC, IPv4, port id). The checks
+are whole-column operations (element-wise compare, count-by-key, sort) pushed down to C by
+map/compress/Counter/sorted, so Python only loops over the rows that turn out to be anomalous
+"""
+
+from .parse import parse_mac, format_mac, parse_ipv4, format_ipv4
+from .network_device import NetworkDevice
+from collections import Counter
+from itertools import compress
+from operator import ne, attrgetter
+from array import array
+import logging as log
+
+MAC_BITS = 48
+MAC_MASK = (1 << MAC_BITS) - 1
+
+
+class Anomaly:
+    # Same IP address held by more than one MAC address (DHCP or ARP)
+    DUPLICATE_IP = 'duplicate_ip'
+    # Same MAC address learned on more than one bridge port
+    MAC_ON_MULTIPLE_PORTS = 'mac_on_multiple_ports'
+    # ARP entry for a MAC address with no DHCP lease (static address or a spoofer)
+    ARP_WITHOUT_LEASE = 'arp_without_lease'
+    # A device's lease and ARP entry disagree on its IP address
+    IP_MISMATCH = 'ip_mismatch'
+
+    __slots__ = ('kind', 'router', 'subject', 'details')
+
+    def __init__(self, kind, subject, details=None, router=None):
+        self.kind = kind
+        self.router = router
+        # The IP or MAC address the anomaly is about
+        self.subject = subject
+        self.details = details or {}
+
+    def key(self):
+        """Identity used to tell a new anomaly from one that was already reported"""
+        return (self.router, self.kind, self.subject)
+
+    def to_dict(self):
+        return {'anomaly': self.kind, 'router': self.router, 'subject': self.subject, **self.details}
+
+    def __repr__(self):
+        prefix = f"[{self.router}] " if self.router else ""
+        details = ", ".join(f"{key}: {value}" for key, value in self.details.items())
+        return f"{prefix}{self.kind} {self.subject}" + (f" ({details})" if details else "")
+
+
+class SnapshotColumns:
+    """
+    Flat columns for one snapshot, one entry per device (lease) plus one per ARP-only MAC
+        mac          array('Q')  48-bit MAC
+        dhcp_ip      array('q')  packed IPv4 from the lease, -1 if none
+        arp_ip       array('q')  packed IPv4 from ARP, -1 if none
+    Bridge ports are kept as packed (port id << 48 | MAC) keys for every non-local bridge host row
+    """
+    def __init__(self):
+        self.mac = array('Q')
+        self.dhcp_ip = array('q')
+        self.arp_ip = array('q')
+        self.port_keys = array('Q')
+        self.port_names = []
+        # Entries [0, device_count) are these NetworkDevice objects, the rest are ARP-only MACs
+        self.devices = []
+        self.device_count = 0
+
+    def __len__(self):
+        return len(self.mac)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, devices_dict):
+        columns = cls()
+        # Devices already hold parsed integers, so most rows cost a few attribute reads
+        devices = [device for device in devices_dict.values() if device.dhcp_mac_address is not None]
+        columns.mac = array('Q', map(attrgetter('dhcp_mac_address'), devices))
+        columns.dhcp_ip = array('q', [-1 if ip is None else ip for ip in map(attrgetter('dhcp_address'), devices)])
+        columns.arp_ip = array('q', [-1 if ip is None else ip for ip in map(attrgetter('arp_address'), devices)])
+        columns.devices = devices
+        columns.device_count = len(devices)
+
+        # ARP-only MACs are the only rows still to parse
+        for mac_address in snapshot.arp.by_mac.keys() - snapshot.leases.by_mac.keys():
+            mac = parse_mac(mac_address)
+            ip = parse_ipv4(snapshot.arp.get(mac_address).get('address'))
+            if mac is not None:
+                columns.mac.append(mac)
+                columns.dhcp_ip.append(-1)
+                columns.arp_ip.append(-1 if ip is None else ip)
+
+        port_ids = {}
+        port_keys = []
+        for mac_address, rows in snapshot.bridge_hosts.by_mac.items():
+            if len(rows) < 2:
+                # A single row cannot be on several ports; skip parsing it
+                continue
+            mac = parse_mac(mac_address)
+            if mac is None:
+                continue
+            for row in rows.values():
+                if row.get('local') == 'true':
+                    continue
+                port = (row.get('bridge'), row.get('interface'))
+                port_id = port_ids.setdefault(port, len(port_ids))
+                port_keys.append(port_id << MAC_BITS | mac)
+        columns.port_keys = array('Q', port_keys)
+        columns.port_names = list(port_ids)
+        return columns
+
+
+def find_ip_mismatches(columns):
+    """(row index, lease IP, ARP IP) for devices whose lease and ARP entry carry different addresses"""
+    differs = list(map(ne, columns.dhcp_ip, columns.arp_ip))
+    return [
+        (index, dhcp_ip, arp_ip)
+        for index, dhcp_ip, arp_ip in zip(
+            compress(range(len(columns)), differs),
+            compress(columns.dhcp_ip, differs),
+            compress(columns.arp_ip, differs)
+        )
+        if dhcp_ip >= 0 and arp_ip >= 0
+    ]
+
+
+def find_duplicate_ips(columns):
+    """
+    (IP, sorted MACs) for every IP claimed by more than one MAC across leases and ARP
+    A MAC whose lease and ARP entry agree is counted once for that IP
+    """
+    arp_differs = list(map(ne, columns.arp_ip, columns.dhcp_ip))
+    counts = Counter(columns.dhcp_ip)
+    counts.update(compress(columns.arp_ip, arp_differs))
+    counts.pop(-1, None)
+    duplicated = {ip for ip, count in counts.items() if count > 1}
+    if not duplicated:
+        return []
+
+    holders = {}
+    for ips in (columns.dhcp_ip, columns.arp_ip):
+        hits = list(map(duplicated.__contains__, ips))
+        for ip, mac in zip(compress(ips, hits), compress(columns.mac, hits)):
+            holders.setdefault(ip, set()).add(mac)
+    return [(ip, sorted(macs)) for ip, macs in sorted(holders.items()) if len(macs) > 1]
+
+
+def find_multi_port_macs(columns):
+    """(MAC, port ids) for every MAC learned on more than one (bridge, port)"""
+    # Unique (MAC, port) pairs sorted by MAC, so each MAC's ports are adjacent
+    keys = sorted({(key & MAC_MASK) << 16 | key >> MAC_BITS for key in columns.port_keys})
+    by_mac = {}
+    for key in keys:
+        by_mac.setdefault(key >> 16, []).append(key & 0xFFFF)
+    return [(mac, ports) for mac, ports in by_mac.items() if len(ports) > 1]
+
+
+def analyze_snapshot(snapshot, devices_dict):
+    """
+    Run every cross-device check over one snapshot and record IP mismatches on the devices themselves
+    Args:
+        snapshot (RouterSnapshot): Fetched tables (for ARP-only and duplicate bridge rows)
+        devices_dict (dict): MAC => NetworkDevice built from the same snapshot
+    Returns:
+        list: Anomaly objects
+    """
+    log.debug("analyze_snapshot(%s) with %s devices", snapshot, len(devices_dict))
+    router = snapshot.router
+    columns = SnapshotColumns.from_snapshot(snapshot, devices_dict)
+    anomalies = []
+
+    # Every device gets its verdict here, so none has to re-check itself
+    NetworkDevice.mark_conflicts_checked(devices_dict.values())
+    for index, dhcp_ip, arp_ip in find_ip_mismatches(columns):
+        details = {'dhcp_ip': format_ipv4(dhcp_ip), 'arp_ip': format_ipv4(arp_ip)}
+        columns.devices[index].set_conflicts({'ip_mismatch': details})
+        anomalies.append(Anomaly(Anomaly.IP_MISMATCH, format_mac(columns.mac[index]), details, router=router))
+
+    for ip, macs in find_duplicate_ips(columns):
+        anomalies.append(Anomaly(
+            Anomaly.DUPLICATE_IP,
+            format_ipv4(ip),
+            {'mac_addresses': [format_mac(mac) for mac in macs]},
+            router=router
+        ))
+
+    for mac, ports in find_multi_port_macs(columns):
+        anomalies.append(Anomaly(
+            Anomaly.MAC_ON_MULTIPLE_PORTS,
+            format_mac(mac),
+            {'ports': [f"{columns.port_names[port][0]}:{columns.port_names[port][1]}" for port in ports]},
+            router=router
+        ))
+
+    for index in range(columns.device_count, len(columns)):
+        anomalies.append(Anomaly(
+            Anomaly.ARP_WITHOUT_LEASE,
+            format_mac(columns.mac[index]),
+            {'arp_ip': format_ipv4(columns.arp_ip[index]) if columns.arp_ip[index] >= 0 else None},
+            router=router
+        ))
+    return anomalies
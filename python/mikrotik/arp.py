@@ -1,76 +1,106 @@
-import json
 import logging as log
 from mikrotik.exceptions import *
-from .login import RouterLogin
+from mikrotik.log_format import LazyJson
+from .pool import connection_pool
+from .pipeline import stream_rows
 
 class ARPManager:
-    def __init__(self, connection=None):
-        log.debug(f"ARPManager.__init__({self})")
-        self.router = RouterLogin()
+    RESOURCE_PATH = '/ip/arp'
+
+    def __init__(self, connection=None, pool=None):
+        log.debug("ARPManager.__init__(%s)", self)
+        # Without a shared connection a session is borrowed from the router's pool; a shared connection reads no router config
+        self.pool = None if connection else (pool or connection_pool())
+        self.session = None
         self.connection = connection
 
     def connect(self):
-        log.debug(f"ARPManager.connect({self})")
+        log.debug("ARPManager.connect(%s)", self)
         if not self.connection:
-            self.connection = self.router.connect()
+            self.session = self.pool.acquire()
+            self.connection = self.session.connection
         if not self.connection:
             raise RouterConnectionError("Failed to connect to router for ARP entries")
         return self.connection is not None
 
     def disconnect(self):
-        log.debug(f"ARPManager.disconnect({self})")
-        self.router.disconnect()
+        log.debug("ARPManager.disconnect(%s)", self)
+        # Returns a borrowed session; a shared connection belongs to whoever passed it in
+        if self.session:
+            self.pool.release(self.session)
+            self.session = None
+            self.connection = None
 
-    def get_arp_entries(self):
-        log.debug(f"ARPManager.get_arp_entries({self})")
+    def iter_arp_entries(self, fields=None, filters=None):
+        """
+        Stream rows as the router sends them, each decoded on arrival, without holding the whole table
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'interface': 'bridge'}
+        Yields:
+            dict: ARP entry
+        Raises:
+            RouterConnectionError: No session could be had, or the router refused the print
+        """
+        log.debug("ARPManager.iter_arp_entries(%s) fields: %s filters: %s", self, fields, filters)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
-            if not self.connect():
-                return []
+            self.connect()
 
+        log.debug("Querying router for /ip/arp resource")
+        yield from stream_rows(self.connection, self.RESOURCE_PATH, {'.proplist': ','.join(fields)} if fields else None, filters)
+
+    def get_arp_entries(self, fields=None, filters=None):
+        """
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'interface': 'bridge'}
+        Returns:
+            list: ARP entries
+        """
+        log.debug("ARPManager.get_arp_entries(%s) fields: %s filters: %s", self, fields, filters)
         try:
-            log.debug("Querying router for /ip/arp resource")
-            arp = self.connection.get_resource('/ip/arp')
-            log.debug(f"Successfully retrieved ARP entries: {json.dumps(arp, indent=2)}")
-            return arp.get()
+            result = list(self.iter_arp_entries(fields, filters))
+            log.debug("Successfully retrieved %s ARP entries", len(result))
+            return result
         except Exception as e:
-            log.error(f"Error getting ARP entries: {str(e)}")
+            log.error("Error getting ARP entries: %s", str(e))
             return []
 
     def get_arp_by_mac(self, mac_address):
-        log.debug(f"ARPManager.get_arp_by_mac({self}, {mac_address})")
+        log.debug("ARPManager.get_arp_by_mac(%s, %s)", self, mac_address)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
                 return None
             
         try:
-            log.debug(f"Querying router for /ip/arp resource")
+            log.debug("Querying router for /ip/arp resource")
             arp = self.connection.get_resource('/ip/arp')
-            log.debug(f"Executing ARP query for MAC: {mac_address}")
+            log.debug("Executing ARP query for MAC: %s", mac_address)
             result = arp.get(mac_address=mac_address)
-            log.debug(f"ARP query result for MAC {mac_address}: {json.dumps(result, indent=2)}")
+            log.debug("ARP query result for MAC %s: %s", mac_address, LazyJson(result))
             return result[0] if result else None
         except Exception as e:
-            log.error(f"Error getting ARP entry for MAC {mac_address}: {str(e)}")
+            log.error("Error getting ARP entry for MAC %s: %s", mac_address, str(e))
             return None
 
     def get_arp_by_ip(self, ip_address):
-        log.debug(f"ARPManager.get_arp_by_ip({self}, {ip_address})")
+        log.debug("ARPManager.get_arp_by_ip(%s, %s)", self, ip_address)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
                 return None
 
         try:
-            log.debug(f"Querying router for /ip/arp resource")
+            log.debug("Querying router for /ip/arp resource")
             arp = self.connection.get_resource('/ip/arp')
-            log.debug(f"Executing ARP query for IP: {ip_address}")
+            log.debug("Executing ARP query for IP: %s", ip_address)
             result = arp.get(address=ip_address)
-            log.debug(f"ARP query result for IP {ip_address}: {json.dumps(result, indent=2)}")
+            log.debug("ARP query result for IP %s: %s", ip_address, LazyJson(result))
             return result[0] if result else None
         except Exception as e:
-            log.error(f"Error getting ARP entry for IP {ip_address}: {str(e)}")
+            log.error("Error getting ARP entry for IP %s: %s", ip_address, str(e))
             return None
         
 
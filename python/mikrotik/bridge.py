@@ -3,49 +3,74 @@ MikroTik Bridge Host Module
 Handles bridge host information queries
 """
 
-from .login import RouterLogin
+from .pool import connection_pool
+from .pipeline import stream_rows
 from mikrotik.exceptions import *
 import logging as log
-import json
+from mikrotik.log_format import LazyJson
 
 class BridgeHostManager:
-    def __init__(self, connection=None):
-        log.debug(f"BridgeHostManager.__init__({self})")
-        self.router = RouterLogin()
+    RESOURCE_PATH = '/interface/bridge/host'
+
+    def __init__(self, connection=None, pool=None):
+        log.debug("BridgeHostManager.__init__(%s)", self)
+        # Without a shared connection a session is borrowed from the router's pool; a shared connection reads no router config
+        self.pool = None if connection else (pool or connection_pool())
+        self.session = None
         self.connection = connection
 
     def connect(self):
-        log.debug(f"BridgeHostManager.connect({self})")
+        log.debug("BridgeHostManager.connect(%s)", self)
         if not self.connection:
-            self.connection = self.router.connect()
+            self.session = self.pool.acquire()
+            self.connection = self.session.connection
         if not self.connection:
             raise RouterConnectionError("Failed to connect to router for bridge host entries")
         return self.connection is not None
 
     def disconnect(self):
-        log.debug(f"BridgeHostManager.disconnect({self})")
-        self.router.disconnect()
+        log.debug("BridgeHostManager.disconnect(%s)", self)
+        # Returns a borrowed session; a shared connection belongs to whoever passed it in
+        if self.session:
+            self.pool.release(self.session)
+            self.session = None
+            self.connection = None
 
-    def get_all_bridge_hosts(self):
+    def iter_bridge_hosts(self, fields=None, filters=None):
         """
-        Get all bridge host entries from the router
-        Returns:
-            list: List of bridge host entries
+        Stream rows as the router sends them, each decoded on arrival, without holding the whole table
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'dynamic': 'true'}
+        Yields:
+            dict: Bridge host entry
+        Raises:
+            RouterConnectionError: No session could be had, or the router refused the print
         """
-        log.debug(f"BridgeHostManager.get_all_bridge_hosts({self})")
+        log.debug("BridgeHostManager.iter_bridge_hosts(%s) fields: %s filters: %s", self, fields, filters)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
-            if not self.connect():
-                return []
+            self.connect()
 
+        log.debug("Querying router for /interface/bridge/host resource")
+        yield from stream_rows(self.connection, self.RESOURCE_PATH, {'.proplist': ','.join(fields)} if fields else None, filters)
+
+    def get_all_bridge_hosts(self, fields=None, filters=None):
+        """
+        Get all bridge host entries from the router
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'dynamic': 'true'}
+        Returns:
+            list: List of bridge host entries
+        """
+        log.debug("BridgeHostManager.get_all_bridge_hosts(%s) fields: %s filters: %s", self, fields, filters)
         try:
-            log.debug("Querying router for /interface/bridge/host resource")
-            hosts = self.connection.get_resource('/interface/bridge/host')
-            result = hosts.get()
-            log.debug(f"Bridge hosts query result: {json.dumps(result, indent=2)}")
+            result = list(self.iter_bridge_hosts(fields, filters))
+            log.debug("Successfully retrieved %s bridge hosts", len(result))
             return result
         except Exception as e:
-            log.error(f"Error getting bridge hosts: {str(e)}")
+            log.error("Error getting bridge hosts: %s", str(e))
             return []
 
     def get_bridge_host_by_mac(self, mac_address):
@@ -56,7 +81,7 @@ class BridgeHostManager:
         Returns:
             dict: Bridge host entry if found, None otherwise
         """
-        log.debug(f"BridgeHostManager.get_bridge_host_by_mac({self}, {mac_address})")
+        log.debug("BridgeHostManager.get_bridge_host_by_mac(%s, %s)", self, mac_address)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
@@ -65,10 +90,10 @@ class BridgeHostManager:
         try:
             log.debug("Querying router for /interface/bridge/host resource")
             hosts = self.connection.get_resource('/interface/bridge/host')
-            log.debug(f"Executing bridge host query for MAC: {mac_address}")
+            log.debug("Executing bridge host query for MAC: %s", mac_address)
             result = hosts.get(mac_address=mac_address)
-            log.debug(f"Bridge host query result for MAC {mac_address}: {json.dumps(result, indent=2)}")
+            log.debug("Bridge host query result for MAC %s: %s", mac_address, LazyJson(result))
             return result[0] if result else None
         except Exception as e:
-            log.error(f"Error getting bridge host for MAC {mac_address}: {str(e)}")
+            log.error("Error getting bridge host for MAC %s: %s", mac_address, str(e))
             return None
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""
+MikroTik Device Change Module
+Diffs successive snapshots of NetworkDevice objects into a stream of change events
+"""
+
+from .parse import format_ipv4
+import logging as log
+import time
+
+
+class DeviceEvent:
+    JOINED = 'joined'
+    LEFT = 'left'
+    IP_CHANGED = 'ip_changed'
+    STATUS_CHANGED = 'status_changed'
+    BRIDGE_PORT_MOVED = 'bridge_port_moved'
+
+    def __init__(self, kind, mac_address, field=None, old=None, new=None, router=None):
+        self.kind = kind
+        self.router = router
+        self.mac_address = mac_address
+        self.field = field
+        self.old = old
+        self.new = new
+
+    def to_dict(self):
+        return {
+            'event': self.kind,
+            'router': self.router,
+            'mac_address': self.mac_address,
+            'field': self.field,
+            'old': self.old,
+            'new': self.new,
+        }
+
+    def __repr__(self):
+        prefix = f"[{self.router}] " if self.router else ""
+        if self.field:
+            return f"{prefix}{self.kind} {self.mac_address} {self.field}: {self.old} -> {self.new}"
+        return f"{prefix}{self.kind} {self.mac_address}"
+
+
+class DeviceChangeTracker:
+    # Order of the tuple returned by NetworkDevice.get_state()
+    STATE_FIELDS = ('ip_address', 'dhcp_status', 'arp_status', 'bridge', 'bridge_interface')
+    STATE_EVENTS = (
+        DeviceEvent.IP_CHANGED,
+        DeviceEvent.STATUS_CHANGED,
+        DeviceEvent.STATUS_CHANGED,
+        DeviceEvent.BRIDGE_PORT_MOVED,
+        DeviceEvent.BRIDGE_PORT_MOVED,
+    )
+
+    # get_state() keeps the address packed; events carry the dotted form
+    STATE_FORMATTERS = (format_ipv4, str, str, str, str)
+
+    def __init__(self, router=None):
+        log.debug("DeviceChangeTracker.__init__(%s)", self)
+        self.router = router
+        self.devices = {}
+        # MAC address => epoch seconds of the poll or update it was last seen in
+        self.seen = {}
+        # MAC address => get_state() tuple, compared directly so no change can hide behind a hash collision
+        self._states = {}
+
+    def has_baseline(self):
+        return bool(self._states)
+
+    def restore(self, devices_dict, seen=None):
+        """
+        Adopt devices from a previous run as the baseline, see checkpoint.py
+        Args:
+            devices_dict (dict): MAC address => NetworkDevice
+            seen (dict): MAC address => epoch seconds last seen
+        """
+        log.debug("DeviceChangeTracker.restore(%s) with %s devices", self, len(devices_dict))
+        self.devices = devices_dict
+        self.seen = dict(seen or {})
+        self._states = {mac_address: device.get_state() for mac_address, device in devices_dict.items()}
+
+    def update(self, devices_dict):
+        """
+        Diff a new snapshot against the previous one and keep it as the new baseline
+        Args:
+            devices_dict (dict): MAC address => NetworkDevice
+        Returns:
+            list: DeviceEvent objects, empty when nothing changed
+        """
+        log.debug("DeviceChangeTracker.update(%s) with %s devices", self, len(devices_dict))
+        events = []
+        states = {}
+
+        for mac_address, device in devices_dict.items():
+            state = device.get_state()
+            states[mac_address] = state
+
+            previous_state = self._states.get(mac_address)
+            if previous_state is None:
+                events.append(DeviceEvent(DeviceEvent.JOINED, mac_address, new=format_ipv4(state[0]), router=self.router))
+            elif previous_state != state:
+                events.extend(self._diff_state(mac_address, previous_state, state))
+
+        for mac_address, state in self._states.items():
+            if mac_address not in states:
+                events.append(DeviceEvent(DeviceEvent.LEFT, mac_address, old=format_ipv4(state[0]), router=self.router))
+
+        self.devices = devices_dict
+        self.seen = dict.fromkeys(devices_dict, time.time())
+        self._states = states
+        log.debug("DeviceChangeTracker.update(%s) produced %s events", self, len(events))
+        return events
+
+    def apply(self, changed_devices):
+        """
+        Fold a partial update into the baseline, e.g. devices rebuilt from a listen stream
+        Args:
+            changed_devices (dict): MAC address => NetworkDevice, or None if the device is gone
+        Returns:
+            list: DeviceEvent objects for the given MACs only
+        """
+        log.debug("DeviceChangeTracker.apply(%s) with %s devices", self, len(changed_devices))
+        events = []
+        for mac_address, device in changed_devices.items():
+            previous_state = self._states.get(mac_address)
+            if device is None:
+                if previous_state is not None:
+                    events.append(DeviceEvent(DeviceEvent.LEFT, mac_address, old=format_ipv4(previous_state[0]), router=self.router))
+                    del self._states[mac_address]
+                    self.devices.pop(mac_address, None)
+                    self.seen.pop(mac_address, None)
+                continue
+
+            state = device.get_state()
+            if previous_state is None:
+                events.append(DeviceEvent(DeviceEvent.JOINED, mac_address, new=format_ipv4(state[0]), router=self.router))
+            elif previous_state != state:
+                events.extend(self._diff_state(mac_address, previous_state, state))
+            self._states[mac_address] = state
+            self.devices[mac_address] = device
+            self.seen[mac_address] = time.time()
+        return events
+
+    def _diff_state(self, mac_address, old_state, new_state):
+        events = []
+        for index, field in enumerate(self.STATE_FIELDS):
+            if old_state[index] != new_state[index]:
+                format_value = self.STATE_FORMATTERS[index]
+                events.append(DeviceEvent(
+                    self.STATE_EVENTS[index],
+                    mac_address,
+                    field,
+                    format_value(old_state[index]),
+                    format_value(new_state[index]),
+                    router=self.router
+                ))
+        return events
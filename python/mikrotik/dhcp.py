@@ -1,45 +1,75 @@
 from datetime import datetime
-from .login import RouterLogin
+from .pool import connection_pool
+from .pipeline import stream_rows
 from mikrotik.exceptions import *
-import json
+from mikrotik.log_format import LazyJson
 import logging as log
 
 class DHCPLeaseManager:
-    def __init__(self, connection=None):
-        log.debug(f"DHCPLeaseManager.__init__({self})")
-        self.router = RouterLogin()
+    RESOURCE_PATH = '/ip/dhcp-server/lease'
+
+    def __init__(self, connection=None, pool=None):
+        log.debug("DHCPLeaseManager.__init__(%s)", self)
+        # Without a shared connection a session is borrowed from the router's pool; a shared connection reads no router config
+        self.pool = None if connection else (pool or connection_pool())
+        self.session = None
         self.connection = connection
 
     def connect(self):
-        log.debug(f"DHCPLeaseManager.connect({self})")
+        log.debug("DHCPLeaseManager.connect(%s)", self)
         if not self.connection:
-            self.connection = self.router.connect()
+            self.session = self.pool.acquire()
+            self.connection = self.session.connection
         if not self.connection:
             raise RouterConnectionError("Failed to connect to router for ARP entries")
         return self.connection is not None
 
     def disconnect(self):
-        log.debug(f"DHCPLeaseManager.disconnect({self})")
-        self.router.disconnect()
+        log.debug("DHCPLeaseManager.disconnect(%s)", self)
+        # Returns a borrowed session; a shared connection belongs to whoever passed it in
+        if self.session:
+            self.pool.release(self.session)
+            self.session = None
+            self.connection = None
 
-    def get_all_leases(self):
-        log.debug(f"DHCPLeaseManager.get_all_leases({self})")
+    def iter_leases(self, fields=None, filters=None):
+        """
+        Stream rows as the router sends them, each decoded on arrival, without holding the whole table
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'status': 'bound'}
+        Yields:
+            dict: Lease row
+        Raises:
+            RouterConnectionError: No session could be had, or the router refused the print
+        """
+        log.debug("DHCPLeaseManager.iter_leases(%s) fields: %s filters: %s", self, fields, filters)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
-            if not self.connect():
-                return []
+            self.connect()
 
+        log.debug("Querying router for /ip/dhcp-server/lease resource")
+        yield from stream_rows(self.connection, self.RESOURCE_PATH, {'.proplist': ','.join(fields)} if fields else None, filters)
+
+    def get_all_leases(self, fields=None, filters=None):
+        """
+        Args:
+            fields (iterable): RouterOS fields to return (.proplist), None for every column
+            filters (dict): RouterOS field => value the router matches rows against, e.g. {'status': 'bound'}
+        Returns:
+            list: Lease rows
+        """
+        log.debug("DHCPLeaseManager.get_all_leases(%s) fields: %s filters: %s", self, fields, filters)
         try:
-            log.debug("Querying router for /ip/dhcp-server/lease resource")
-            leases = self.connection.get_resource('/ip/dhcp-server/lease')
-            log.debug(f"Successfully retrieved DHCP leases: {leases}")
-            return leases.get()
+            result = list(self.iter_leases(fields, filters))
+            log.debug("Successfully retrieved %s DHCP leases", len(result))
+            return result
         except Exception as e:
-            log.error(f"Error getting DHCP leases: {str(e)}")
+            log.error("Error getting DHCP leases: %s", str(e))
             return []
 
     def get_active_leases(self):
-        log.debug(f"DHCPLeaseManager.get_active_leases({self})")
+        log.debug("DHCPLeaseManager.get_active_leases(%s)", self)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
@@ -48,14 +78,14 @@ class DHCPLeaseManager:
         try:
             log.debug("Querying router for /ip/dhcp-server/lease resource")
             leases = self.connection.get_resource('/ip/dhcp-server/lease')
-            log.debug(f"Successfully retrieved DHCP leases: {leases}")
+            log.debug("Successfully retrieved DHCP leases: %s", leases)
             return leases.get(status='bound')
         except Exception as e:
-            log.error(f"Error getting active leases: {str(e)}")
+            log.error("Error getting active leases: %s", str(e))
             return []
 
     def get_lease_by_mac(self, mac_address):
-        log.debug(f"DHCPLeaseManager.get_lease_by_mac({self}, {mac_address})")
+        log.debug("DHCPLeaseManager.get_lease_by_mac(%s, %s)", self, mac_address)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
@@ -64,16 +94,16 @@ class DHCPLeaseManager:
         try:
             log.debug("Querying router for /ip/dhcp-server/lease resource")
             leases = self.connection.get_resource('/ip/dhcp-server/lease')
-            log.debug(f"Executing DHCP lease query for MAC: {mac_address}")
+            log.debug("Executing DHCP lease query for MAC: %s", mac_address)
             result = leases.get(mac_address=mac_address)
-            log.debug(f"DHCP lease query result for MAC {mac_address}: {json.dumps(result, indent=2)}")
+            log.debug("DHCP lease query result for MAC %s: %s", mac_address, LazyJson(result))
             return result[0] if result else None
         except Exception as e:
-            log.error(f"Error getting lease for MAC {mac_address}: {str(e)}")
+            log.error("Error getting lease for MAC %s: %s", mac_address, str(e))
             return None
 
     def get_lease_by_ip(self, ip_address):
-        log.debug(f"DHCPLeaseManager.get_lease_by_ip({self}, {ip_address})")
+        log.debug("DHCPLeaseManager.get_lease_by_ip(%s, %s)", self, ip_address)
         if not self.connection:
             log.debug("No active connection, attempting to connect...")
             if not self.connect():
@@ -82,12 +112,12 @@ class DHCPLeaseManager:
         try:
             log.debug("Querying router for /ip/dhcp-server/lease resource")
             leases = self.connection.get_resource('/ip/dhcp-server/lease')
-            log.debug(f"Executing DHCP lease query for IP: {ip_address}")
+            log.debug("Executing DHCP lease query for IP: %s", ip_address)
             result = leases.get(address=ip_address)
-            log.debug(f"DHCP lease query result for IP {ip_address}: {json.dumps(result, indent=2)}")
+            log.debug("DHCP lease query result for IP %s: %s", ip_address, LazyJson(result))
             return result[0] if result else None
         except Exception as e:
-            log.error(f"Error getting lease for IP {ip_address}: {str(e)}")
+            log.error("Error getting lease for IP %s: %s", ip_address, str(e))
             return None
         
 
@@ -0,0 +1,119 @@
+"""
+MikroTik Listen Module
+Streams lease, ARP and bridge host table updates over one API session using the RouterOS `listen` command
+"""
+
+from .pipeline import api_communicators, decode_row, read_sentence, encode_words, buffered_bytes
+from mikrotik.exceptions import *
+import logging as log
+import select
+
+# RouterOS path => RouterSnapshot attribute holding that table
+LISTEN_TABLES = {
+    '/ip/dhcp-server/lease': 'leases',
+    '/ip/arp': 'arp',
+    '/interface/bridge/host': 'bridge_hosts',
+}
+
+
+class TableListener:
+    """
+    Multiplexes one `listen` per table on a leased pool session and applies each row to a RouterSnapshot
+
+    routeros_api only exposes blocking, per-tag iteration, so this drives the library's
+    response buffer directly: each sentence read is filed under its tag and drained from here.
+    """
+    def __init__(self, session, snapshot):
+        log.debug("TableListener.__init__(%s)", self)
+        # PooledSession (mikrotik/pool.py); outstanding listens leave replies on it, so it is never returned for reuse
+        self.session = session
+        self.snapshot = snapshot
+        self.tags = {}
+
+    def start(self):
+        log.debug("TableListener.start(%s)", self)
+        communicator, _ = api_communicators(self.session.connection)
+        self.tags = {}
+        for path, table in LISTEN_TABLES.items():
+            # Same columns as the snapshot's print; filters are applied to each update in _drain()
+            arguments = encode_words(self.snapshot.queries[table].arguments())
+            tag = communicator.send(f"{path}/".encode(), b'listen', arguments=arguments)
+            log.debug("Listening on %s with tag %s", path, tag)
+            self.tags[tag] = table
+
+    def stop(self):
+        log.debug("TableListener.stop(%s)", self)
+        if not self.tags or not self.session.is_connected():
+            self.tags = {}
+            return
+        communicator, _ = api_communicators(self.session.connection)
+        try:
+            for tag in self.tags:
+                communicator.send(b'/', b'cancel', arguments={b'tag': tag})
+        except Exception as e:
+            log.error("Error cancelling listen commands: %s", str(e))
+        self.tags = {}
+
+    def _readable(self, timeout):
+        # Sentences the reader already pulled off the socket, see SentenceReader
+        if buffered_bytes(self.session.connection):
+            return True
+        sock = self.session.api.socket.socket
+        # TLS can hold already-decrypted bytes that select() will not report
+        pending = getattr(sock, 'pending', None)
+        if pending and pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return bool(readable)
+
+    def _buffered(self):
+        """Updates another command on this session (e.g. a traffic sample) already read off the socket"""
+        _, base = api_communicators(self.session.connection)
+        for tag in self.tags:
+            response = base.response_buffor.get(tag)
+            if response is not None and (response or response.done or response.error):
+                return True
+        return False
+
+    def _drain(self):
+        changed = set()
+        _, base = api_communicators(self.session.connection)
+        buffers = base.response_buffor
+        for tag, table_name in self.tags.items():
+            response = buffers.get(tag)
+            if response is None:
+                continue
+            if response.error:
+                raise RouterConnectionError(f"listen on {table_name} failed: {response.error.decode()}")
+            if response.done:
+                raise RouterConnectionError(f"listen on {table_name} ended unexpectedly")
+            rows = list(response)
+            del response[:]
+            table = getattr(self.snapshot, table_name)
+            query = self.snapshot.queries[table_name]
+            for raw_row in rows:
+                row = decode_row(raw_row)
+                # A row that no longer matches the filters leaves the table just like a removed one
+                if row.pop('.dead', 'false') in ('true', 'yes') or not query.matches(row):
+                    changed |= table.remove(row.get('id'))
+                else:
+                    changed |= table.upsert(row)
+        return changed
+
+    def wait_for_updates(self, timeout=1.0):
+        """
+        Wait up to `timeout` seconds for table updates and apply all that are available
+        Returns:
+            set: Upper-cased MAC addresses whose joined device may have changed
+        """
+        if not self.tags:
+            raise RouterConnectionError("TableListener.start() has not been called")
+        if not self._buffered():
+            if not self._readable(timeout):
+                return set()
+            read_sentence(self.session.connection)
+        while self._readable(0):
+            read_sentence(self.session.connection)
+        changed = self._drain()
+        log.debug("TableListener.wait_for_updates(%s) => %s changed MACs", self, len(changed))
+        return changed
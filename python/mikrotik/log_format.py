@@ -0,0 +1,24 @@
+"""
+MikroTik Log Formatting Module
+Helpers that defer expensive message formatting until a log record is actually emitted
+"""
+
+import json
+
+
+class LazyJson:
+    """
+    Pretty-prints `obj` as JSON only when str() is called on it
+    Pass it as a %-style logging argument so a disabled level costs one small allocation instead of a json.dumps()
+    """
+    __slots__ = ('obj', 'indent')
+
+    def __init__(self, obj, indent=2):
+        self.obj = obj
+        # None gives one compact line
+        self.indent = indent
+
+    def __str__(self):
+        if self.indent is None:
+            return json.dumps(self.obj, separators=(',', ':'), default=str)
+        return json.dumps(self.obj, indent=self.indent, default=str)
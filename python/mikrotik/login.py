@@ -1,68 +1,163 @@
-import os
-from routeros_api import RouterOsApiPool
 import json
+import socket
 import logging as log
+from functools import lru_cache
 from mikrotik.exceptions import *
-import ssl
+from mikrotik.query import table_queries
+from mikrotik.pool import DEFAULT_POOL_SIZE, DEFAULT_KEEPALIVE
+from mikrotik.pipeline import SentenceReader
+
+DEFAULT_TIMEOUT = 15.0
+
+
+def config_flag(value, default=True):
+    """JSON true/false or the strings "TRUE"/"FALSE" used elsewhere in the configuration"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().upper() not in ('FALSE', '0', 'NO', '')
+    return bool(value)
+
+
+@lru_cache(maxsize=None)
+def read_config(path):
+    """Parsed info.json, read once per process however many RouterLogin objects are built"""
+    with open(path, encoding='utf-8') as config_file:
+        return json.load(config_file)
+
+
+def load_router_configs(path='configuration/info.json'):
+    """
+    Read the router list from info.json
+    Accepts either a "ROUTERS" list of per-router objects or the original single-router keys at the top level
+    Returns:
+        list: One dict per router with NAME, MIKROTIK_HOST, MIKROTIK_USER, MIKROTIK_PASS and MIKROTIK_TIMEOUT
+    """
+    config = read_config(path)
+    log.debug("Loaded %s -- Empty Check: %s", path, not bool(config))
+    routers = config.get('ROUTERS')
+    if routers is None:
+        routers = [config]
+    if not isinstance(routers, list) or not routers:
+        raise RouterConfigurationError(f"ROUTERS in {path} must be a non-empty list of router objects.")
+
+    router_configs = []
+    for router in routers:
+        router_config = dict(router)
+        router_config.setdefault('MIKROTIK_TIMEOUT', config.get('MIKROTIK_TIMEOUT', DEFAULT_TIMEOUT))
+        for key in ('MIKROTIK_PROPLIST', 'MIKROTIK_FILTERS', 'MIKROTIK_POOL_SIZE', 'MIKROTIK_KEEPALIVE'):
+            if key in config and key not in router_config:
+                router_config[key] = config[key]
+        router_config.setdefault('NAME', router_config.get('MIKROTIK_HOST'))
+        router_configs.append(router_config)
+
+    names = [router_config['NAME'] for router_config in router_configs]
+    if len(set(names)) != len(names):
+        raise RouterConfigurationError(f"Router NAME values in {path} must be unique.")
+    return router_configs
+
 
 class RouterLogin:
-    def __init__(self):
-        log.debug(f"RouterLogin.__init__({self})")
-        config = json.load(open('configuration/info.json'))
-        log.debug(f"Loaded configuration/info.json -- Empty Check: {not bool(config)}")
-        self.host = config.get('MIKROTIK_HOST')
-        self.username = config.get('MIKROTIK_USER')
-        self.password = config.get('MIKROTIK_PASS')
+    def __init__(self, router_config=None):
+        log.debug("RouterLogin.__init__(%s)", self)
+        if router_config is None:
+            router_config = load_router_configs()[0]
+        self.name = router_config.get('NAME') or router_config.get('MIKROTIK_HOST')
+        self.host = router_config.get('MIKROTIK_HOST')
+        self.username = router_config.get('MIKROTIK_USER')
+        self.password = router_config.get('MIKROTIK_PASS')
+        self.timeout = float(router_config.get('MIKROTIK_TIMEOUT', DEFAULT_TIMEOUT))
+        # Optional, defaults to 8729 for api-ssl or 8728 for the plain api service
+        self.port = int(router_config['MIKROTIK_PORT']) if router_config.get('MIKROTIK_PORT') else None
+        # Plain API is only meant for lab routers and the local stand-in in benchmarks/fake_router.py
+        self.use_ssl = config_flag(router_config.get('MIKROTIK_SSL'), default=True)
+        # Columns and rows requested per table, see mikrotik/query.py
+        self.queries = table_queries(
+            filters=router_config.get('MIKROTIK_FILTERS'),
+            projection=config_flag(router_config.get('MIKROTIK_PROPLIST'), default=True)
+        )
+        # Sessions kept to this router and idle seconds before one is probed, see mikrotik/pool.py
+        self.pool_size = int(router_config.get('MIKROTIK_POOL_SIZE', DEFAULT_POOL_SIZE))
+        self.keepalive = float(router_config.get('MIKROTIK_KEEPALIVE', DEFAULT_KEEPALIVE))
         self.api = None
         self.connection = None
 
+    def open_session(self):
+        """
+        Log in a new API session; the caller owns it (mikrotik/pool.py is the only caller besides connect())
+        Returns:
+            tuple: (RouterOsApiPool, RouterOsApi)
+        Raises:
+            RouterConfigurationError: The router configuration is incomplete
+        """
+        log.debug("RouterLogin.open_session(%s)", self)
+        if not self.host or not self.username or not self.password:
+            raise RouterConfigurationError("Router configuration is incomplete. Please check configuration/info.json.")
+
+        log.debug("Attempting connection to router at %s with user %s", self.host, self.username)
+        # Deferred to the first connection: routeros_api (and the ssl module it pulls in) is most of the startup import time
+        from routeros_api import RouterOsApiPool
+        api = RouterOsApiPool(
+            host=self.host,
+            username=self.username,
+            password=self.password,
+            port=self.port,
+            plaintext_login=True,
+            ssl_context=self.ssl_context() if self.use_ssl else None
+        )
+        # Bounds every blocking read, so one unresponsive router cannot hold a worker forever
+        api.socket_timeout = self.timeout
+
+        connection = api.get_api()
+        log.debug("Connection to router established successfully")
+        # routeros_api writes every word of a sentence separately; without this, Nagle holds each
+        # pipelined command back until the router acknowledges the previous one
+        api.socket.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Replies are parsed out of one receive buffer rather than read a word at a time
+        SentenceReader.install(api, connection)
+        return api, connection
+
     def connect(self):
-        log.debug(f"RouterLogin.connect({self})")
+        """Open a session owned by this object; code that shares the router should lease from mikrotik.pool instead"""
+        log.debug("RouterLogin.connect(%s)", self)
         try:
-            if not self.host or not self.username or not self.password:
-                raise RouterConfigurationError("Router configuration is incomplete. Please check configuration/info.json.")
-
-            # Create a custom SSL context to handle Anonymous TLS cipher
-            # > API-SSL service is capable of working in two modes - with and without a certificate. 
-            # > In the case no certificate is used in /ip service settings then an anonymous Diffie-Hellman cipher has to be used to establish a connection. 
-            # > If a certificate is in use, a TLS session can be established.
-            # Source: https://help.mikrotik.com/docs/spaces/ROS/pages/47579160/API#API-Initiallogin
-            ssl_context = ssl.create_default_context()
-            # Note that "SECLEVEL=0" is required for anonymous Diffie-Hellman cipher suites by OpenSSL 1.1.0 and later
-            ssl_context.set_ciphers("ADH-AES256-SHA256:AECDH-AES128-SHA:ADH-AES256-SHA:!CAMELLIA:!NULL:@SECLEVEL=0")
-            ssl_context.check_hostname = False
-            ssl_context.verify_mode = ssl.CERT_NONE
-            # For RouterOS 7.19.6 it appears that TLS 1.2 is the highest supported version
-            ssl_context.tls_version = ssl.PROTOCOL_TLSv1_2
-
-            log.debug(f"Attempting connection to router at {self.host} with user {self.username}")
-            self.api = RouterOsApiPool(
-                host=self.host,
-                username=self.username,
-                password=self.password,
-                plaintext_login=True,
-                ssl_context=ssl_context
-            )
-
-            log.debug("Connection to router established successfully")
-            self.connection = self.api.get_api()
-
+            self.api, self.connection = self.open_session()
             log.debug("Router API instance obtained successfully")
             return self.connection
         except Exception as e:
-            log.error(f"Failed to connect to router: {str(e)}")
+            log.error("Failed to connect to router: %s", str(e))
             return None
 
+    @staticmethod
+    def ssl_context():
+        # Create a custom SSL context to handle Anonymous TLS cipher
+        # > API-SSL service is capable of working in two modes - with and without a certificate. 
+        # > In the case no certificate is used in /ip service settings then an anonymous Diffie-Hellman cipher has to be used to establish a connection. 
+        # > If a certificate is in use, a TLS session can be established.
+        # Source: https://help.mikrotik.com/docs/spaces/ROS/pages/47579160/API#API-Initiallogin
+        import ssl
+        ssl_context = ssl.create_default_context()
+        # Note that "SECLEVEL=0" is required for anonymous Diffie-Hellman cipher suites by OpenSSL 1.1.0 and later
+        ssl_context.set_ciphers("ADH-AES256-SHA256:AECDH-AES128-SHA:ADH-AES256-SHA:!CAMELLIA:!NULL:@SECLEVEL=0")
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+        # For RouterOS 7.19.6 it appears that TLS 1.2 is the highest supported version
+        ssl_context.tls_version = ssl.PROTOCOL_TLSv1_2
+        return ssl_context
+
     def disconnect(self):
-        log.debug(f"RouterLogin.disconnect({self})")
+        log.debug("RouterLogin.disconnect(%s)", self)
         if self.api:
             log.debug("Disconnecting from router")
             try:
                 self.api.disconnect()
                 log.debug("Successfully disconnected from router")
             except Exception as e:
-                log.error(f"Error during disconnection: {str(e)}")
+                log.error("Error during disconnection: %s", str(e))
+        self.api = None
+        self.connection = None
 
     def is_connected(self):
-        log.debug(f"RouterLogin.is_connected({self})")
-        return self.connection is not None
\ No newline at end of file
+        log.debug("RouterLogin.is_connected(%s)", self)
+        # The API pool flips `connected` off when the library hits a connection or fatal error
+        return self.connection is not None and self.api is not None and self.api.connected
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+MikroTik Poll Metrics Module
+Per-poll stage timings and per-resource API call accounting, folded into process-wide
+histograms and counters that the daemon can expose
+"""
+
+from mikrotik.log_format import LazyJson
+from contextlib import contextmanager
+import logging as log
+import threading
+import os
+import time
+
+# Upper bounds in seconds, Prometheus style (each bucket counts observations <= its bound)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Histograms, counters and gauges keyed by (name, labels) shared by every poll in the process"""
+    HELP = {
+        'network_monitor_stage_seconds': ("histogram", "Time spent in each poll stage"),
+        'network_monitor_api_call_seconds': ("histogram", "Time from sending a RouterOS command to its !done"),
+        'network_monitor_api_calls_total': ("counter", "RouterOS commands sent"),
+        'network_monitor_api_rows_total': ("counter", "Rows returned by RouterOS commands"),
+        'network_monitor_api_bytes_total': ("counter", "Payload bytes (words) returned by RouterOS commands"),
+        'network_monitor_poll_interval_seconds': ("gauge", "Current adaptive poll interval per router and table"),
+        'network_monitor_table_churn_ratio': ("gauge", "Share of rows that changed between the last two fetches of a table"),
+        'network_monitor_pool_hits_total': ("counter", "Session leases answered with an idle pooled session"),
+        'network_monitor_pool_misses_total': ("counter", "Session leases that had to log in a new session"),
+        'network_monitor_pool_handshakes_total': ("counter", "API logins performed by the connection pool"),
+        'network_monitor_pool_probes_total': ("counter", "Liveness probes of idle pooled sessions"),
+        'network_monitor_pool_sessions': ("gauge", "Pooled sessions per router, idle or leased"),
+        'network_monitor_notifications_total': ("counter", "Alerts handed to each notification target, by outcome"),
+        'network_monitor_notifications_dropped_total': ("counter", "Alerts not queued, as duplicates within the TTL or because the queue was full"),
+        'network_monitor_probes_total': ("counter", "Devices actively probed, by whether they answered"),
+        'network_monitor_interface_rate': ("gauge", "Per second rate of each interface counter between the last two samples"),
+        'network_monitor_interface_rate_p95': ("gauge", "95th percentile of each interface counter's per second rate over the traffic window"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def remove_gauge(self, name, labels):
+        """Stop exporting a gauge, e.g. for something that no longer exists"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges.pop(key, None)
+
+    def record_poll(self, poll_metrics):
+        router = poll_metrics.router or ''
+        for stage, (seconds, _) in poll_metrics.stages.items():
+            self.observe('network_monitor_stage_seconds', {'router': router, 'stage': stage}, seconds)
+        for resource, usage in poll_metrics.resources.items():
+            labels = {'router': router, 'resource': resource}
+            self.observe('network_monitor_api_call_seconds', labels, usage['seconds'])
+            self.increment('network_monitor_api_calls_total', labels, usage['calls'])
+            self.increment('network_monitor_api_rows_total', labels, usage['rows'])
+            self.increment('network_monitor_api_bytes_total', labels, usage['bytes'])
+
+    def render_prometheus(self, format_labels):
+        """
+        Args:
+            format_labels (callable): Renders keyword labels as '{name="value",...}'
+        Returns:
+            list: Exposition lines, grouped by metric family
+        """
+        with self._lock:
+            histograms = {key: (tuple(histogram.cumulative()), histogram.count, histogram.sum) for key, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        lines = []
+        families = sorted({name for name, _ in histograms} | {name for name, _ in counters} | {name for name, _ in gauges})
+        for family in families:
+            kind, help_text = self.HELP.get(family, ("untyped", family))
+            lines.append(f"# HELP {family} {help_text}\n")
+            lines.append(f"# TYPE {family} {kind}\n")
+            for (name, labels), (buckets, count, total) in sorted(histograms.items()):
+                if name != family:
+                    continue
+                for bound, cumulative in buckets:
+                    lines.append(f"{name}_bucket{format_labels(**dict(labels), le=bound)} {cumulative}\n")
+                lines.append(f"{name}_bucket{format_labels(**dict(labels), le='+Inf')} {count}\n")
+                lines.append(f"{name}_sum{format_labels(**dict(labels))} {total}\n")
+                lines.append(f"{name}_count{format_labels(**dict(labels))} {count}\n")
+            for (name, labels), value in sorted(counters.items()) + sorted(gauges.items()):
+                if name == family:
+                    lines.append(f"{name}{format_labels(**dict(labels))} {value}\n")
+        return lines
+
+
+# Process-wide registry the daemon's Prometheus sink exposes
+REGISTRY = MetricsRegistry()
+
+
+class PollMetrics:
+    """
+    Durations and call counts for one router's poll
+    Stages are timed with `with metrics.stage('name'):`; a stage entered twice accumulates
+    """
+    def __init__(self, router=None):
+        self.router = router
+        self.started = time.perf_counter()
+        self.finished = None
+        # stage => [seconds, calls]
+        self.stages = {}
+        # resource path => {'calls', 'rows', 'bytes', 'seconds'}
+        self.resources = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += time.perf_counter() - started
+            totals[1] += 1
+
+    def api_call(self, resource, seconds, rows=0, size=0):
+        usage = self.resources.setdefault(resource, {'calls': 0, 'rows': 0, 'bytes': 0, 'seconds': 0.0})
+        usage['calls'] += 1
+        usage['rows'] += rows
+        usage['bytes'] += size
+        usage['seconds'] += seconds
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def finish(self, registry=REGISTRY):
+        """Stop the clock and fold this poll into the shared histograms"""
+        self.finished = time.perf_counter()
+        if registry is not None:
+            registry.record_poll(self)
+        return self
+
+    def summary(self):
+        end = self.finished or time.perf_counter()
+        return {
+            'router': self.router,
+            'total_ms': round((end - self.started) * 1000, 1),
+            'stages': {name: {'ms': round(seconds * 1000, 1), 'calls': calls} for name, (seconds, calls) in self.stages.items()},
+            'api': {
+                resource: {
+                    'calls': usage['calls'],
+                    'rows': usage['rows'],
+                    'bytes': usage['bytes'],
+                    'ms': round(usage['seconds'] * 1000, 1),
+                }
+                for resource, usage in self.resources.items()
+            },
+            'counts': dict(self.counts),
+        }
+
+
+def log_summary(poll_metrics, level=log.INFO):
+    """One structured line per poll, only built when the level is enabled"""
+    logger = log.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, "[POLL] %s", LazyJson(poll_metrics.summary(), indent=None))
+
+
+class PollProfiler:
+    """
+    Opt-in cProfile/tracemalloc capture of one poll round, armed on demand (e.g. from a signal handler)
+    Each router's poll runs on its own worker thread, so each gets its own cProfile dump;
+    tracemalloc is process-wide and covers the whole round
+    """
+    def __init__(self, directory):
+        log.debug("PollProfiler.__init__(%s) with directory: %s", self, directory)
+        self.directory = directory
+        self._armed = threading.Event()
+        self.active = False
+        self.stamp = None
+
+    def request(self):
+        """Profile the next round; only sets a flag, so it is safe to call from a signal handler"""
+        self._armed.set()
+
+    def begin_round(self):
+        if not self._armed.is_set():
+            return False
+        self._armed.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        self.stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.active = True
+        import tracemalloc
+        tracemalloc.start()
+        log.info("[PROFILE] Capturing this poll round into %s", self.directory)
+        return True
+
+    def run(self, label, function, *args):
+        """Call function(*args), under cProfile when a round is being captured"""
+        if not self.active:
+            return function(*args)
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            path = os.path.join(self.directory, f"poll-{self.stamp}-{label}.pstats")
+            profile.dump_stats(path)
+            log.info("[PROFILE] Wrote %s (view with: python -m pstats %s)", path, path)
+
+    def end_round(self, top=25):
+        if not self.active:
+            return
+        self.active = False
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        path = os.path.join(self.directory, f"poll-{self.stamp}-memory.txt")
+        with open(path, 'w', encoding='utf-8') as report:
+            report.write(f"Traced memory: current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB\n\n")
+            for statistic in snapshot.statistics('lineno')[:top]:
+                report.write(f"{statistic}\n")
+        log.info("[PROFILE] Peak traced memory %.1f MB, top allocations in %s", peak / 1e6, path)
@@ -1,154 +1,291 @@
-import json
 import logging as log
 from mikrotik.exceptions import *
+from mikrotik.log_format import LazyJson
+from mikrotik.parse import parse_mac, format_mac, parse_ipv4, format_ipv4, parse_bool, format_bool, parse_name, parse_duration, format_duration
+
+# (RouterOS key, attribute, parse, format) for each field kept from a table row; everything else is dropped
+DHCP_FIELDS = (
+    ('comment', 'dhcp_comment', str, str),
+    ('address', 'dhcp_address', parse_ipv4, format_ipv4),
+    ('mac-address', 'dhcp_mac_address', parse_mac, format_mac),
+    ('status', 'dhcp_status', parse_name, str),
+    ('host-name', 'dhcp_host_name', str, str),
+    ('last-seen', 'dhcp_last_seen', parse_duration, format_duration),
+    ('client-id', 'dhcp_client_id', str, str),
+    ('server', 'dhcp_server', parse_name, str),
+    ('dynamic', 'dhcp_dynamic', parse_bool, format_bool),
+)
+ARP_FIELDS = (
+    ('comment', 'arp_comment', str, str),
+    ('address', 'arp_address', parse_ipv4, format_ipv4),
+    ('mac-address', 'arp_mac_address', parse_mac, format_mac),
+    ('status', 'arp_status', parse_name, str),
+    ('interface', 'arp_interface', parse_name, str),
+    ('published', 'arp_published', parse_bool, format_bool),
+    ('invalid', 'arp_invalid', parse_bool, format_bool),
+    ('dynamic', 'arp_dynamic', parse_bool, format_bool),
+)
+BRIDGE_FIELDS = (
+    ('bridge', 'bridge_bridge', parse_name, str),
+    ('interface', 'bridge_interface', parse_name, str),
+    ('local', 'bridge_local', parse_bool, format_bool),
+    ('mac-address', 'bridge_mac_address', parse_mac, format_mac),
+    ('on-bridge', 'bridge_on_bridge', parse_bool, format_bool),
+    ('status', 'bridge_status', parse_name, str),
+)
+
 
 class NetworkDevice:
-    def __init__(self, identifier):
-        log.debug(f"NetworkDevice.__init__({self}) with identifier: {identifier}")
+    __slots__ = (
+        'identifier',
+        'router',
+        '_has_conflicts',
+        '_conflict_details',
+        '_conflicts_checked',
+        '_has_dhcp',
+        '_has_arp',
+        '_reachable',
+        '_rtt',
+        '_vendor',
+        '_dns_name',
+        '_port_rx',
+        '_port_tx',
+        *(field[1] for field in DHCP_FIELDS),
+        *(field[1] for field in ARP_FIELDS),
+        *(field[1] for field in BRIDGE_FIELDS),
+    )
+
+    def __init__(self, identifier, router=None):
+        log.debug("NetworkDevice.__init__(%s) with identifier: %s", self, identifier)
         # Indending for this to be a MAC Address
         self.identifier = identifier
-        self.dhcp_data = {
-            'comment': None,
-            'address': None,
-            'mac-address': None,
-            'status': None,
-            'host-name': None,
-            'last-seen': None,
-            'client-id': None,
-            'server': None,
-            'dynamic': None,
-        }
-        self.arp_data = {
-            'comment': None,
-            'address': None,
-            'mac-address': None,
-            'status': None,
-            'interface': None,
-            'published': None,
-            'invalid': None,
-            'dynamic': None,
-        }
-        self.bridge_data = {
-            'bridge': None,
-            'interface': None,
-            'local': None,
-            'mac-address': None,
-            'on-bridge': None,
-            'status': None,
-        }
+        # Name of the router the device was seen on, see load_router_configs()
+        self.router = router
+        for fields in (DHCP_FIELDS, ARP_FIELDS, BRIDGE_FIELDS):
+            for _, attribute, _, _ in fields:
+                setattr(self, attribute, None)
 
+        self._has_dhcp = False
+        self._has_arp = False
         self._has_conflicts = False
         self._conflict_details = {}
+        self._conflicts_checked = False
+        # Verdict of the last active probe, None until one ran, see mikrotik/probe.py
+        self._reachable = None
+        self._rtt = None
+        # Filled in by the enrichment stage, see enrich.py
+        self._vendor = None
+        self._dns_name = None
+        # Bytes per second through the device's port, see mikrotik/traffic.py
+        self._port_rx = None
+        self._port_tx = None
+
+    def _apply(self, fields, data):
+        # Same semantics as the dict.update() this replaced: keys missing from `data` keep their value
+        for key, attribute, parse, _ in fields:
+            value = data.get(key)
+            if value is not None:
+                setattr(self, attribute, parse(value))
+
+    def _view(self, fields):
+        view = {}
+        for key, attribute, _, format_value in fields:
+            value = getattr(self, attribute)
+            view[key] = None if value is None else format_value(value)
+        return view
 
     def add_dhcp_data(self, lease_data):
-        log.debug(f"NetworkDevice.add_dhcp_data({self}) with lease data: {json.dumps(lease_data, indent=2)}")
-        self.dhcp_data.update(lease_data)
-        log.debug(f"Updated DHCP data: {json.dumps(self.dhcp_data, indent=2)}")
-        self._check_conflicts()
+        log.debug("NetworkDevice.add_dhcp_data(%s) with lease data: %s", self, LazyJson(lease_data))
+        self._apply(DHCP_FIELDS, lease_data)
+        self._has_dhcp = True
+        self._conflicts_checked = False
 
     def add_arp_data(self, arp_data):
-        log.debug(f"NetworkDevice.add_arp_data({self}) with ARP data: {json.dumps(arp_data, indent=2)}")
-        self.arp_data.update(arp_data)
-        self._check_conflicts()
+        log.debug("NetworkDevice.add_arp_data(%s) with ARP data: %s", self, LazyJson(arp_data))
+        self._apply(ARP_FIELDS, arp_data)
+        self._has_arp = True
+        self._conflicts_checked = False
 
     def add_bridge_data(self, bridge_data):
-        log.debug(f"NetworkDevice.add_bridge_data({self}) with bridge data: {json.dumps(bridge_data, indent=2)}")
-        self.bridge_data.update(bridge_data)
-        self._check_conflicts()
+        log.debug("NetworkDevice.add_bridge_data(%s) with bridge data: %s", self, LazyJson(bridge_data))
+        self._apply(BRIDGE_FIELDS, bridge_data)
+
+    def set_probe_result(self, reachable, rtt=None):
+        """
+        Args:
+            reachable (bool): Whether the device answered an active probe
+            rtt (float): Round trip in seconds
+        """
+        self._reachable = reachable
+        self._rtt = rtt
+
+    def set_enrichment(self, vendor=None, dns_name=None):
+        """
+        Args:
+            vendor (str): Organization the MAC prefix is registered to
+            dns_name (str): Name the IP address resolves back to
+        """
+        self._vendor = vendor
+        self._dns_name = dns_name
+
+    def set_port_traffic(self, rx, tx):
+        """
+        Args:
+            rx (float): Bytes per second the router's port received, None before there are two samples
+            tx (float): Bytes per second the port sent
+        """
+        self._port_rx = rx
+        self._port_tx = tx
+
+    def set_conflicts(self, conflict_details):
+        """Record a verdict computed elsewhere, see mikrotik/analysis.py"""
+        self._conflict_details = conflict_details
+        self._has_conflicts = bool(conflict_details)
+        self._conflicts_checked = True
+
+    @staticmethod
+    def mark_conflicts_checked(devices):
+        """Clear devices in bulk after a snapshot analysis; the ones with conflicts then get set_conflicts()"""
+        for device in devices:
+            device._has_conflicts = False
+            device._conflict_details = {}
+            device._conflicts_checked = True
+
+    def _ensure_conflicts_checked(self):
+        # Devices built outside a snapshot analysis (e.g. from the listen stream) check themselves once, on demand
+        if not self._conflicts_checked:
+            self._check_conflicts()
 
     def _check_conflicts(self):
-        log.debug(f"NetworkDevice._check_conflicts({self})")
+        log.debug("NetworkDevice._check_conflicts(%s)", self)
+        self._conflicts_checked = True
         self._has_conflicts = False
         self._conflict_details = {}
 
-        if not all(self.dhcp_data.values()) and not all(self.arp_data.values()):
+        # Only meaningful once both sources have reported
+        if not (self._has_dhcp and self._has_arp):
             return
 
-        dhcp_ip = self.dhcp_data.get('address')
-        arp_ip = self.arp_data.get('address')
-        if dhcp_ip and arp_ip and dhcp_ip != arp_ip:
+        if self.dhcp_address is not None and self.arp_address is not None and self.dhcp_address != self.arp_address:
             self._has_conflicts = True
             self._conflict_details['ip_mismatch'] = {
-                'dhcp_ip': dhcp_ip,
-                'arp_ip': arp_ip
+                'dhcp_ip': format_ipv4(self.dhcp_address),
+                'arp_ip': format_ipv4(self.arp_address)
             }
 
-        dhcp_mac = self.dhcp_data.get('mac-address')
-        arp_mac = self.arp_data.get('mac-address')
-        if dhcp_mac and arp_mac and dhcp_mac.upper() != arp_mac.upper():
+        if self.dhcp_mac_address is not None and self.arp_mac_address is not None and self.dhcp_mac_address != self.arp_mac_address:
             self._has_conflicts = True
             self._conflict_details['mac_mismatch'] = {
-                'dhcp_mac': dhcp_mac,
-                'arp_mac': arp_mac
+                'dhcp_mac': format_mac(self.dhcp_mac_address),
+                'arp_mac': format_mac(self.arp_mac_address)
             }
 
+    @property
+    def ip_address(self):
+        """Packed IPv4 address, preferring DHCP over ARP"""
+        return self.dhcp_address if self.dhcp_address is not None else self.arp_address
+
+    @property
+    def mac_address(self):
+        """48-bit MAC address, preferring DHCP over ARP"""
+        return self.dhcp_mac_address if self.dhcp_mac_address is not None else self.arp_mac_address
+
     def get_merged_data(self):
-        log.debug(f"NetworkDevice.get_merged_data({self})")
-                                                  
+        log.debug("NetworkDevice.get_merged_data(%s)", self)
+        self._ensure_conflicts_checked()
+
         device_info = {
+            'router': self.router,
             'conflicts': self._has_conflicts,
             'conflict_details': self._conflict_details
         }
 
-        device_ip_address = self.dhcp_data.get('address') or self.arp_data.get('address') or None
-        if device_ip_address is None:
-            log.error(f"NetworkDevice {self.identifier} has no valid IP address from DHCP or ARP data.")
+        if self.ip_address is None:
+            log.error("NetworkDevice %s has no valid IP address from DHCP or ARP data.", self.identifier)
             raise NoValidIPAddressError(f"NetworkDevice {self.identifier} has no valid IP address from DHCP or ARP data.")
-        device_info.update({'ip_address': device_ip_address})
+        device_info.update({'ip_address': format_ipv4(self.ip_address)})
 
-        device_mac_address = self.dhcp_data.get('mac-address') or self.arp_data.get('mac-address') or None
-        if device_mac_address is None:
-            log.error(f"NetworkDevice {self.identifier} has no valid MAC address from DHCP or ARP data.")
+        if self.mac_address is None:
+            log.error("NetworkDevice %s has no valid MAC address from DHCP or ARP data.", self.identifier)
             raise NoValidMacAddressError(f"NetworkDevice {self.identifier} has no valid MAC address from DHCP or ARP data.")
-        device_info.update({'mac_address': device_mac_address})
+        device_info.update({'mac_address': format_mac(self.mac_address)})
 
         device_info.update({
-            'hostname': self.dhcp_data.get('host-name') or 'N/A',
-            'dhcp_status': self.dhcp_data.get('status') or 'noDHCP',
-            'last_seen': self.dhcp_data.get('last-seen') or 'noDHCP',
-            'comment': self.dhcp_data.get('comment') or '',
-            'client_id': self.dhcp_data.get('client-id') or 'noDHCP',
-            'dhcp_server': self.dhcp_data.get('server') or 'noDHCP',
-            'static_lease': self.dhcp_data.get('dynamic', 'true') == 'false'
+            # Devices that never send a DHCP host name fall back to their reverse DNS name
+            'hostname': self.dhcp_host_name or self._dns_name or 'N/A',
+            'dhcp_status': self.dhcp_status or 'noDHCP',
+            'last_seen': format_duration(self.dhcp_last_seen) or 'noDHCP',
+            'comment': self.dhcp_comment or '',
+            'client_id': self.dhcp_client_id or 'noDHCP',
+            'dhcp_server': self.dhcp_server or 'noDHCP',
+            'static_lease': self.dhcp_dynamic is False
         })
 
         # Add ARP information
         device_info.update({
-            'interface': self.arp_data.get('interface') or 'noARP',
-            'arp_status': self.arp_data.get('status') or 'noARP',
-            'published': self.arp_data.get('published') or 'noARP',
-            'invalid': self.arp_data.get('invalid', 'false') == 'true',
-            'dynamic': self.arp_data.get('dynamic', 'false') == 'true'
+            'interface': self.arp_interface or 'noARP',
+            'arp_status': self.arp_status or 'noARP',
+            'published': format_bool(self.arp_published) or 'noARP',
+            'invalid': self.arp_invalid is True,
+            'dynamic': self.arp_dynamic is True
+        })
+
+        # Add enrichment and active probe information, None when those stages are off
+        device_info.update({
+            'vendor': self._vendor,
+            'dns_name': self._dns_name,
+            'reachable': self._reachable,
+            'rtt_ms': None if self._rtt is None else round(self._rtt * 1000, 3),
+            'port_rx_bps': None if self._port_rx is None else round(self._port_rx * 8),
+            'port_tx_bps': None if self._port_tx is None else round(self._port_tx * 8)
         })
 
         # Add Bridge information
         device_info.update({
-            'bridge': self.bridge_data.get('bridge') or 'noBridge',
-            'bridge_interface': self.bridge_data.get('interface') or 'noBridge',
-            'bridge_local': self.bridge_data.get('local', 'false') == 'true',
-            'on_bridge': self.bridge_data.get('on-bridge', 'false') == 'true',
-            'bridge_status': self.bridge_data.get('status') or 'noBridge'
+            'bridge': self.bridge_bridge or 'noBridge',
+            'bridge_interface': self.bridge_interface or 'noBridge',
+            'bridge_local': self.bridge_local is True,
+            'on_bridge': self.bridge_on_bridge is True,
+            'bridge_status': self.bridge_status or 'noBridge'
         })
 
-        log.debug(f"Merged device info for {self.identifier}: {json.dumps(device_info, indent=2)}")
+        log.debug("Merged device info for %s: %s", self.identifier, LazyJson(device_info))
         return device_info
 
+    def get_state(self):
+        """
+        Fields tracked between polls, in DeviceChangeTracker.STATE_FIELDS order
+        Unlike get_merged_data() this never raises and builds no dicts, so it is cheap enough to call every poll
+        """
+        return (
+            self.ip_address,
+            self.dhcp_status or 'noDHCP',
+            self.arp_status or 'noARP',
+            self.bridge_bridge or 'noBridge',
+            self.bridge_interface or 'noBridge',
+        )
+
     def has_conflicts(self):
-        log.debug(f"NetworkDevice.has_conflicts({self}) => {self._has_conflicts}")
+        self._ensure_conflicts_checked()
+        log.debug("NetworkDevice.has_conflicts(%s) => %s", self, self._has_conflicts)
         return self._has_conflicts
 
     def get_conflict_details(self):
-        log.debug(f"NetworkDevice.get_conflict_details({self}) => {json.dumps(self._conflict_details, indent=2)}")
+        self._ensure_conflicts_checked()
+        log.debug("NetworkDevice.get_conflict_details(%s) => %s", self, LazyJson(self._conflict_details))
         return self._conflict_details
 
     def get_dhcp_data(self):
-        log.debug(f"NetworkDevice.get_dhcp_data({self}) => {json.dumps(self.dhcp_data, indent=2)}")
-        return self.dhcp_data
+        dhcp_data = self._view(DHCP_FIELDS)
+        log.debug("NetworkDevice.get_dhcp_data(%s) => %s", self, LazyJson(dhcp_data))
+        return dhcp_data
 
     def get_arp_data(self):
-        log.debug(f"NetworkDevice.get_arp_data({self}) => {json.dumps(self.arp_data, indent=2)}")
-        return self.arp_data
+        arp_data = self._view(ARP_FIELDS)
+        log.debug("NetworkDevice.get_arp_data(%s) => %s", self, LazyJson(arp_data))
+        return arp_data
 
     def get_bridge_data(self):
-        log.debug(f"NetworkDevice.get_bridge_data({self}) => {json.dumps(self.bridge_data, indent=2)}")
-        return self.bridge_data
+        bridge_data = self._view(BRIDGE_FIELDS)
+        log.debug("NetworkDevice.get_bridge_data(%s) => %s", self, LazyJson(bridge_data))
+        return bridge_data
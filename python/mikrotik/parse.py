@@ -0,0 +1,134 @@
+"""
+MikroTik Value Parsing Module
+Converts the strings RouterOS returns into compact typed values and back
+
+The same MACs, addresses and durations come back on every poll and across the lease, ARP and
+bridge tables, so the costlier conversions are memoized in bounded LRU caches; a malformed value
+is therefore only warned about the first time it is seen
+"""
+
+from functools import lru_cache
+import logging as log
+import socket
+import sys
+import re
+
+# Distinct values remembered per conversion, comfortably above the devices on a large router
+CACHE_SIZE = 16384
+
+# RouterOS durations: '1w2d', '9m41s', '350ms', and ping times like '1ms419us'
+DURATION_PART = re.compile(r'(\d+)(ms|us|w|d|h|m|s)')
+# In microseconds, so whole-second durations stay ints
+DURATION_UNITS = {'w': 604800000000, 'd': 86400000000, 'h': 3600000000, 'm': 60000000, 's': 1000000, 'ms': 1000, 'us': 1}
+FORMAT_UNITS = (('w', 604800), ('d', 86400), ('h', 3600), ('m', 60), ('s', 1))
+BOOLS = {'true': True, 'yes': True, 'false': False, 'no': False}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_mac(value):
+    """'12:34:56:ab:cd:ef' => 0x123456ABCDEF, None if absent or malformed"""
+    if not value:
+        return None
+    digits = value.replace(':', '').replace('-', '')
+    try:
+        if len(digits) != 12:
+            raise ValueError(value)
+        return int(digits, 16)
+    except ValueError:
+        log.warning("Ignoring malformed MAC address: %s", value)
+        return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_mac(value):
+    if value is None:
+        return None
+    digits = f"{value:012X}"
+    return ':'.join(digits[index:index + 2] for index in range(0, 12, 2))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_ipv4(value):
+    """'10.0.5.23' => 0x0A000517, None if absent or malformed"""
+    if not value:
+        return None
+    try:
+        return int.from_bytes(socket.inet_aton(value), 'big')
+    except OSError:
+        log.warning("Ignoring malformed IPv4 address: %s", value)
+        return None
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_ipv4(value):
+    if value is None:
+        return None
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+def parse_bool(value):
+    """RouterOS flags come back as 'true'/'false' (or 'yes'/'no'); anything else is unknown"""
+    return BOOLS.get(value)
+
+
+def format_bool(value):
+    if value is None:
+        return None
+    return 'true' if value else 'false'
+
+
+def parse_name(value):
+    """Interface, bridge and server names repeat across thousands of rows, so share one string object each"""
+    if not value:
+        return None
+    return sys.intern(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_duration(value):
+    """
+    '1d2h3m4s' or '02:03:04' => seconds, None if absent, 'never' or malformed
+    Whole seconds come back as an int, anything finer ('350ms', '1ms419us', '00:00:01.5') as a float
+    """
+    if not value or value == 'never':
+        return None
+    if ':' in value:
+        try:
+            hours, minutes, seconds = value.split(':')
+            seconds = float(seconds)
+            total = int(hours) * 3600 + int(minutes) * 60 + seconds
+        except ValueError:
+            log.warning("Ignoring malformed duration: %s", value)
+            return None
+        return int(total) if seconds.is_integer() else total
+    parts = DURATION_PART.findall(value)
+    if not parts or sum(len(number) + len(unit) for number, unit in parts) != len(value):
+        log.warning("Ignoring malformed duration: %s", value)
+        return None
+    microseconds = sum(int(number) * DURATION_UNITS[unit] for number, unit in parts)
+    return microseconds // 1000000 if microseconds % 1000000 == 0 else microseconds / 1000000
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_duration(value):
+    """Seconds => RouterOS style '1w2d3h4m5s'"""
+    if value is None:
+        return None
+    seconds, fraction = divmod(value, 1)
+    seconds = int(seconds)
+    text = ''
+    for unit, size in FORMAT_UNITS:
+        if seconds >= size:
+            text += f"{seconds // size}{unit}"
+            seconds %= size
+    milliseconds, microseconds = divmod(round(fraction * 1000000), 1000)
+    if milliseconds:
+        text += f"{milliseconds}ms"
+    if microseconds:
+        text += f"{microseconds}us"
+    return text or '0s'
+
+
+def cache_info():
+    """Hits, misses and size of each memoized conversion, name => CacheInfo"""
+    return {function.__name__: function.cache_info() for function in (parse_mac, format_mac, parse_ipv4, format_ipv4, parse_duration, format_duration)}
@@ -0,0 +1,288 @@
+"""
+MikroTik Pipeline Module
+Issues several API commands at once on one session and streams the replies row by row as they arrive
+
+Replies are read through SentenceReader, which parses sentences out of one large receive buffer;
+routeros_api on its own makes a recv() call for every length prefix and every word, two or more
+system calls per field of every row
+"""
+
+from mikrotik.exceptions import *
+import logging as log
+import time
+
+# Bytes asked of the socket per read; a TLS socket returns at most one record (16 KiB) per read anyway
+RECEIVE_BUFFER = 1 << 16
+
+# Reply key => decoded name, shared by every row so each key string exists once rather than once per row
+# routeros_api's key cleaner renames the first two; everything else is decoded as is
+DECODED_KEYS = {b'.id': 'id', b'.proplist': 'proplist'}
+
+
+def api_communicators(connection):
+    """
+    Reach into the routeros_api communicator stack of a RouterOsApi connection
+    Returns:
+        tuple: (exception-aware communicator used to send, base communicator holding the per-tag response buffer)
+    """
+    if not connection:
+        raise RouterConnectionError("No router connection")
+    exception_aware = connection.communicator.exception_aware_communicator
+    # ExceptionAware -> KeyCleaner -> ApiCommunicatorBase
+    return exception_aware, exception_aware.inner.inner
+
+
+def encode_words(dictionary):
+    return {str(key).encode(): str(value).encode() for key, value in (dictionary or {}).items()}
+
+
+def decode_key(key):
+    name = DECODED_KEYS.get(key)
+    if name is None:
+        name = DECODED_KEYS[key] = key.decode(errors='backslashreplace')
+    return name
+
+
+def decode_row(raw_row):
+    """Turn a raw reply row ({b'.id': b'*1', ...}) into the same shape resource.get() returns"""
+    keys = DECODED_KEYS
+    return {
+        keys.get(key) or decode_key(key): value.decode(errors='backslashreplace')
+        for key, value in raw_row.items()
+    }
+
+
+class RowDecoder:
+    """
+    decode_row() for one fetch that also shares value strings within columns that repeat (status, flags,
+    server and interface names) instead of holding a copy per row; a column stops being shared once it
+    shows more than `limit` distinct values, as addresses and ids do
+    """
+    def __init__(self, limit=256):
+        self.limit = limit
+        # Raw key => {raw value: decoded value}, None once the column has too many distinct values
+        self.columns = {}
+
+    def __call__(self, raw_row):
+        row = {}
+        columns = self.columns
+        for key, value in raw_row.items():
+            values = columns.get(key, False)
+            if values is False:
+                values = columns[key] = {}
+            name = DECODED_KEYS.get(key) or decode_key(key)
+            if values is None:
+                row[name] = value.decode(errors='backslashreplace')
+                continue
+            text = values.get(value)
+            if text is None:
+                text = value.decode(errors='backslashreplace')
+                if len(values) < self.limit:
+                    values[value] = text
+                else:
+                    columns[key] = None
+            row[name] = text
+        return row
+
+
+def row_size(row):
+    """Payload bytes of a row's words, either raw reply bytes or decoded strings"""
+    return sum(len(key) + len(value) + 2 for key, value in row.items())
+
+
+def read_sentence(connection):
+    """Read one reply sentence and file it under its tag in the base communicator's buffer"""
+    exception_aware, base = api_communicators(connection)
+    try:
+        base.process_single_response()
+    except Exception as e:
+        # Let the pool's handlers mark the connection as closed before re-raising; they ignore anything
+        # that is not a routeros_api connection error, so routeros_api need not be imported here
+        exception_aware.handle_exception(e)
+
+
+class SentenceReader:
+    """
+    Reads API sentences for a routeros_api connection out of a buffer refilled RECEIVE_BUFFER bytes at
+    a time, in place of the library's word-at-a-time reads; see SentenceReader.install()
+    """
+    def __init__(self, wrapped, exceptions, size=RECEIVE_BUFFER):
+        """
+        Args:
+            wrapped (SocketWrapper): routeros_api's socket wrapper, raises when the router closes the connection
+            exceptions (module): routeros_api.exceptions, for raising the errors the library's handlers expect
+        """
+        self.wrapped = wrapped
+        self.exceptions = exceptions
+        self.size = size
+        self.buffer = b''
+        self.position = 0
+
+    @classmethod
+    def install(cls, api, connection):
+        """
+        Have a freshly opened session read through a SentenceReader
+        Args:
+            api (RouterOsApiPool): Owner of the session's socket
+            connection (RouterOsApi): The session's connection
+        """
+        from routeros_api import exceptions
+        _, base = api_communicators(connection)
+        reader = cls(api.socket, exceptions)
+        base.base.receive_sentence = reader.receive_sentence
+        base.base.reader = reader
+        return reader
+
+    def pending(self):
+        """Bytes received but not read yet, which select() on the socket cannot see"""
+        return len(self.buffer) - self.position
+
+    def _fill(self, needed):
+        while len(self.buffer) - self.position < needed:
+            try:
+                data = self.wrapped.receive(max(self.size, needed))
+            except OSError as e:
+                raise self.exceptions.RouterOsApiConnectionError(str(e))
+            self.buffer = self.buffer[self.position:] + data
+            self.position = 0
+
+    def _length(self):
+        """Word length prefix, 1 to 5 bytes (see https://help.mikrotik.com/docs/spaces/ROS/pages/47579160/API#API-APIwords)"""
+        self._fill(1)
+        first = self.buffer[self.position]
+        if first < 0x80:
+            self.position += 1
+            return first
+        if first < 0xC0:
+            size, value = 2, first & 0x3F
+        elif first < 0xE0:
+            size, value = 3, first & 0x1F
+        elif first < 0xF0:
+            size, value = 4, first & 0x0F
+        elif first < 0xF8:
+            size, value = 5, 0
+        else:
+            raise self.exceptions.FatalRouterOsApiError("Malformed length")
+        self._fill(size)
+        start = self.position + 1
+        self.position += size
+        return (value << 8 * (size - 1)) | int.from_bytes(self.buffer[start:self.position], 'big')
+
+    def receive_sentence(self):
+        """
+        Returns:
+            list: The sentence's words, as routeros_api's Connection.receive_sentence() returns them
+        """
+        words = []
+        while True:
+            buffer, position = self.buffer, self.position
+            # Fast path: a one-byte length prefix (words under 128 bytes) and the whole word already buffered
+            if position < len(buffer) and buffer[position] < 0x80 and position + 1 + buffer[position] <= len(buffer):
+                length = buffer[position]
+                position += 1
+            else:
+                length = self._length()
+                self._fill(length)
+                buffer, position = self.buffer, self.position
+            if not length:
+                self.position = position
+                return words
+            end = position + length
+            words.append(buffer[position:end])
+            self.position = end
+
+
+def buffered_bytes(connection):
+    """Bytes a SentenceReader holds for the connection beyond what select() on its socket reports"""
+    _, base = api_communicators(connection)
+    reader = getattr(base.base, 'reader', None)
+    return reader.pending() if reader else 0
+
+
+class PipelinedFetch:
+    """
+    Sends every queued print before reading any reply, so the router works on them together
+    and the wall time is roughly that of the slowest table instead of the sum of all of them
+    """
+    def __init__(self, connection):
+        log.debug("PipelinedFetch.__init__(%s)", self)
+        self.connection = connection
+        self.requests = {}
+        self.timings = {}
+        self.row_counts = {}
+        self.byte_counts = {}
+        # Names whose command trapped; rows streamed before the trap (if any) should be discarded
+        self.errors = set()
+
+    def add(self, name, path, arguments=None, queries=None):
+        self.requests[name] = (path, arguments, queries)
+        return self
+
+    def stream(self):
+        """
+        Yield rows as their sentences arrive, each decoded and dropped from the reply buffer before the
+        next sentence is read, so the tables are never held raw and whole
+        Yields:
+            tuple: (name, row), rows of different tables interleaved
+        """
+        log.debug("PipelinedFetch.stream(%s) for %s", self, list(self.requests))
+        exception_aware, base = api_communicators(self.connection)
+        started = time.perf_counter()
+        pending = {}
+        for name, (path, arguments, queries) in self.requests.items():
+            path = path if path.endswith('/') else f"{path}/"
+            tag = exception_aware.send(
+                path.encode(),
+                b'print',
+                arguments=encode_words(arguments),
+                queries=encode_words(queries)
+            )
+            pending[tag] = name
+            self.row_counts[name] = 0
+            self.byte_counts[name] = 0
+
+        buffers = base.response_buffor
+        decode = RowDecoder()
+        while pending:
+            read_sentence(self.connection)
+            for tag, name in list(pending.items()):
+                response = buffers[tag]
+                if response:
+                    rows = response[:]
+                    del response[:]
+                    self.row_counts[name] += len(rows)
+                    self.byte_counts[name] += sum(map(row_size, rows))
+                    for raw_row in rows:
+                        yield name, decode(raw_row)
+                if response.done:
+                    del pending[tag]
+                    del buffers[tag]
+                    self.timings[name] = time.perf_counter() - started
+                    if response.error:
+                        log.error("Error fetching %s: %s", self.requests[name][0], response.error.decode())
+                        self.errors.add(name)
+
+    def run(self):
+        """
+        Returns:
+            dict: name => list of rows; a table whose command trapped is logged and returned empty
+        """
+        results = {name: [] for name in self.requests}
+        for name, row in self.stream():
+            results[name].append(row)
+        for name in self.errors:
+            results[name] = []
+        return results
+
+
+def stream_rows(connection, path, arguments=None, queries=None):
+    """
+    Print one table, yielding its rows as they arrive
+    Raises:
+        RouterConnectionError: The command trapped
+    """
+    fetch = PipelinedFetch(connection).add(path, path, arguments, queries)
+    for _, row in fetch.stream():
+        yield row
+    if fetch.errors:
+        raise RouterConnectionError(f"Router refused to print {path}")
@@ -0,0 +1,302 @@
+"""
+MikroTik Connection Pool Module
+One bounded pool of API sessions per router, shared by every monitor, manager and listener in the process
+
+Callers lease a session, use it and return it, so a router normally costs one login for the life of
+the process however many objects talk to it. Idle sessions are probed with a cheap command
+before they are handed out and kept warm by a keepalive thread; a session that fails either check
+is closed and replaced on the next lease, without the caller seeing the dead one
+"""
+
+from mikrotik.exceptions import *
+from mikrotik.metrics import REGISTRY
+from contextlib import contextmanager
+import logging as log
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 2
+# Seconds an idle session may go unused before it is probed
+DEFAULT_KEEPALIVE = 60.0
+# Answered by every RouterOS version with one short row
+PROBE_PATH = '/system/identity'
+
+# stats key => registry counter it is also exported as
+POOL_METRICS = {
+    'hits': 'network_monitor_pool_hits_total',
+    'misses': 'network_monitor_pool_misses_total',
+    'handshakes': 'network_monitor_pool_handshakes_total',
+    'probes': 'network_monitor_pool_probes_total',
+}
+
+# Router name => ConnectionPool, see connection_pool()
+POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+class PooledSession:
+    """One logged-in API session: the routeros_api pool object (socket owner) and its RouterOsApi connection"""
+    def __init__(self, login, number):
+        log.debug("PooledSession.__init__(%s) #%s to %s", self, number, login.host)
+        self.number = number
+        self.api, self.connection = login.open_session()
+        self.last_used = time.monotonic()
+
+    def is_connected(self):
+        # The API pool flips `connected` off when the library hits a connection or fatal error
+        return self.connection is not None and self.api is not None and self.api.connected
+
+    def probe(self):
+        """
+        One round trip on the session
+        Returns:
+            bool: True if the router answered, even with a trap
+        """
+        from routeros_api.exceptions import RouterOsApiCommunicationError
+        try:
+            self.connection.get_resource(PROBE_PATH).get()
+        except RouterOsApiCommunicationError:
+            # A trap still proves the session is alive
+            pass
+        except Exception as e:
+            log.debug("Probe of session #%s failed: %s", self.number, str(e))
+            return False
+        self.last_used = time.monotonic()
+        return self.is_connected()
+
+    def close(self):
+        log.debug("PooledSession.close(%s) #%s", self, self.number)
+        if self.api:
+            try:
+                self.api.disconnect()
+            except Exception as e:
+                log.error("Error during disconnection: %s", str(e))
+        self.api = None
+        self.connection = None
+
+
+class ConnectionPool:
+    """
+    Bounded set of sessions to one router with lease/return semantics
+        size       most sessions open at once; a lease beyond it waits for a return
+        keepalive  idle seconds after which a session is probed, by the keepalive thread or before
+                   it is leased again (0 disables probing)
+    """
+    def __init__(self, login, size=DEFAULT_POOL_SIZE, keepalive=DEFAULT_KEEPALIVE):
+        log.debug("ConnectionPool.__init__(%s) for %s, size %s, keepalive %ss", self, login.name, size, keepalive)
+        self.login = login
+        self.name = login.name
+        self.size = max(1, int(size))
+        self.keepalive = float(keepalive)
+        self._lock = threading.Condition()
+        # Most recently returned last, so the warmest session is leased first
+        self.idle = []
+        self.leased = set()
+        # Sessions being opened or probed outside the lock; they count against `size`
+        self._pending = 0
+        self._probing = 0
+        self._numbers = 0
+        self._closed = False
+        self._stop = threading.Event()
+        self._keeper = None
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'handshakes': 0, 'probes': 0, 'dead': 0}
+
+    def __len__(self):
+        with self._lock:
+            return len(self.idle) + len(self.leased) + self._pending + self._probing
+
+    def _count(self, name, **labels):
+        # Poll threads and the keepalive thread count concurrently
+        with self._lock:
+            self.stats[name] += 1
+        metric = POOL_METRICS.get(name)
+        if metric:
+            REGISTRY.increment(metric, dict(labels, router=self.name or ''))
+
+    def _publish_sizes(self):
+        labels = {'router': self.name or ''}
+        REGISTRY.set_gauge('network_monitor_pool_sessions', dict(labels, state='idle'), len(self.idle))
+        REGISTRY.set_gauge('network_monitor_pool_sessions', dict(labels, state='leased'), len(self.leased))
+
+    def acquire(self, timeout=None):
+        """
+        Lease a live session, reusing an idle one when possible
+        Args:
+            timeout (float): Seconds to wait for a return when all `size` sessions are leased, None waits forever
+        Returns:
+            PooledSession
+        Raises:
+            RouterConnectionError: The pool is closed, no session came free in time, or a new login failed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                session = None
+                while True:
+                    if self._closed:
+                        raise RouterConnectionError(f"Connection pool for {self.name} is closed")
+                    if self.idle:
+                        session = self.idle.pop()
+                        self.leased.add(session)
+                        break
+                    # A session being probed is about to come back; do not log in again for it
+                    if not self._probing and len(self.leased) + self._pending < self.size:
+                        self._pending += 1
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise RouterConnectionError(f"No free session to {self.name} within {timeout}s ({self.size} leased)")
+                    waited = True
+                    self._lock.wait(remaining)
+                if self._keeper is None and self.keepalive > 0:
+                    self._keeper = threading.Thread(target=self._keep_alive, name=f"pool-{self.name}", daemon=True)
+                    self._keeper.start()
+
+            if session is None:
+                return self._open(waited)
+            if self._check(session):
+                self._count('hits')
+                if waited:
+                    self._count('waits')
+                with self._lock:
+                    self._publish_sizes()
+                return session
+            # Dead: drop it and try again, which opens a replacement if nothing else is idle
+            self.release(session, discard=True)
+
+    def _open(self, waited):
+        try:
+            with self._lock:
+                self._numbers += 1
+                number = self._numbers
+            session = PooledSession(self.login, number)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+                self._lock.notify()
+            raise RouterConnectionError(f"Failed to connect to router {self.name} at {self.login.host}: {e}")
+        self._count('misses')
+        if waited:
+            self._count('waits')
+        self._count('handshakes')
+        log.debug("[%s] Opened session #%s (%s handshake(s) so far)", self.name, number, self.stats['handshakes'])
+        with self._lock:
+            self._pending -= 1
+            self.leased.add(session)
+            self._publish_sizes()
+        return session
+
+    def _check(self, session):
+        """Liveness check before reuse; only sessions idle longer than `keepalive` cost a round trip"""
+        if not session.is_connected():
+            self._count('dead')
+            return False
+        if self.keepalive <= 0 or time.monotonic() - session.last_used < self.keepalive:
+            return True
+        alive = session.probe()
+        self._count('probes', result='alive' if alive else 'dead')
+        if not alive:
+            self._count('dead')
+        return alive
+
+    def release(self, session, discard=False):
+        """
+        Return a leased session
+        Args:
+            discard (bool): Close it instead, e.g. when it may hold unread replies or failed mid-command
+        """
+        if session is None:
+            return
+        with self._lock:
+            self.leased.discard(session)
+            keep = not discard and not self._closed and session.is_connected()
+            if keep:
+                session.last_used = time.monotonic()
+                self.idle.append(session)
+            self._publish_sizes()
+            self._lock.notify()
+        if not keep:
+            session.close()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """with pool.lease() as session: ...; a session that lost its connection is not returned to the pool"""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        except Exception:
+            self.release(session, discard=not session.is_connected())
+            raise
+        self.release(session)
+
+    def _keep_alive(self):
+        interval = self.keepalive / 2
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                quiet = [session for session in self.idle if now - session.last_used >= self.keepalive]
+                for session in quiet:
+                    self.idle.remove(session)
+                self._probing += len(quiet)
+            for session in quiet:
+                alive = session.probe()
+                self._count('probes', result='alive' if alive else 'dead')
+                if not alive:
+                    self._count('dead')
+                    log.info("[%s] Idle session #%s stopped answering, it will be replaced on next use", self.name, session.number)
+                with self._lock:
+                    self._probing -= 1
+                    if alive and not self._closed:
+                        self.idle.append(session)
+                    self._publish_sizes()
+                    self._lock.notify_all()
+                if not alive or self._closed:
+                    session.close()
+
+    def close(self):
+        """Close idle sessions now and leased ones as they are returned; the pool cannot be leased from again"""
+        log.debug("ConnectionPool.close(%s)", self)
+        with self._lock:
+            self._closed = True
+            idle, self.idle = self.idle, []
+            self._publish_sizes()
+            self._lock.notify_all()
+        self._stop.set()
+        for session in idle:
+            session.close()
+        with _POOLS_LOCK:
+            if POOLS.get(self.name) is self:
+                del POOLS[self.name]
+        log.info(
+            "[POOL] [%s] %s login(s), %s lease(s) reused, %s new, %s waited, %s probe(s), %s dead session(s)",
+            self.name, self.stats['handshakes'], self.stats['hits'], self.stats['misses'],
+            self.stats['waits'], self.stats['probes'], self.stats['dead']
+        )
+
+
+def connection_pool(login=None):
+    """
+    The process-wide pool for a router, created on first use
+    Args:
+        login (RouterLogin): Router to pool, defaults to the first router in configuration/info.json;
+                             the first caller's settings (size, keepalive) configure the pool
+    Returns:
+        ConnectionPool
+    """
+    if login is None:
+        from .login import RouterLogin
+        login = RouterLogin()
+    with _POOLS_LOCK:
+        pool = POOLS.get(login.name)
+        if pool is None:
+            pool = POOLS[login.name] = ConnectionPool(login, size=login.pool_size, keepalive=login.keepalive)
+        return pool
+
+
+def close_pools():
+    """Close every pool, for process shutdown"""
+    with _POOLS_LOCK:
+        pools = list(POOLS.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,312 @@
+"""
+MikroTik Reachability Probe Module
+Checks whether each device in the inventory actually answers, instead of trusting the ARP or DHCP
+status the router reports (DHCP last-seen is only refreshed periodically, see mikrotik/dhcp.py)
+
+Both probers check many hosts at once, with at most `concurrency` probes outstanding and a
+per-host `timeout`:
+    RouterProber  pings from the router over the poll's API session: an ARP ping on the device's
+                  ARP interface (answered even by hosts that drop ICMP) or a plain /ping, as
+                  tagged commands that run side by side on the router
+    LocalProber   probes from this host with asyncio, for a collector on the same LAN: ICMP echo
+                  over an unprivileged ping socket, or a raw socket when running as root, else a
+                  TCP connect where a refusal proves the host is up just as well as an accept
+"""
+
+from mikrotik.pipeline import api_communicators, read_sentence, encode_words
+from mikrotik.parse import format_ipv4, format_duration, parse_duration
+from mikrotik.metrics import REGISTRY
+import logging as log
+import itertools
+import asyncio
+import socket
+import struct
+import time
+import os
+
+DEFAULT_CONCURRENCY = 128
+DEFAULT_TIMEOUT = 1.0
+# Ports tried by the TCP fallback; any answer, even a refusal, means the host is up
+DEFAULT_TCP_PORTS = (80, 443, 22)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = struct.Struct('!BBHHH')
+ICMP_PAYLOAD = b'network-monitor'
+
+
+class ProbeResult:
+    __slots__ = ('reachable', 'rtt')
+
+    def __init__(self, reachable, rtt=None):
+        self.reachable = reachable
+        # Round trip in seconds, None when the host did not answer
+        self.rtt = rtt
+
+
+class Prober:
+    """
+    Probes every device with an address and attaches the results to it, see NetworkDevice.set_probe_result()
+    One prober per router; results are kept between rounds so devices polled between two rounds
+    (when `interval` is longer than the poll interval) still carry the last verdict
+    """
+    def __init__(self, router=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, interval=0.0):
+        log.debug("%s.__init__(%s) for %s, %s at once, %ss timeout", type(self).__name__, self, router, concurrency, timeout)
+        self.router = router
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = float(timeout)
+        self.interval = float(interval)
+        # Packed IPv4 => ProbeResult from the last round
+        self.results = {}
+        self.last_round = None
+
+    def due(self, at_least=0.0):
+        """
+        Args:
+            at_least (float): Seconds a caller wants between rounds even when `interval` is shorter
+        """
+        return self.last_round is None or time.monotonic() - self.last_round >= max(self.interval, at_least)
+
+    def probe(self, connection, devices_dict, metrics=None):
+        """
+        Probe the devices' addresses if a round is due, then attach the latest results to every device
+        Args:
+            connection (RouterOsApi): The poll's session, used by RouterProber
+            devices_dict (dict): MAC address => NetworkDevice
+        """
+        if self.due():
+            targets = {}
+            for device in devices_dict.values():
+                if device.ip_address is not None:
+                    targets[device.ip_address] = device.arp_interface
+            self.last_round = time.monotonic()
+            results = self._probe(connection, targets)
+            answered = sum(1 for result in results.values() if result.reachable)
+            labels = {'router': self.router or ''}
+            REGISTRY.increment('network_monitor_probes_total', dict(labels, result='reachable'), answered)
+            REGISTRY.increment('network_monitor_probes_total', dict(labels, result='unreachable'), len(results) - answered)
+            if metrics:
+                metrics.count('probed', len(results))
+                metrics.count('unreachable', len(results) - answered)
+            self.results = results
+        self.attach(devices_dict)
+
+    def attach(self, devices_dict):
+        """Give devices the last round's results without probing, e.g. devices rebuilt from a listen update"""
+        for device in devices_dict.values():
+            result = self.results.get(device.ip_address)
+            if result is not None:
+                device.set_probe_result(result.reachable, result.rtt)
+
+    def _probe(self, connection, targets):
+        """
+        Args:
+            targets (dict): Packed IPv4 => ARP interface name or None
+        Returns:
+            dict: Packed IPv4 => ProbeResult, hosts that could not be probed at all are left out
+        """
+        raise NotImplementedError
+
+
+class RouterProber(Prober):
+    def __init__(self, router=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, interval=0.0, arp_ping=True):
+        super().__init__(router, concurrency, timeout, interval)
+        self.arp_ping = arp_ping
+
+    def _arguments(self, address, interface):
+        arguments = {'address': format_ipv4(address), 'count': 1, 'interval': format_duration(self.timeout)}
+        if self.arp_ping and interface:
+            arguments.update({'arp-ping': 'yes', 'interface': interface})
+        return arguments
+
+    def _probe(self, connection, targets):
+        exception_aware, base = api_communicators(connection)
+        queue = iter(targets.items())
+        # tag => packed IPv4
+        pending = {}
+        results = {}
+
+        def send_next():
+            for address, interface in queue:
+                tag = exception_aware.send(b'/', b'ping', arguments=encode_words(self._arguments(address, interface)))
+                pending[tag] = address
+                return
+
+        for _ in range(self.concurrency):
+            send_next()
+        while pending:
+            read_sentence(connection)
+            for tag in [tag for tag in pending if base.response_buffor[tag].done]:
+                address = pending.pop(tag)
+                response = base.response_buffor.pop(tag)
+                if response.error:
+                    log.debug("[%s] Could not ping %s: %s", self.router, format_ipv4(address), response.error.decode())
+                else:
+                    results[address] = self._result(response)
+                send_next()
+        return results
+
+    @staticmethod
+    def _result(rows):
+        """A reply row with a time and no status (e.g. 'timeout') is an answer"""
+        for row in rows:
+            if b'time' in row and b'status' not in row:
+                return ProbeResult(True, parse_duration(row[b'time'].decode()))
+        return ProbeResult(False)
+
+
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(identifier, sequence):
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = icmp_checksum(header + ICMP_PAYLOAD)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + ICMP_PAYLOAD
+
+
+class IcmpPinger:
+    """
+    One ICMP socket shared by every outstanding echo request, replies matched back by sequence number
+    Raises PermissionError when neither a ping socket nor a raw socket may be opened
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        try:
+            # Unprivileged where net.ipv4.ping_group_range allows it; the kernel sets the identifier
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        except PermissionError:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.raw = True
+        self.socket.setblocking(False)
+        self.identifier = os.getpid() & 0xFFFF
+        self.sequences = itertools.count()
+        # sequence => (dotted address, future)
+        self.waiting = {}
+        loop.add_reader(self.socket.fileno(), self._receive)
+
+    async def ping(self, address, timeout):
+        sequence = next(self.sequences) & 0xFFFF
+        future = self.loop.create_future()
+        self.waiting[sequence] = (address, future)
+        started = time.perf_counter()
+        try:
+            self.socket.sendto(echo_request(self.identifier, sequence), (address, 0))
+            await asyncio.wait_for(future, timeout)
+            return ProbeResult(True, time.perf_counter() - started)
+        except (asyncio.TimeoutError, OSError):
+            return ProbeResult(False)
+        finally:
+            self.waiting.pop(sequence, None)
+
+    def _receive(self):
+        while True:
+            try:
+                data, (address, _) = self.socket.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.debug("ICMP receive failed: %s", str(e))
+                return
+            if self.raw:
+                # Raw sockets see the IP header, and every ICMP message the host receives
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < ICMP_HEADER.size:
+                continue
+            kind, _, _, identifier, sequence = ICMP_HEADER.unpack_from(data)
+            if kind != ICMP_ECHO_REPLY or (self.raw and identifier != self.identifier):
+                continue
+            entry = self.waiting.get(sequence)
+            if entry and entry[0] == address and not entry[1].done():
+                entry[1].set_result(True)
+
+    def close(self):
+        self.loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+
+
+class LocalProber(Prober):
+    def __init__(self, router=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, interval=0.0, ports=DEFAULT_TCP_PORTS, icmp=True):
+        super().__init__(router, concurrency, timeout, interval)
+        self.ports = tuple(ports)
+        # Cleared after the first PermissionError so later rounds go straight to TCP
+        self.icmp = icmp
+
+    def _probe(self, connection, targets):
+        addresses = list(targets)
+        return dict(zip(addresses, asyncio.run(self._probe_all(addresses))))
+
+    async def _probe_all(self, addresses):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pinger = None
+        if self.icmp:
+            try:
+                pinger = IcmpPinger(asyncio.get_running_loop())
+            except PermissionError:
+                log.warning("[%s] No permission for ICMP sockets (see net.ipv4.ping_group_range), probing with TCP connects to ports %s", self.router, self.ports)
+                self.icmp = False
+
+        async def probe_host(address):
+            async with semaphore:
+                if pinger:
+                    return await pinger.ping(format_ipv4(address), self.timeout)
+                return await self._connect_any(format_ipv4(address))
+
+        try:
+            return await asyncio.gather(*(probe_host(address) for address in addresses))
+        finally:
+            if pinger:
+                pinger.close()
+
+    async def _connect_any(self, address):
+        """Try every port at once; the first to accept or refuse answers for the host"""
+        started = time.perf_counter()
+        attempts = [asyncio.ensure_future(self._connect(address, port)) for port in self.ports]
+        try:
+            for attempt in asyncio.as_completed(attempts, timeout=self.timeout):
+                if await attempt:
+                    return ProbeResult(True, time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+        return ProbeResult(False)
+
+    @staticmethod
+    async def _connect(address, port):
+        try:
+            _, writer = await asyncio.open_connection(address, port)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            # Unreachable host or network, or nothing listening that answers
+            return False
+        writer.close()
+        return True
+
+
+PROBERS = {
+    'router': RouterProber,
+    'local': LocalProber,
+}
+
+
+def prober_factory(mode, **options):
+    """
+    Args:
+        mode (str): 'router' to ping from the router, 'local' to probe from this host
+        options: Passed to the prober, e.g. concurrency, timeout, interval
+    Returns:
+        callable: Router name => Prober
+    """
+    if mode not in PROBERS:
+        raise ValueError(f"Unknown probe mode '{mode}', expected one of: {', '.join(PROBERS)}")
+    prober_type = PROBERS[mode]
+    return lambda router: prober_type(router, **options)
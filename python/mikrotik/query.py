@@ -0,0 +1,101 @@
+"""
+MikroTik Table Query Module
+Which columns (.proplist) and which rows (?key=value query words) the collector asks the router for
+
+RouterOS serializes every column of every row unless told otherwise, and on low-end routers that is
+where most of the API CPU goes. Each consumer declares the fields it reads, only their union is
+requested, and optional per-table filters let the router drop rows before they are sent
+"""
+
+from .network_device import DHCP_FIELDS, ARP_FIELDS, BRIDGE_FIELDS
+from mikrotik.exceptions import *
+import logging as log
+
+TABLES = ('leases', 'arp', 'bridge_hosts')
+
+# Consumer => table => RouterOS fields it reads from the raw rows
+CONSUMER_FIELDS = {
+    # MacTable keys rows by .id and MAC; listen updates and removals are matched by .id
+    'index': {
+        'leases': ('.id', 'mac-address'),
+        'arp': ('.id', 'mac-address'),
+        'bridge_hosts': ('.id', 'mac-address'),
+    },
+    # NetworkDevice, and through get_merged_data() the report, output sinks and history
+    'device': {
+        'leases': tuple(field[0] for field in DHCP_FIELDS),
+        'arp': tuple(field[0] for field in ARP_FIELDS),
+        'bridge_hosts': tuple(field[0] for field in BRIDGE_FIELDS),
+    },
+    # mikrotik/analysis.py reads ARP-only and extra bridge host rows directly
+    'analysis': {
+        'arp': ('address',),
+        'bridge_hosts': ('bridge', 'interface', 'local'),
+    },
+    # The adaptive scheduler (scheduler.py) bounds the lease interval by lease expiry
+    'scheduler': {
+        'leases': ('status', 'expires-after'),
+    },
+}
+
+
+def query_value(value):
+    """JSON config values to the strings RouterOS prints (true/false for booleans)"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+class TableQuery:
+    """
+    Projection and filters for one table
+        fields   tuple of RouterOS field names sent as .proplist, None for every column
+        filters  RouterOS field => value, each sent as a ?field=value query word (all must match)
+    """
+    def __init__(self, fields=None, filters=None):
+        self.fields = tuple(fields) if fields else None
+        self.filters = {key: query_value(value) for key, value in (filters or {}).items()}
+
+    def arguments(self):
+        return {'.proplist': ','.join(self.fields)} if self.fields else {}
+
+    def queries(self):
+        return dict(self.filters)
+
+    def matches(self, row):
+        """Client-side check of the filters, for rows the router did not filter (listen updates)"""
+        return all(row.get(key) == value for key, value in self.filters.items())
+
+    def __repr__(self):
+        return f"TableQuery(fields={self.fields}, filters={self.filters})"
+
+
+def table_queries(filters=None, projection=True, consumers=None):
+    """
+    Build the query for every table
+    Args:
+        filters (dict): Table name => {field: value}, e.g. {"leases": {"status": "bound"}}
+        projection (bool): False requests every column, as before .proplist was used
+        consumers (iterable): Names from CONSUMER_FIELDS to serve, defaults to all of them
+    Returns:
+        dict: Table name => TableQuery
+    """
+    filters = filters or {}
+    unknown = set(filters) - set(TABLES)
+    if unknown:
+        raise RouterConfigurationError(f"Unknown table(s) in MIKROTIK_FILTERS: {', '.join(sorted(unknown))}, expected: {', '.join(TABLES)}")
+
+    queries = {}
+    for table in TABLES:
+        fields = None
+        if projection:
+            fields = []
+            for consumer in consumers or CONSUMER_FIELDS:
+                for field in CONSUMER_FIELDS[consumer].get(table, ()):
+                    if field not in fields:
+                        fields.append(field)
+            # Listen updates are filtered client-side, so they must carry the filtered fields
+            fields.extend(field for field in filters.get(table, {}) if field not in fields)
+        queries[table] = TableQuery(fields, filters.get(table))
+    log.debug("table_queries() => %s", queries)
+    return queries
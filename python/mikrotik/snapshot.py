@@ -0,0 +1,312 @@
+"""
+MikroTik Snapshot Module
+Fetches the DHCP lease, ARP and bridge host tables once per poll and joins them in memory
+
+Rows are indexed as they stream in (see PipelinedFetch.stream()), so a fetch holds each row once,
+in its MacTable, rather than as a raw reply list, a decoded list and the index together
+"""
+
+from .dhcp import DHCPLeaseManager
+from .arp import ARPManager
+from .bridge import BridgeHostManager
+from .network_device import NetworkDevice
+from .pipeline import PipelinedFetch, row_size
+from .metrics import PollMetrics
+from .analysis import analyze_snapshot
+from .query import table_queries
+from mikrotik.exceptions import *
+import logging as log
+from mikrotik.log_format import LazyJson
+import time
+
+
+class MacTable:
+    """
+    RouterOS table rows keyed by .id with a secondary index on upper-cased MAC address
+    Rows can be replaced or removed one at a time, which is what the listen stream delivers
+    """
+    def __init__(self, rows=()):
+        self.rows = {}
+        self.by_mac = {}
+        for row in rows:
+            self.upsert(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def _row_id(row):
+        return row.get('id') or row.get('mac-address')
+
+    @staticmethod
+    def _mac(row):
+        mac_address = row.get('mac-address')
+        return mac_address.upper() if mac_address else None
+
+    def upsert(self, row):
+        """
+        Insert a row or merge it into the row with the same .id
+        Returns:
+            set: MAC addresses whose rows changed (old and new MAC if the row moved)
+        """
+        row_id = self._row_id(row)
+        previous = self.rows.get(row_id)
+        changed = set()
+        if previous is not None:
+            old_mac = self._mac(previous)
+            if old_mac:
+                self.by_mac.get(old_mac, {}).pop(row_id, None)
+                if not self.by_mac.get(old_mac):
+                    self.by_mac.pop(old_mac, None)
+                changed.add(old_mac)
+            row = {**previous, **row}
+
+        self.rows[row_id] = row
+        new_mac = self._mac(row)
+        if new_mac:
+            self.by_mac.setdefault(new_mac, {})[row_id] = row
+            changed.add(new_mac)
+        return changed
+
+    def remove(self, row_id):
+        row = self.rows.pop(row_id, None)
+        if row is None:
+            return set()
+        mac_address = self._mac(row)
+        if not mac_address:
+            return set()
+        self.by_mac.get(mac_address, {}).pop(row_id, None)
+        if not self.by_mac.get(mac_address):
+            self.by_mac.pop(mac_address, None)
+        return {mac_address}
+
+    def get(self, mac_address):
+        """First row for a MAC, matching what the per-MAC getters on the managers return"""
+        rows = self.by_mac.get(mac_address.upper())
+        return next(iter(rows.values())) if rows else None
+
+    def get_all(self, mac_address):
+        return list(self.by_mac.get(mac_address.upper(), {}).values())
+
+    def macs(self):
+        return self.by_mac.keys()
+
+
+def table_signatures(table, fields):
+    """MAC => the watched fields of each of its rows, for comparing two fetches of a table"""
+    return {
+        mac_address: tuple(tuple(row.get(field) for field in fields) for row in rows.values())
+        for mac_address, rows in table.by_mac.items()
+    }
+
+
+def table_churn(old_signatures, new_signatures):
+    """Share of MACs added, removed or changed between two sets of table_signatures()"""
+    if not old_signatures:
+        return 0.0
+    changed = sum(1 for mac_address, signature in new_signatures.items() if old_signatures.get(mac_address) != signature)
+    removed = sum(1 for mac_address in old_signatures if mac_address not in new_signatures)
+    return (changed + removed) / max(len(old_signatures), len(new_signatures))
+
+
+class RouterSnapshot:
+    # Table attribute => RouterOS resource path, for per-resource accounting
+    RESOURCE_PATHS = {
+        'leases': DHCPLeaseManager.RESOURCE_PATH,
+        'arp': ARPManager.RESOURCE_PATH,
+        'bridge_hosts': BridgeHostManager.RESOURCE_PATH,
+    }
+    # Fields whose change counts as churn for the adaptive scheduler (scheduler.py)
+    CHURN_FIELDS = {
+        'leases': ('address', 'status', 'host-name'),
+        'arp': ('address', 'status', 'interface'),
+        'bridge_hosts': ('bridge', 'interface'),
+    }
+
+    def __init__(self, connection=None, router=None, queries=None):
+        log.debug("RouterSnapshot.__init__(%s)", self)
+        self.router = router
+        self.connection = connection
+        # Table attribute => TableQuery (.proplist and filters), see mikrotik/query.py
+        self.queries = queries or table_queries()
+        self.dhcp_manager = DHCPLeaseManager(connection)
+        self.arp_manager = ARPManager(connection)
+        self.bridge_manager = BridgeHostManager(connection)
+        self.leases = MacTable()
+        self.arp = MacTable()
+        self.bridge_hosts = MacTable()
+        # Seconds from dispatch until each table's reply completed on the last fetch
+        self.timings = {}
+        # Payload bytes of each table on the last fetch
+        self.sizes = {}
+        # Cross-device Anomaly objects from the last build_devices()
+        self.anomalies = []
+        # Share of rows that changed on each table's last fetch, and what it was compared against
+        self.churn = {}
+        self._signatures = {}
+        # Only the adaptive scheduler reads churn, so it is not computed otherwise
+        self.track_churn = False
+
+    def bind(self, connection):
+        """Fetch over another session from now on, keeping the tables already fetched"""
+        log.debug("RouterSnapshot.bind(%s)", self)
+        self.connection = connection
+        for manager in (self.dhcp_manager, self.arp_manager, self.bridge_manager):
+            manager.connection = connection
+
+    def disconnect(self):
+        log.debug("RouterSnapshot.disconnect(%s)", self)
+        # Only matters if a manager had to borrow a session of its own
+        self.dhcp_manager.disconnect()
+        self.arp_manager.disconnect()
+        self.bridge_manager.disconnect()
+
+    def fetch(self, metrics=None, tables=None):
+        """
+        Pull each table from the router with a single query apiece
+        With a connection the queries are pipelined on it; otherwise each manager fetches in turn
+        Args:
+            metrics (PollMetrics): Receives the fetch stage and one API call per table
+            tables (iterable): Table names to refresh, defaults to all; the others keep their last fetch
+        Returns:
+            RouterSnapshot: self, so fetch() and build_devices() can be chained
+        """
+        log.debug("RouterSnapshot.fetch(%s) tables: %s", self, tables)
+        metrics = metrics or PollMetrics(self.router)
+        names = [name for name in self.RESOURCE_PATHS if tables is None or name in tables]
+        with metrics.stage('fetch'):
+            if self.connection:
+                tables, row_counts = self._fetch_pipelined(names)
+            else:
+                tables, row_counts = self._fetch_sequential(names)
+        # Swapped in only once every reply is complete, a failed fetch keeps the last tables
+        for name in names:
+            setattr(self, name, tables[name])
+
+        if self.track_churn:
+            with metrics.stage('churn'):
+                self.churn = {}
+                for name in names:
+                    signatures = table_signatures(getattr(self, name), self.CHURN_FIELDS[name])
+                    self.churn[name] = table_churn(self._signatures.get(name), signatures)
+                    self._signatures[name] = signatures
+
+        for name, seconds in self.timings.items():
+            metrics.api_call(self.RESOURCE_PATHS[name], seconds, rows=row_counts.get(name, 0), size=self.sizes.get(name, 0))
+        return self
+
+    def _fetch_pipelined(self, names):
+        """
+        Returns:
+            tuple: ({name: MacTable}, {name: rows received})
+        """
+        log.debug("Fetching %s from router in one pipeline...", ", ".join(names))
+        fetch = PipelinedFetch(self.connection)
+        tables = {}
+        for name in names:
+            path = self.RESOURCE_PATHS[name]
+            query = self.queries[name]
+            fetch.add(name, path, query.arguments(), query.queries())
+            tables[name] = MacTable()
+        upserts = {name: table.upsert for name, table in tables.items()}
+        for name, row in fetch.stream():
+            upserts[name](row)
+        # A table whose print trapped counts as empty, as it did before streaming
+        for name in fetch.errors:
+            tables[name] = MacTable()
+        self.timings = fetch.timings
+        self.sizes = fetch.byte_counts
+        return tables, fetch.row_counts
+
+    def _fetch_sequential(self, names):
+        tables = {}
+        row_counts = {}
+        self.timings = {}
+        self.sizes = {}
+        for name, rows in (
+            ('leases', self.dhcp_manager.iter_leases),
+            ('arp', self.arp_manager.iter_arp_entries),
+            ('bridge_hosts', self.bridge_manager.iter_bridge_hosts),
+        ):
+            if name not in names:
+                continue
+            log.debug("Fetching %s from router...", name)
+            started = time.perf_counter()
+            table = MacTable()
+            try:
+                for row in rows(fields=self.queries[name].fields, filters=self.queries[name].queries()):
+                    table.upsert(row)
+            except Exception as e:
+                log.error("Error fetching %s: %s", name, str(e))
+                table = MacTable()
+            tables[name] = table
+            row_counts[name] = len(table)
+            self.timings[name] = time.perf_counter() - started
+            self.sizes[name] = sum(map(row_size, table.rows.values()))
+        return tables, row_counts
+
+    def build_device(self, mac_address):
+        """
+        Join the tables for one MAC address
+        Returns:
+            NetworkDevice: None if no DHCP lease with an address exists for the MAC
+        """
+        device = None
+        for lease in self.leases.get_all(mac_address):
+            if not lease.get('address'):
+                log.warning("Lease with missing IP or MAC address: %s", LazyJson(lease))
+                continue
+            if device is None:
+                log.debug("Creating new device entry for MAC: %s", mac_address)
+                device = NetworkDevice(lease.get('mac-address'), router=self.router)
+            log.debug("Adding DHCP data to device with MAC: %s", mac_address)
+            device.add_dhcp_data(lease)
+        if device is None:
+            return None
+
+        arp_entry = self.arp.get(mac_address)
+        if arp_entry:
+            log.debug("Adding ARP data to device with MAC: %s", mac_address)
+            device.add_arp_data(arp_entry)
+        else:
+            log.warning("No ARP entry found for MAC: %s", mac_address)
+
+        bridge_entry = self.bridge_hosts.get(mac_address)
+        if bridge_entry:
+            log.debug("Adding bridge data to device with MAC: %s", mac_address)
+            device.add_bridge_data(bridge_entry)
+        else:
+            log.warning("No bridge entry found for MAC: %s", mac_address)
+        return device
+
+    def build_devices(self, metrics=None):
+        """
+        Join the fetched tables into NetworkDevice objects
+        Args:
+            metrics (PollMetrics): Receives the build and analyze stages and device/conflict/anomaly counts
+        Returns:
+            dict: Upper-cased MAC address => NetworkDevice, one per leased MAC
+        """
+        log.debug("RouterSnapshot.build_devices(%s)", self)
+        if not len(self.leases):
+            log.error("No DHCP leases found in the network.")
+            raise NoDHCPLeasesError("No DHCP leases found in the network. This might indicate a DHCP server issue or network connectivity problem...")
+
+        metrics = metrics or PollMetrics(self.router)
+        devices_dict = {}
+        log.debug("Processing DHCP leases...")
+        with metrics.stage('build'):
+            for mac_address in self.leases.macs():
+                device = self.build_device(mac_address)
+                if device is not None:
+                    devices_dict[mac_address] = device
+        with metrics.stage('analyze'):
+            self.anomalies = analyze_snapshot(self, devices_dict)
+        metrics.count('devices', len(devices_dict))
+        metrics.count('conflicts', sum(1 for device in devices_dict.values() if device._has_conflicts))
+        metrics.count('anomalies', len(self.anomalies))
+        return devices_dict
+
+    def collect(self, metrics=None, tables=None):
+        log.debug("RouterSnapshot.collect(%s)", self)
+        return self.fetch(metrics, tables).build_devices(metrics)
@@ -0,0 +1,255 @@
+"""
+MikroTik Interface Traffic Module
+Samples the router's /interface counters (bytes, packets, errors and drops in each direction) and
+keeps per-second rates for each interface, so a device's bridge port can be checked for load
+
+Rates are the counter deltas between two samples over the time between them. RouterOS counters are
+64-bit, but 32-bit counters (older devices, some virtual interfaces) wrap, and any counter starts
+over when an interface or the router restarts; see counter_delta()
+
+Each interface's rates go into fixed-size ring buffers preallocated as array('d'), one per counter
+beside one of sample times, so a long-running daemon holds a constant amount of history however
+long it runs. Window aggregates (mean, max, p95) slice the window out of the arrays by sample time
+with bisect and sort it in one call, rather than walking samples in Python
+"""
+
+from mikrotik.pipeline import stream_rows
+from mikrotik.metrics import REGISTRY
+from mikrotik.exceptions import *
+from array import array
+import logging as log
+import bisect
+import time
+
+INTERFACE_PATH = '/interface'
+# RouterOS field => rate name
+COUNTERS = {
+    'rx-byte': 'rx_bytes',
+    'tx-byte': 'tx_bytes',
+    'rx-packet': 'rx_packets',
+    'tx-packet': 'tx_packets',
+    'rx-error': 'rx_errors',
+    'tx-error': 'tx_errors',
+    'rx-drop': 'rx_drops',
+    'tx-drop': 'tx_drops',
+}
+DEFAULT_SAMPLES = 720
+DEFAULT_WINDOW = 3600.0
+WRAP_32 = 2 ** 32
+
+
+def counter_delta(previous, current):
+    """
+    Increase of a counter between two reads
+    A decrease is a 32-bit wrap when the value was below 2^32 and wrapping explains it with less than
+    half the counter's range; any other decrease is a reset, counted from zero
+    """
+    if current >= previous:
+        return current - previous
+    if previous < WRAP_32:
+        wrapped = current + WRAP_32 - previous
+        if wrapped < WRAP_32 // 2:
+            return wrapped
+    return current
+
+
+def percentile(ordered, fraction):
+    """Linear interpolation between the closest ranks of sorted values (numpy's default method)"""
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class RingBuffer:
+    """Preallocated numeric buffer of `capacity` samples; once full each append overwrites the oldest"""
+    __slots__ = ('data', 'capacity', 'head', 'count')
+
+    def __init__(self, capacity, typecode='d'):
+        self.capacity = max(1, int(capacity))
+        self.data = array(typecode, bytes(array(typecode).itemsize * self.capacity))
+        # Slot the next sample goes in
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self):
+        return self.data[self.head - 1] if self.count else None
+
+    def values(self):
+        """
+        Returns:
+            array: The samples oldest first, copied out of the buffer
+        """
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return self.data[self.head:] + self.data[:self.head]
+
+
+class InterfaceSeries:
+    """One interface's rates: a RingBuffer per counter, and one of the (monotonic) times they were sampled"""
+    def __init__(self, capacity=DEFAULT_SAMPLES):
+        self.times = RingBuffer(capacity)
+        self.rates = {name: RingBuffer(capacity) for name in COUNTERS.values()}
+        # Raw counters and time of the last sample, the baseline for the next rates
+        self.counters = None
+        self.sampled_at = None
+
+    def add(self, counters, now):
+        """
+        Args:
+            counters (dict): Rate name => raw counter value
+            now (float): time.monotonic() of the sample
+        Returns:
+            dict: Rate name => per second since the last sample, None for the first sample
+        """
+        previous, then = self.counters, self.sampled_at
+        self.counters, self.sampled_at = counters, now
+        if previous is None or now <= then:
+            return None
+        elapsed = now - then
+        rates = {name: counter_delta(previous[name], value) / elapsed for name, value in counters.items()}
+        self.times.append(now)
+        for name, rate in rates.items():
+            self.rates[name].append(rate)
+        return rates
+
+    def latest(self, name):
+        return self.rates[name].last()
+
+    def window(self, name, seconds, now=None):
+        """
+        Returns:
+            array: The rates sampled in the last `seconds`, oldest first
+        """
+        start = bisect.bisect_left(self.times.values(), (time.monotonic() if now is None else now) - seconds)
+        return self.rates[name].values()[start:]
+
+    def aggregate(self, name, seconds, now=None):
+        """
+        Returns:
+            dict: 'mean', 'max' and 'p95' of the rates in the window, None when it holds no samples
+        """
+        rates = self.window(name, seconds, now)
+        if not rates:
+            return None
+        ordered = sorted(rates)
+        return {'mean': sum(rates) / len(rates), 'max': ordered[-1], 'p95': percentile(ordered, 0.95)}
+
+
+class TrafficCollector:
+    """
+    Samples one router's interface counters at most once per `interval` seconds and attaches the rates of
+    each device's port (bridge port, else ARP interface) to the device
+    """
+    def __init__(self, router=None, samples=DEFAULT_SAMPLES, interval=0.0, window=DEFAULT_WINDOW):
+        """
+        Args:
+            samples (int): Rates kept per interface and counter, the ring buffer capacity
+            window (float): Seconds the p95 gauges are computed over
+        """
+        log.debug("TrafficCollector.__init__(%s) for %s, %s samples", self, router, samples)
+        self.router = router
+        self.samples = max(2, int(samples))
+        self.interval = float(interval)
+        self.window = float(window)
+        # Interface name => InterfaceSeries
+        self.series = {}
+        self.last_round = None
+
+    def due(self, at_least=0.0):
+        """
+        Args:
+            at_least (float): Seconds a caller wants between samples even when `interval` is shorter
+        """
+        return self.last_round is None or time.monotonic() - self.last_round >= max(self.interval, at_least)
+
+    def collect(self, connection, devices_dict=None, metrics=None):
+        """
+        Sample the counters if a round is due, then attach the latest port rates to every device
+        Args:
+            connection (RouterOsApi): The poll's session
+            devices_dict (dict): MAC address => NetworkDevice
+        """
+        if self.due():
+            self.last_round = time.monotonic()
+            self.sample(connection, metrics)
+        self.attach(devices_dict or {})
+
+    def attach(self, devices_dict):
+        """Give devices their port's latest rates without sampling, e.g. devices rebuilt from a listen update"""
+        for device in devices_dict.values():
+            series = self.series.get(device.bridge_interface or device.arp_interface)
+            if series is not None:
+                device.set_port_traffic(series.latest('rx_bytes'), series.latest('tx_bytes'))
+
+    def _labels(self, interface, counter):
+        return {'router': self.router or '', 'interface': interface, 'counter': counter}
+
+    def sample(self, connection, metrics=None):
+        """
+        Returns:
+            dict: Interface name => rates per second, interfaces without a previous sample left out
+        """
+        now = time.monotonic()
+        results = {}
+        seen = set()
+        try:
+            for row in stream_rows(connection, INTERFACE_PATH, {'.proplist': ','.join(('name', *COUNTERS))}):
+                name = row.get('name')
+                if not name:
+                    continue
+                try:
+                    counters = {rate: int(row.get(field) or 0) for field, rate in COUNTERS.items()}
+                except ValueError:
+                    log.debug("[%s] Unreadable counters on %s: %s", self.router, name, row)
+                    continue
+                seen.add(name)
+                series = self.series.get(name)
+                if series is None:
+                    series = self.series[name] = InterfaceSeries(self.samples)
+                rates = series.add(counters, now)
+                if rates is not None:
+                    results[name] = rates
+        except RouterConnectionError as e:
+            # The print was refused (e.g. a read-only user without access), the poll itself goes on
+            log.error("[%s] Could not read interface counters: %s", self.router, str(e))
+            return results
+        # Removed interfaces take their history and gauges with them
+        for name in [name for name in self.series if name not in seen]:
+            log.debug("[%s] Interface %s is gone, dropping its traffic history", self.router, name)
+            del self.series[name]
+            for rate_name in COUNTERS.values():
+                labels = self._labels(name, rate_name)
+                REGISTRY.remove_gauge('network_monitor_interface_rate', labels)
+                REGISTRY.remove_gauge('network_monitor_interface_rate_p95', labels)
+
+        for name, rates in results.items():
+            series = self.series[name]
+            for rate_name, rate in rates.items():
+                labels = self._labels(name, rate_name)
+                REGISTRY.set_gauge('network_monitor_interface_rate', labels, rate)
+                summary = series.aggregate(rate_name, self.window, now)
+                if summary is not None:
+                    REGISTRY.set_gauge('network_monitor_interface_rate_p95', labels, summary['p95'])
+        if metrics:
+            metrics.count('interfaces', len(seen))
+        return results
+
+
+def traffic_factory(**options):
+    """
+    Args:
+        options: Passed to every collector, e.g. samples, interval, window
+    Returns:
+        callable: Router name => TrafficCollector
+    """
+    return lambda router: TrafficCollector(router, **options)
@@ -1,99 +1,602 @@
-from mikrotik.dhcp import DHCPLeaseManager
-from mikrotik.arp import ARPManager
-from mikrotik.bridge import BridgeHostManager
-from mikrotik.network_device import NetworkDevice
-from mikrotik.exceptions import *
-from mikrotik.login import RouterLogin
+from mikrotik.snapshot import RouterSnapshot
+from mikrotik.changes import DeviceChangeTracker
+from mikrotik.listen import TableListener
+from mikrotik.log_format import LazyJson
+from mikrotik.metrics import PollMetrics, PollProfiler, log_summary
+from mikrotik.login import RouterLogin, load_router_configs
+from mikrotik.pool import connection_pool
+from scheduler import PollScheduler, Backoff, AdaptiveSchedule
+from sinks import write_sinks, close_sinks
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging as log
-import json
+import threading
+import signal
+import os
+import time
 
-def main():
-    log.debug("Starting network device information gathering...")
-    router = RouterLogin().connect()
-    dhcp_manager = DHCPLeaseManager(router)
-    arp_manager = ARPManager(router)
-    bridge_manager = BridgeHostManager(router)
-    devices_dict = {}
 
-    log.debug("Compiling device information")
-    try:
-        log.debug("Fetching DHCP leases from router...")
-        dhcp_leases = dhcp_manager.get_all_leases()
-        log.debug(f"Found {len(dhcp_leases)} DHCP leases:\n {json.dumps(dhcp_leases, indent=2)}")
-        if not dhcp_leases:
-            log.error("No DHCP leases found in the network.")
-            raise NoDHCPLeasesError("No DHCP leases found in the network. This might indicate a DHCP server issue or network connectivity problem...")
-
-        log.debug("Processing DHCP leases...")
-        for lease in dhcp_leases:
-            ip_address = lease.get('address')
-            mac_address = lease.get('mac-address')
-            if not ip_address or not mac_address:
-                log.warning(f"Lease with missing IP or MAC address: {json.dumps(lease, indent=2)}")
+class NetworkMonitor:
+    """
+    Polls one router over a session leased from its connection pool (mikrotik/pool.py)
+    The session is returned after every poll, so between polls the pool can keep it alive and replace it if it died
+    """
+    def __init__(self, router_config=None, max_backoff=60.0, schedule=None):
+        log.debug("NetworkMonitor.__init__(%s)", self)
+        self.login = RouterLogin(router_config)
+        self.name = self.login.name
+        self.pool = connection_pool(self.login)
+        # PooledSession leased for the current poll (or for as long as a listener runs) and its connection
+        self.session = None
+        self.router = None
+        # Number of the session the snapshot was built on; another session means a fresh baseline
+        self.session_number = None
+        self.snapshot = None
+        self.listener = None
+        # Survives reconnects so a dropped session does not look like every device rejoining
+        self.tracker = DeviceChangeTracker(router=self.name)
+        self.backoff = Backoff(maximum=max_backoff)
+        self.retry_at = 0.0
+        self.last_metrics = None
+        # Anomaly.key() => Anomaly from the last analysed snapshot, so only changes are logged
+        self.anomalies = {}
+        # Optional AdaptiveSchedule deciding which tables each poll fetches, see scheduler.py
+        self.schedule = schedule
+        # Optional NotificationDispatcher that sees every poll and listen update, see notify.py
+        self.notifier = None
+        # Optional Prober confirming each device answers, see mikrotik/probe.py
+        self.prober = None
+        # Optional Enricher adding MAC vendors and reverse DNS names, see enrich.py
+        self.enricher = None
+        # Optional TrafficCollector sampling interface counters, see mikrotik/traffic.py
+        self.traffic = None
+
+    def connect(self, metrics=None):
+        log.debug("NetworkMonitor.connect(%s)", self)
+        metrics = metrics or PollMetrics(self.name)
+        with metrics.stage('connect'):
+            self.session = self.pool.acquire()
+        self.router = self.session.connection
+        if self.snapshot is not None and self.session.number == self.session_number:
+            # Same session as the last poll: the tables fetched on it are still a valid baseline
+            self.snapshot.bind(self.router)
+            return self.router
+        log.info("[%s] Connected to router at %s", self.name, self.login.host)
+        metrics.count('new_sessions')
+        self.session_number = self.session.number
+        self.snapshot = RouterSnapshot(self.router, router=self.name, queries=self.login.queries)
+        if self.schedule:
+            self.snapshot.track_churn = True
+            self.schedule.reset()
+        return self.router
+
+    def release(self):
+        """Return the session to the pool after a poll; a listener keeps its session until disconnect()"""
+        if self.session is None or self.listener:
+            return
+        self.pool.release(self.session)
+        self.session = None
+        self.router = None
+
+    def disconnect(self):
+        """Drop the session (closing it rather than returning it) and the snapshot built on it"""
+        log.debug("NetworkMonitor.disconnect(%s)", self)
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+        if self.session:
+            # After a failure or with listens outstanding, the session may hold unread replies
+            self.pool.release(self.session, discard=True)
+        # Just in case any manager borrowed a session of its own (which they shouldn't now)
+        if self.snapshot:
+            self.snapshot.disconnect()
+        self.session = None
+        self.router = None
+        self.session_number = None
+        self.snapshot = None
+
+    def is_connected(self):
+        return self.session is not None and self.session.is_connected()
+
+    def ensure_connected(self, metrics=None):
+        """
+        Connect unless still backing off from a previous failure
+        Args:
+            metrics (PollMetrics): Receives the connect stage if a connection is opened
+        Returns:
+            bool: True if there is a usable connection
+        """
+        if self.is_connected():
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.connect(metrics)
+            return True
+        except Exception as e:
+            self.fail(e)
+            return False
+
+    def fail(self, error):
+        """Drop the session and schedule the next reconnect attempt"""
+        delay = self.backoff.next_delay()
+        log.error("[%s] %s -- retrying in %.1fs", self.name, str(error), delay)
+        self.disconnect()
+        self.retry_at = time.monotonic() + delay
+
+    def due_tables(self):
+        """Tables the schedule wants fetched now, None (all of them) without an adaptive schedule"""
+        if not self.schedule:
+            return None
+        return self.schedule.due_tables()
+
+    def poll(self, metrics=None, tables=None):
+        log.debug("NetworkMonitor.poll(%s)", self)
+        if not self.is_connected():
+            snapshot = self.snapshot
+            self.connect(metrics)
+            if self.snapshot is not snapshot:
+                # A fresh snapshot has no earlier fetch to keep
+                tables = None
+        return self.snapshot.collect(metrics, tables)
+
+    def poll_changes(self, metrics=None, tables=None):
+        """
+        Poll and diff against the previous poll
+        Args:
+            metrics (PollMetrics): Receives every stage of the poll
+            tables (iterable): Tables to refresh, defaults to all of them
+        Returns:
+            tuple: (devices_dict, events, first) where first is True when there was no baseline to diff against
+        """
+        log.debug("NetworkMonitor.poll_changes(%s)", self)
+        metrics = metrics or PollMetrics(self.name)
+        devices_dict = self.poll(metrics, tables)
+        if self.schedule:
+            self.schedule.update(self.snapshot)
+        if self.prober:
+            with metrics.stage('probe'):
+                self.prober.probe(self.router, devices_dict, metrics)
+        if self.traffic:
+            with metrics.stage('traffic'):
+                self.traffic.collect(self.router, devices_dict, metrics)
+        if self.enricher:
+            with metrics.stage('enrich'):
+                self.enricher.enrich(devices_dict, metrics)
+        first = not self.tracker.has_baseline()
+        with metrics.stage('diff'):
+            events = self.tracker.update(devices_dict)
+        metrics.count('events', len(events))
+        new_anomalies = self.report_anomalies(self.snapshot.anomalies)
+        if self.notifier:
+            with metrics.stage('notify'):
+                self.notifier.observe(self.name, devices_dict, events, new_anomalies, baseline=first)
+        return devices_dict, events, first
+
+    def report_anomalies(self, anomalies):
+        """
+        Log anomalies that appeared since the last poll at WARNING and those that cleared at INFO
+        Returns:
+            list: The anomalies that appeared
+        """
+        current = {anomaly.key(): anomaly for anomaly in anomalies}
+        new_anomalies = []
+        for key, anomaly in current.items():
+            if key not in self.anomalies:
+                log.warning("[ANOMALY] %s", anomaly)
+                new_anomalies.append(anomaly)
+        for key, anomaly in self.anomalies.items():
+            if key not in current:
+                log.info("[ANOMALY] Resolved: %s", anomaly)
+        self.anomalies = current
+        return new_anomalies
+
+    def start_listening(self):
+        """Subscribe to table updates; call after a full poll so the snapshot is a complete baseline"""
+        log.debug("NetworkMonitor.start_listening(%s)", self)
+        self.listener = TableListener(self.session, self.snapshot)
+        self.listener.start()
+
+    def wait_for_changes(self, timeout=1.0):
+        """
+        Apply streamed table updates to the in-memory devices
+        Returns:
+            list: DeviceEvent objects for devices touched by the updates
+        """
+        changed = self.listener.wait_for_updates(timeout)
+        if not changed:
+            return []
+        changed_devices = {mac: self.snapshot.build_device(mac) for mac in changed}
+        rebuilt = {mac: device for mac, device in changed_devices.items() if device is not None}
+        if self.prober:
+            self.prober.attach(rebuilt)
+        if self.traffic:
+            self.traffic.attach(rebuilt)
+        if self.enricher:
+            self.enricher.enrich(rebuilt)
+        events = self.tracker.apply(changed_devices)
+        if self.notifier:
+            # No snapshot analysis runs on listen updates, so the notifier checks the changed devices itself
+            self.notifier.observe(self.name, rebuilt, events)
+        return events
+
+    def run_listener(self, scheduler):
+        """Stream changes until the scheduler is stopped, resyncing after every (re)connect"""
+        log.debug("NetworkMonitor.run_listener(%s)", self)
+        while not scheduler.stopped():
+            if not self.ensure_connected():
+                scheduler.sleep(max(0.0, self.retry_at - time.monotonic()))
                 continue
+            try:
+                if self.listener:
+                    report_changes(self.wait_for_changes(timeout=1.0))
+                    # The listen loop turns every second, so rounds are kept at least a daemon interval apart
+                    if self.prober and self.prober.due(scheduler.interval):
+                        # Pings go out on the listen session, its updates are filed for the next wait_for_changes()
+                        self.prober.probe(self.router, self.tracker.devices)
+                    if self.traffic and self.traffic.due(scheduler.interval):
+                        # Sampled on the listen session, its updates are filed for the next wait_for_changes()
+                        self.traffic.collect(self.router, self.tracker.devices)
+                else:
+                    metrics = PollMetrics(self.name)
+                    devices_dict, events, first = self.poll_changes(metrics)
+                    with metrics.stage('report'):
+                        if first:
+                            report_devices(devices_dict)
+                        else:
+                            report_changes(events)
+                    self.start_listening()
+                    self.last_metrics = metrics.finish()
+                    log_summary(metrics)
+                self.backoff.reset()
+            except Exception as e:
+                # Drop the session so the next pass resyncs from a full snapshot
+                self.fail(e)
 
-            if mac_address not in devices_dict:
-                log.debug(f"Creating new device entry for MAC: {mac_address}")
-                devices_dict[mac_address] = NetworkDevice(mac_address)
-            log.debug(f"Adding DHCP data to device with MAC: {mac_address}")
-            devices_dict[mac_address].add_dhcp_data(lease)
-
-            log.debug(f"Fetching ARP entry for MAC: {mac_address}")
-            arp_entry = arp_manager.get_arp_by_mac(mac_address)
-            if arp_entry:
-                log.debug(f"Adding ARP data to device with MAC: {mac_address}")
-                devices_dict[mac_address].add_arp_data(arp_entry)
-            else:
-                log.warning(f"No ARP entry found for MAC: {mac_address}")
 
-            log.debug(f"Fetching bridge data for MAC: {mac_address}")
-            bridge_entry = bridge_manager.get_bridge_host_by_mac(mac_address)
-            if bridge_entry:
-                log.debug(f"Adding bridge data to device with MAC: {mac_address}")
-                devices_dict[mac_address].add_bridge_data(bridge_entry)
+class RouterFleet:
+    """
+    Runs the same operation against every configured router in parallel
+    Each router has its own NetworkMonitor and connection pool, with at most `max_workers` in flight at once
+    """
+    def __init__(self, router_configs=None, max_workers=8, timeout=None, max_backoff=60.0, profiler=None, schedule=None, notifier=None, prober=None, enricher=None, traffic=None):
+        """
+        Args:
+            schedule (callable): Router name => AdaptiveSchedule, for per-table adaptive polling
+            notifier (NotificationDispatcher): Shared by every router's monitor, see notify.py
+            prober (callable): Router name => Prober, to actively probe every device after each poll
+            enricher (Enricher): Shared by every router's monitor, see enrich.py
+            traffic (callable): Router name => TrafficCollector, to sample interface counters with each poll
+        """
+        log.debug("RouterFleet.__init__(%s)", self)
+        if router_configs is None:
+            router_configs = load_router_configs()
+        self.monitors = []
+        for router_config in router_configs:
+            monitor = NetworkMonitor(router_config, max_backoff=max_backoff)
+            if schedule:
+                monitor.schedule = schedule(monitor.name)
+            monitor.notifier = notifier
+            if prober:
+                monitor.prober = prober(monitor.name)
+            monitor.enricher = enricher
+            if traffic:
+                monitor.traffic = traffic(monitor.name)
+            self.monitors.append(monitor)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(self.monitors))),
+            thread_name_prefix="router"
+        )
+        # Polls that overran the fleet timeout, skipped until they finish
+        self._pending = {}
+        # Optional PollProfiler, see mikrotik/metrics.py
+        self.profiler = profiler
+
+    def close(self):
+        log.debug("RouterFleet.close(%s)", self)
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for monitor in self.monitors:
+            monitor.disconnect()
+            monitor.pool.close()
+
+    def _poll_router(self, monitor):
+        if self.profiler:
+            return self.profiler.run(monitor.name, self._poll_router_measured, monitor)
+        return self._poll_router_measured(monitor)
+
+    def _poll_router_measured(self, monitor):
+        metrics = PollMetrics(monitor.name)
+        try:
+            if not monitor.ensure_connected(metrics):
+                return None
+            tables = monitor.due_tables()
+            if tables is not None and not tables:
+                # Adaptive polling: nothing is due on this router this tick
+                return None
+            result = monitor.poll_changes(metrics, tables)
+            monitor.backoff.reset()
+            return result
+        except Exception as e:
+            if monitor.is_connected():
+                log.error("[%s] %s", monitor.name, str(e))
             else:
-                log.warning(f"No bridge entry found for MAC: {mac_address}")
-
-
-        log.info(f"Compiled information for {len(devices_dict)} devices.")
-        log.info(f"\n{("=" * 80)}\nNetwork Devices Information: \n{("=" * 80)}\n")
-        
-        for ip, device in devices_dict.items():
-            device_info = device.get_merged_data()
-            log.info(
-                f"Device Details:\n{("-" * 40)}\n"
-                f"IP Address:\t{device_info.get('ip_address')}\n"
-                f"MAC Address:\t{device_info.get('mac_address')}\n"
-                f"Hostname:\t{device_info.get('hostname')}\n"
-                f"Interface:\t{device_info.get('interface')}\n"
-                f"DHCP Status:\t{device_info.get('dhcp_status')}\n"
-                f"ARP Status:\t{device_info.get('arp_status')}\n"
-                f"Last Seen:\t{device_info.get('last_seen')}\n"
-                f"Dynamic:\t{device_info.get('dynamic')}\n"
-                f"Static Lease:\t{device_info.get('static_lease')}\n"
-                f"Bridge:\t\t{device_info.get('bridge')}\n"
-                f"Bridge Port:\t{device_info.get('bridge_interface')}\n"
-                f"Bridge Status:\t{device_info.get('bridge_status')}\n"
-                f"On Bridge:\t{device_info.get('on_bridge')}\n"
-                f"Bridge Local:\t{device_info.get('bridge_local')}\n"
-                f"Comment:\t{device_info.get('comment')}"
-            )
-            
-            if device_info.get('conflicts'):
-                log.warning(
-                    f"Conflicts detected:\n"
-                    f"{json.dumps(device_info.get('conflict_details'), indent=2)}"
-                )
-            log.info(f"\n{"-"*40}")
+                monitor.fail(e)
+            return None
+        finally:
+            monitor.release()
+            if metrics.stages:
+                monitor.last_metrics = metrics.finish()
+                log_summary(metrics)
+
+    def poll_changes(self):
+        """
+        Poll every router whose previous poll has finished
+        Returns:
+            tuple: (inventory, events, baselines) where inventory maps (router, MAC) => NetworkDevice,
+                   events is every router's DeviceEvent list combined, and baselines lists the routers
+                   that had nothing to diff against yet
+        """
+        log.debug("RouterFleet.poll_changes(%s)", self)
+        profiling = self.profiler.begin_round() if self.profiler else False
+        futures = {}
+        for monitor in self.monitors:
+            if monitor.name in self._pending and not self._pending[monitor.name].done():
+                log.warning("[%s] Previous poll is still running, skipping this round", monitor.name)
+                continue
+            self._pending.pop(monitor.name, None)
+            futures[self.executor.submit(self._poll_router, monitor)] = monitor
+
+        done, not_done = wait(futures, timeout=self.timeout)
+        if profiling:
+            self.profiler.end_round()
+        for future in not_done:
+            monitor = futures[future]
+            log.error("[%s] No answer within %ss", monitor.name, self.timeout)
+            self._pending[monitor.name] = future
+
+        inventory, events, baselines = {}, [], []
+        for future in done:
+            monitor = futures[future]
+            result = future.result()
+            if result is None:
+                continue
+            devices_dict, router_events, first = result
+            inventory.update({(monitor.name, mac): device for mac, device in devices_dict.items()})
+            events.extend(router_events)
+            if first:
+                baselines.append(monitor.name)
+        return inventory, events, baselines
+
+    def inventory(self, connected_only=False):
+        """
+        Latest known devices of every router, whether polled or streamed
+        Args:
+            connected_only (bool): Leave out routers whose session is currently down
+        Returns:
+            dict: (router, MAC) => NetworkDevice
+        """
+        inventory = {}
+        for monitor in self.monitors:
+            if connected_only and not monitor.is_connected():
+                continue
+            # Copy first, a listener thread may be folding updates into the tracker
+            devices = dict(monitor.tracker.devices)
+            inventory.update({(monitor.name, mac): device for mac, device in devices.items()})
+        return inventory
+
+    def run_listeners(self, scheduler, on_interval=None):
+        """
+        One listener thread per router, returning once the scheduler is stopped
+        Args:
+            on_interval (callable): Called every scheduler interval while the listeners run
+        """
+        threads = [
+            threading.Thread(target=monitor.run_listener, args=(scheduler,), name=f"listen-{monitor.name}", daemon=True)
+            for monitor in self.monitors
+        ]
+        for thread in threads:
+            thread.start()
+        while scheduler.wait_next():
+            if on_interval:
+                on_interval()
+        for thread in threads:
+            thread.join()
+
 
+DEVICE_REPORT = (
+    "Device Details:\n%(rule)s\n"
+    "Router:\t\t%(router)s\n"
+    "IP Address:\t%(ip_address)s\n"
+    "MAC Address:\t%(mac_address)s\n"
+    "Hostname:\t%(hostname)s\n"
+    "Interface:\t%(interface)s\n"
+    "DHCP Status:\t%(dhcp_status)s\n"
+    "ARP Status:\t%(arp_status)s\n"
+    "Last Seen:\t%(last_seen)s\n"
+    "Dynamic:\t%(dynamic)s\n"
+    "Static Lease:\t%(static_lease)s\n"
+    "Bridge:\t\t%(bridge)s\n"
+    "Bridge Port:\t%(bridge_interface)s\n"
+    "Bridge Status:\t%(bridge_status)s\n"
+    "On Bridge:\t%(on_bridge)s\n"
+    "Bridge Local:\t%(bridge_local)s\n"
+    "Comment:\t%(comment)s\n"
+    "%(rule)s"
+)
+
+
+def report_devices(devices_dict):
+    """
+    Write the device report as one log record instead of one per device
+    Nothing is merged or formatted unless INFO is enabled; conflicts are collected into a single warning
+    """
+    log.info("Compiled information for %s devices.", len(devices_dict))
+    if not log.getLogger().isEnabledFor(log.INFO):
+        return
+
+    blocks = []
+    conflicts = []
+    for key, device in devices_dict.items():
+        device_info = device.get_merged_data()
+        blocks.append(DEVICE_REPORT % dict(device_info, rule="-" * 40))
+        if device_info.get('conflicts'):
+            conflicts.append((device_info.get('router'), device_info.get('mac_address'), device_info.get('conflict_details')))
+
+    log.info("\n%s\nNetwork Devices Information: \n%s\n%s", "=" * 80, "=" * 80, "\n".join(blocks))
+    if conflicts:
+        log.warning(
+            "Conflicts detected on %s device(s):\n%s",
+            len(conflicts),
+            "\n".join(f"[{router}] {mac}: {LazyJson(details)}" for router, mac, details in conflicts)
+        )
+
+
+def report_changes(events):
+    if not events:
+        log.debug("No device changes since the last poll")
+        return
+    log.info("%s device change(s) since the last poll", len(events))
+    for event in events:
+        log.info("[CHANGE] %s", event)
+
+
+def record_history(history, inventory, routers=None):
+    if history is None:
+        return
+    try:
+        history.record(inventory, routers=routers)
     except Exception as e:
-        log.error(f"{str(e)}")
+        log.error("Error recording device history: %s", str(e))
+
+
+def publish(inventory, report_inventory, events, sinks, history, report=True, history_routers=None):
+    """Everything done with a round's results, timed as the fleet-wide (router="") stages"""
+    metrics = PollMetrics()
+    with metrics.stage('report'):
+        if report and report_inventory:
+            report_devices(report_inventory)
+        report_changes(events)
+    if sinks:
+        with metrics.stage('sinks'):
+            write_sinks(sinks, inventory)
+    if history is not None:
+        with metrics.stage('history'):
+            record_history(history, inventory, routers=history_routers)
+    log_summary(metrics.finish(), level=log.DEBUG)
+
+
+def main(max_workers=8, timeout=None, sinks=None, report=True, history=None, profile_dir=None, notifier=None, prober=None, enricher=None):
+    log.debug("Starting network device information gathering...")
+    sinks = sinks or []
+    profiler = PollProfiler(profile_dir) if profile_dir else None
+    if profiler:
+        profiler.request()
+    fleet = RouterFleet(max_workers=max_workers, timeout=timeout, profiler=profiler, notifier=notifier, prober=prober, enricher=enricher)
+
+    log.debug("Compiling device information")
+    try:
+        inventory, events, baselines = fleet.poll_changes()
+        publish(inventory, inventory, [], sinks, history, report=report)
+    except Exception as e:
+        log.error("%s", str(e))
+    finally:
+        fleet.close()
+        close_sinks(sinks)
+        if history:
+            history.close()
+        if notifier:
+            notifier.close()
+
+
+def run_daemon(interval, max_backoff=60.0, listen=False, max_workers=8, timeout=None, sinks=None, report=True, history=None, profile_dir=None, adaptive=None, notifier=None, checkpoint=None, prober=None, enricher=None, traffic=None):
+    """
+    Args:
+        adaptive (tuple): (floor, ceiling) seconds to poll each table on its own churn-driven interval, starting at `interval`
+        checkpoint (CheckpointStore): Restores the devices known before a restart and saves them periodically, see checkpoint.py
+        prober (callable): Router name => Prober, see mikrotik/probe.py; in listen mode rounds run on the listen session, at most once per `interval`
+        traffic (callable): Router name => TrafficCollector, see mikrotik/traffic.py; in listen mode sampled on the listen session between updates, at most once per `interval`
+    """
+    sinks = sinks or []
+    schedule = None
+    tick = interval
+    if listen:
+        log.info("[DAEMON] Streaming table updates (reconnect backoff capped at %ss)", max_backoff)
+        if adaptive:
+            log.warning("[DAEMON] Adaptive polling does not apply in listen mode, ignoring it")
+    elif adaptive:
+        floor, ceiling = adaptive
+        log.info("[DAEMON] Polling each table every %ss to %ss depending on churn (reconnect backoff capped at %ss)", floor, ceiling, max_backoff)
+        schedule = lambda router: AdaptiveSchedule(router, floor, ceiling, initial=interval)
+        # Tick at the floor; each tick only fetches the tables that are due
+        tick = floor
+    else:
+        log.info("[DAEMON] Polling every %ss (reconnect backoff capped at %ss)", interval, max_backoff)
+    profiler = PollProfiler(profile_dir) if profile_dir else None
+    fleet = RouterFleet(max_workers=max_workers, timeout=timeout, max_backoff=max_backoff, profiler=profiler, schedule=schedule, notifier=notifier, prober=prober, enricher=enricher, traffic=traffic)
+    scheduler = PollScheduler(tick)
+    if checkpoint and checkpoint.restore(fleet) and sinks:
+        # Serve the last known devices straight away rather than after the first poll
+        write_sinks(sinks, fleet.inventory())
+
+    def handle_signal(signum, frame):
+        log.info("[DAEMON] Received signal %s, shutting down...", signum)
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    if profiler and hasattr(signal, 'SIGUSR1'):
+        log.info("[DAEMON] Send SIGUSR1 (kill -USR1 %s) to profile the next poll into %s", os.getpid(), profile_dir)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request())
+
+    try:
+        if listen:
+            # Listeners update the inventory continuously; sinks and history get a copy once per interval
+            def on_interval():
+                metrics = PollMetrics()
+                if sinks:
+                    with metrics.stage('sinks'):
+                        write_sinks(sinks, fleet.inventory())
+                if history is not None:
+                    with metrics.stage('history'):
+                        connected = fleet.inventory(connected_only=True)
+                        record_history(history, connected, routers=[monitor.name for monitor in fleet.monitors if monitor.is_connected()])
+                if checkpoint:
+                    with metrics.stage('checkpoint'):
+                        checkpoint.save_due(fleet)
+                log_summary(metrics.finish(), level=log.DEBUG)
+
+            fleet.run_listeners(scheduler, on_interval=on_interval)
+            return
+
+        while not scheduler.stopped():
+            try:
+                inventory, events, baselines = fleet.poll_changes()
+                publish(
+                    # Routers skipped this round still contribute their last known devices
+                    fleet.inventory() if sinks else inventory,
+                    {key: device for key, device in inventory.items() if key[0] in baselines},
+                    [event for event in events if event.router not in baselines],
+                    sinks,
+                    history,
+                    report=report,
+                    history_routers={router for router, _ in inventory}
+                )
+                if checkpoint:
+                    checkpoint.save_due(fleet)
+            except Exception as e:
+                log.error("%s", str(e))
+            scheduler.wait_next()
     finally:
-        router.disconnect()
-        # Just in case any manager opened its own connection (which they shouldn't now)
-        dhcp_manager.disconnect()
-        arp_manager.disconnect()
-        bridge_manager.disconnect()
+        if checkpoint:
+            checkpoint.save(fleet)
+        fleet.close()
+        close_sinks(sinks)
+        if history:
+            history.close()
+        if notifier:
+            notifier.close()
+        log.info("[DAEMON] Stopped")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
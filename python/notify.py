@@ -0,0 +1,401 @@
+"""
+Notification Dispatcher Module
+Turns poll results into alerts and delivers them to webhooks, a local Unix socket or a spool directory
+
+Rules (see NotificationDispatcher.observe):
+    unknown_device   a MAC that is neither listed in the known MACs file nor seen earlier in this process joins
+    static_offline   a device with a static DHCP lease leaves, or its lease stops being bound, or its ARP entry fails
+    ip_mismatch      a device's DHCP lease and ARP entry start disagreeing on its IP address
+
+observe() only evaluates the rules and queues what they produce, so it costs the poll a set update and a
+pass over the poll's events. A single worker thread coalesces everything queued within `window` seconds
+into one batch per target; a notification already sent within `ttl` seconds is dropped as a duplicate,
+and when the bounded queue is full new notifications are dropped and counted instead of blocking the poll
+"""
+
+from datetime import datetime, timezone
+from mikrotik.analysis import Anomaly
+from mikrotik.changes import DeviceEvent
+from mikrotik.metrics import REGISTRY
+from mikrotik.parse import format_ipv4
+import logging as log
+import threading
+import queue
+import json
+import time
+import os
+
+DEFAULT_WINDOW = 10.0
+DEFAULT_TTL = 3600.0
+DEFAULT_QUEUE_SIZE = 1000
+# Notifications per delivered batch; the rest of a burst is summarized as a count per kind
+DEFAULT_MAX_BATCH = 100
+# Seconds a target may take to accept a batch
+DEFAULT_TARGET_TIMEOUT = 5.0
+# Expired duplicate-suppression entries are swept once the cache grows past this
+DEDUP_SWEEP_SIZE = 4096
+
+OFFLINE_ARP_STATUSES = ('failed', 'incomplete', 'noARP')
+
+# Stops the worker once everything queued before it has been delivered
+_STOP = object()
+
+
+class Notification:
+    UNKNOWN_DEVICE = 'unknown_device'
+    STATIC_OFFLINE = 'static_offline'
+    IP_MISMATCH = 'ip_mismatch'
+
+    __slots__ = ('kind', 'router', 'subject', 'message', 'details', 'at')
+
+    def __init__(self, kind, subject, message, details=None, router=None):
+        self.kind = kind
+        self.router = router
+        # The MAC address the notification is about
+        self.subject = subject
+        self.message = message
+        self.details = details or {}
+        self.at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    def key(self):
+        """Identity used for duplicate suppression"""
+        return (self.kind, self.router, self.subject)
+
+    def to_dict(self):
+        return {'notification': self.kind, 'router': self.router, 'subject': self.subject, 'message': self.message, 'at': self.at, **self.details}
+
+    def __repr__(self):
+        prefix = f"[{self.router}] " if self.router else ""
+        return f"{prefix}{self.kind} {self.subject}: {self.message}"
+
+
+def load_known_macs(path):
+    """One MAC per line (':' or '-' separated, any case); blank lines and '#' comments are ignored"""
+    known = set()
+    with open(path, encoding='utf-8') as known_file:
+        for line in known_file:
+            mac = line.split('#', 1)[0].strip().upper().replace('-', ':')
+            if mac:
+                known.add(mac)
+    log.debug("Loaded %s known MAC addresses from %s", len(known), path)
+    return known
+
+
+def device_details(device):
+    """Identifying fields of a NetworkDevice, read from its attributes without building get_merged_data()"""
+    ip_address = device.ip_address
+    return {
+        'ip_address': format_ipv4(ip_address) if ip_address is not None else None,
+        'hostname': device.dhcp_host_name or 'N/A',
+        'comment': device.dhcp_comment or '',
+        'interface': device.arp_interface or 'noARP',
+        'bridge_interface': device.bridge_interface or 'noBridge',
+    }
+
+
+class NotificationTarget:
+    """Base class; send() gets one batch (a dict, see NotificationDispatcher.batch) and raises on failure"""
+    def send(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WebhookTarget(NotificationTarget):
+    """POSTs each batch as JSON"""
+    def __init__(self, url, timeout=DEFAULT_TARGET_TIMEOUT):
+        log.debug("WebhookTarget.__init__(%s) with url: %s", self, url)
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, batch):
+        # Imported on first delivery, most runs never notify
+        from urllib.request import Request, urlopen
+        request = Request(self.url, data=json.dumps(batch).encode(), headers={'Content-Type': 'application/json'}, method='POST')
+        with urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def __repr__(self):
+        return f"webhook:{self.url}"
+
+
+class UnixSocketTarget(NotificationTarget):
+    """Connects to a local stream socket per batch and writes one JSON object per notification (NDJSON)"""
+    def __init__(self, path, timeout=DEFAULT_TARGET_TIMEOUT):
+        log.debug("UnixSocketTarget.__init__(%s) with path: %s", self, path)
+        self.path = path
+        self.timeout = timeout
+
+    def send(self, batch):
+        import socket
+        lines = ''.join(json.dumps(notification) + '\n' for notification in batch['notifications'])
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            sock.sendall(lines.encode())
+
+    def __repr__(self):
+        return f"unix:{self.path}"
+
+
+class SpoolTarget(NotificationTarget):
+    """Writes each batch to its own JSON file, renamed into place so a reader never sees a partial one"""
+    def __init__(self, directory):
+        log.debug("SpoolTarget.__init__(%s) with directory: %s", self, directory)
+        self.directory = directory
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, batch):
+        self.sequence += 1
+        name = f"{time.time_ns()}-{os.getpid()}-{self.sequence}.json"
+        temporary = os.path.join(self.directory, f".{name}.tmp")
+        with open(temporary, 'w', encoding='utf-8') as spool_file:
+            json.dump(batch, spool_file)
+        os.replace(temporary, os.path.join(self.directory, name))
+
+    def __repr__(self):
+        return f"spool:{self.directory}"
+
+
+TARGET_TYPES = {
+    'webhook': WebhookTarget,
+    'unix': UnixSocketTarget,
+    'spool': SpoolTarget,
+}
+
+
+def create_target(spec):
+    """
+    Build a target from a 'type:target' spec
+    Examples: 'webhook:https://hooks.example.com/network', 'unix:/run/network-monitor.sock', 'spool:/var/spool/network-monitor'
+    A bare http(s) URL is taken as a webhook
+    """
+    spec = spec.strip()
+    if spec.startswith(('http://', 'https://')):
+        return WebhookTarget(spec)
+    kind, _, target = spec.partition(':')
+    kind = kind.lower()
+    if kind not in TARGET_TYPES:
+        raise ValueError(f"Unknown notification target '{kind}', expected one of: {', '.join(TARGET_TYPES)}")
+    if not target:
+        raise ValueError(f"Notification target '{spec}' needs a URL or path")
+    return TARGET_TYPES[kind](target)
+
+
+class NotificationDispatcher:
+    """Evaluates the alert rules on every poll and delivers the results asynchronously; see the module docstring"""
+    def __init__(self, targets, known_macs=None, window=DEFAULT_WINDOW, ttl=DEFAULT_TTL, queue_size=DEFAULT_QUEUE_SIZE, max_batch=DEFAULT_MAX_BATCH):
+        """
+        Args:
+            targets (list): NotificationTarget objects, every batch goes to each of them
+            known_macs (set): Upper-cased MAC addresses that never count as unknown
+            window (float): Seconds notifications are coalesced for before a batch is sent
+            ttl (float): Seconds a sent notification suppresses identical ones (same kind, router and MAC)
+        """
+        log.debug("NotificationDispatcher.__init__(%s) targets: %s window: %ss ttl: %ss", self, targets, window, ttl)
+        self.targets = list(targets)
+        self.known_macs = set(known_macs or ())
+        self.window = float(window)
+        self.ttl = float(ttl)
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # Router => MACs seen in this process, so a device coming back is not unknown
+        self._seen = {}
+        # Router => MACs holding a static lease as of the last poll
+        self._static = {}
+        # Notification.key() => monotonic time until which it is suppressed
+        self._sent = {}
+        self._worker = threading.Thread(target=self._run, name="notify", daemon=True)
+        self._worker.start()
+
+    def observe(self, router, devices, events, anomalies=None, baseline=False):
+        """
+        Evaluate the rules for one router's poll (or listen update) and queue what they produce
+        Args:
+            router (str): Router name
+            devices (dict): MAC => NetworkDevice, the whole inventory after a poll or just the changed devices
+            events (list): DeviceEvent objects for this poll
+            anomalies (list): Anomaly objects that are new this poll; None checks the devices in `devices` instead
+            baseline (bool): First poll of the router, whose devices did not join but were already there
+        """
+        notifications = []
+        with self._lock:
+            seen = self._seen.setdefault(router, set())
+            static = self._static.setdefault(router, set())
+            if baseline:
+                seen.update(devices)
+            else:
+                for event in events:
+                    if event.kind == DeviceEvent.JOINED and event.mac_address not in seen and event.mac_address not in self.known_macs:
+                        seen.add(event.mac_address)
+                        device = devices.get(event.mac_address)
+                        details = device_details(device) if device is not None else {'ip_address': event.new}
+                        notifications.append(Notification(
+                            Notification.UNKNOWN_DEVICE, event.mac_address, f"Unknown device joined at {details['ip_address']}", details, router=router
+                        ))
+                    elif event.mac_address in static and self._went_offline(event):
+                        device = devices.get(event.mac_address)
+                        details = device_details(device) if device is not None else {'ip_address': event.old}
+                        details.update(event.to_dict())
+                        notifications.append(Notification(
+                            Notification.STATIC_OFFLINE, event.mac_address, f"Static lease device went offline ({event})", details, router=router
+                        ))
+                    if event.kind == DeviceEvent.LEFT:
+                        static.discard(event.mac_address)
+                seen.update(devices)
+
+            # Devices reported in full replace the set; a partial update only touches its own devices
+            if anomalies is not None:
+                static.clear()
+            for mac_address, device in devices.items():
+                if device.dhcp_dynamic is False:
+                    static.add(mac_address)
+                else:
+                    static.discard(mac_address)
+
+        if anomalies is None:
+            for mac_address, device in devices.items():
+                mismatch = device.get_conflict_details().get('ip_mismatch')
+                if mismatch:
+                    notifications.append(Notification(
+                        Notification.IP_MISMATCH, mac_address, f"DHCP lease {mismatch['dhcp_ip']} but ARP {mismatch['arp_ip']}", dict(mismatch), router=router
+                    ))
+        else:
+            for anomaly in anomalies:
+                if anomaly.kind == Anomaly.IP_MISMATCH:
+                    notifications.append(Notification(
+                        Notification.IP_MISMATCH, anomaly.subject, f"DHCP lease {anomaly.details['dhcp_ip']} but ARP {anomaly.details['arp_ip']}", dict(anomaly.details), router=router
+                    ))
+
+        for notification in notifications:
+            self.notify(notification)
+
+    def restore(self, router, devices):
+        """
+        Seed what a restarted collector knew about a router, so its restored devices are not unknown when
+        they rejoin and a static lease device going offline is still reported
+        Args:
+            devices (dict): MAC => NetworkDevice, e.g. from a checkpoint
+        """
+        with self._lock:
+            self._seen.setdefault(router, set()).update(devices)
+            static = self._static.setdefault(router, set())
+            static.update(mac_address for mac_address, device in devices.items() if device.dhcp_dynamic is False)
+
+    @staticmethod
+    def _went_offline(event):
+        if event.kind == DeviceEvent.LEFT:
+            return True
+        if event.field == 'dhcp_status':
+            return event.old == 'bound'
+        if event.field == 'arp_status':
+            return event.new in OFFLINE_ARP_STATUSES and event.old not in OFFLINE_ARP_STATUSES
+        return False
+
+    def notify(self, notification):
+        """
+        Queue one notification unless a duplicate was sent within the TTL
+        Returns:
+            bool: True if it was queued
+        """
+        now = time.monotonic()
+        key = notification.key()
+        with self._lock:
+            if self._sent.get(key, 0.0) > now:
+                REGISTRY.increment('network_monitor_notifications_dropped_total', {'reason': 'duplicate'})
+                log.debug("Suppressed duplicate notification: %s", notification)
+                return False
+            self._sent[key] = now + self.ttl
+            if len(self._sent) > DEDUP_SWEEP_SIZE:
+                self._sent = {key: until for key, until in self._sent.items() if until > now}
+        try:
+            self.queue.put_nowait(notification)
+        except queue.Full:
+            # Not sent, so a retry within the TTL must not be suppressed as a duplicate
+            with self._lock:
+                self._sent.pop(key, None)
+            REGISTRY.increment('network_monitor_notifications_dropped_total', {'reason': 'queue_full'})
+            log.warning("[NOTIFY] Queue full, dropped: %s", notification)
+            return False
+        log.info("[NOTIFY] %s", notification)
+        return True
+
+    def batch(self, notifications):
+        """The payload every target receives: at most max_batch notifications and a count of the rest per kind"""
+        sent, rest = notifications[:self.max_batch], notifications[self.max_batch:]
+        suppressed = {}
+        for notification in rest:
+            suppressed[notification.kind] = suppressed.get(notification.kind, 0) + 1
+        return {
+            'sent_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'count': len(notifications),
+            'suppressed': suppressed,
+            'notifications': [notification.to_dict() for notification in sent],
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            notifications = [item]
+            # Coalesce whatever else arrives within the window into the same batch
+            deadline = time.monotonic() + self.window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                notifications.append(item)
+            self._deliver(self.batch(notifications))
+
+    def _deliver(self, batch):
+        for target in self.targets:
+            labels = {'target': type(target).__name__}
+            try:
+                target.send(batch)
+                REGISTRY.increment('network_monitor_notifications_total', dict(labels, result='sent'), batch['count'])
+                log.debug("[NOTIFY] Delivered %s notification(s) to %s", batch['count'], target)
+            except Exception as e:
+                REGISTRY.increment('network_monitor_notifications_total', dict(labels, result='failed'), batch['count'])
+                log.error("[NOTIFY] Delivering %s notification(s) to %s failed: %s", batch['count'], target, str(e))
+
+    def close(self, timeout=None):
+        """Deliver what is queued (without waiting out the window) and stop the worker"""
+        log.debug("NotificationDispatcher.close(%s)", self)
+        timeout = timeout if timeout is not None else DEFAULT_TARGET_TIMEOUT * (len(self.targets) + 1)
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            log.error("[NOTIFY] Queue still full at shutdown, undelivered notifications are lost")
+        self._worker.join(timeout)
+        for target in self.targets:
+            try:
+                target.close()
+            except Exception as e:
+                log.error("Error closing %s: %s", target, str(e))
+
+
+def create_dispatcher(specs, known_macs_path=None, window=DEFAULT_WINDOW, ttl=DEFAULT_TTL):
+    """
+    Args:
+        specs (list): Target specs for create_target()
+        known_macs_path (str): File for load_known_macs()
+    Returns:
+        NotificationDispatcher: None when no target is configured
+    """
+    targets = [create_target(spec) for spec in specs or [] if spec.strip()]
+    if not targets:
+        return None
+    known_macs = load_known_macs(known_macs_path) if known_macs_path else None
+    return NotificationDispatcher(targets, known_macs=known_macs, window=window, ttl=ttl)
@@ -0,0 +1,168 @@
+from mikrotik.parse import parse_duration
+from mikrotik.metrics import REGISTRY
+import logging as log
+import random
+import threading
+import time
+
+
+class PollScheduler:
+    """
+    Fixed cadence poll timer
+    Deadlines are anchored to the start time (start + n * interval) so a slow poll
+    does not push every later poll back. Deadlines that were missed entirely are skipped.
+    """
+    def __init__(self, interval):
+        log.debug("PollScheduler.__init__(%s) with interval: %s", self, interval)
+        if interval <= 0:
+            raise ValueError(f"Poll interval must be positive, got {interval}")
+        self.interval = float(interval)
+        self.next_deadline = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        log.debug("PollScheduler.stop(%s)", self)
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def sleep(self, seconds):
+        """
+        Interruptible sleep
+        Returns:
+            bool: True if the full time elapsed, False if stop() was called
+        """
+        return not self._stop_event.wait(max(0.0, seconds))
+
+    def wait_next(self):
+        """
+        Block until the next poll deadline
+        Returns:
+            bool: True when it is time to poll, False if the scheduler was stopped
+        """
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        self.next_deadline += self.interval
+
+        if self.next_deadline < now:
+            missed = int((now - self.next_deadline) // self.interval) + 1
+            log.warning("Poll overran its interval, skipping %s missed poll(s)", missed)
+            self.next_deadline += missed * self.interval
+
+        return self.sleep(self.next_deadline - now)
+
+    def reset(self):
+        log.debug("PollScheduler.reset(%s)", self)
+        self.next_deadline = None
+
+
+class Backoff:
+    """Exponential backoff with full jitter for reconnect attempts"""
+    def __init__(self, base=1.0, maximum=60.0):
+        log.debug("Backoff.__init__(%s) with base: %s, maximum: %s", self, base, maximum)
+        self.base = float(base)
+        self.maximum = float(maximum)
+        self.attempts = 0
+
+    def next_delay(self):
+        ceiling = min(self.maximum, self.base * (2 ** self.attempts))
+        self.attempts += 1
+        return random.uniform(self.base, max(self.base, ceiling))
+
+    def reset(self):
+        self.attempts = 0
+
+
+class TableRate:
+    """
+    Poll interval of one table, adjusted after every fetch of it
+    Any churn halves the interval, a quiet fetch grows it by half; the result is then raised so the
+    table keeps the router's API busy for at most `latency_share` of the time, capped by an optional
+    hint, and clamped to [floor, ceiling]
+    """
+    def __init__(self, name, floor, ceiling, initial=None, churn_threshold=0.0, latency_share=0.1):
+        if floor <= 0 or ceiling < floor:
+            raise ValueError(f"Adaptive poll bounds must satisfy 0 < floor <= ceiling, got {floor} and {ceiling}")
+        self.name = name
+        self.floor = float(floor)
+        self.ceiling = float(ceiling)
+        self.interval = min(max(float(initial or floor), self.floor), self.ceiling)
+        self.churn_threshold = churn_threshold
+        self.latency_share = latency_share
+        # Monotonic time the table is next due; 0 fetches it on the first poll
+        self.next_due = 0.0
+
+    def due(self, now):
+        return now >= self.next_due
+
+    def observe(self, now, churn, latency, hint=None):
+        """
+        Args:
+            churn (float): Share of rows added, removed or changed since the previous fetch
+            latency (float): Seconds the fetch took
+            hint (float): Upper bound from the table's own contents (e.g. lease expiry)
+        Returns:
+            float: The new interval
+        """
+        interval = self.interval * (0.5 if churn > self.churn_threshold else 1.5)
+        interval = max(interval, latency / self.latency_share)
+        if hint is not None:
+            interval = min(interval, hint)
+        self.interval = min(max(interval, self.floor), self.ceiling)
+        self.next_due = now + self.interval
+        return self.interval
+
+
+def lease_renewal_hint(leases):
+    """
+    Median time until a bound lease expires, by which point about half the clients have renewed or gone
+    'last-seen' is not used: RouterOS refreshes it periodically rather than live, see mikrotik/dhcp.py
+    """
+    remaining = sorted(
+        seconds for seconds in (parse_duration(row.get('expires-after')) for row in leases.rows.values() if row.get('status') == 'bound')
+        if seconds is not None
+    )
+    return remaining[len(remaining) // 2] if remaining else None
+
+
+class AdaptiveSchedule:
+    """
+    Per-table poll intervals for one router, driven by churn, fetch latency and lease expiry
+    The daemon ticks at the floor interval and each tick fetches only the tables that are due
+    """
+    HINTS = {
+        'leases': lease_renewal_hint,
+    }
+
+    def __init__(self, router, floor, ceiling, initial=None, tables=('leases', 'arp', 'bridge_hosts')):
+        log.debug("AdaptiveSchedule.__init__(%s) for %s with floor: %s, ceiling: %s", self, router, floor, ceiling)
+        self.router = router
+        self.rates = {table: TableRate(table, floor, ceiling, initial=initial) for table in tables}
+
+    def due_tables(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [table for table, rate in self.rates.items() if rate.due(now)]
+
+    def reset(self):
+        """Make every table due, e.g. after a reconnect left the snapshot empty"""
+        for rate in self.rates.values():
+            rate.next_due = 0.0
+
+    def update(self, snapshot, now=None):
+        """Fold the tables `snapshot` just fetched (those it measured churn for) into their rates"""
+        now = time.monotonic() if now is None else now
+        for table in snapshot.churn:
+            rate = self.rates[table]
+            hint = self.HINTS[table](getattr(snapshot, table)) if table in self.HINTS else None
+            previous = rate.interval
+            interval = rate.observe(now, snapshot.churn.get(table, 0.0), snapshot.timings.get(table, 0.0), hint)
+            labels = {'router': self.router or '', 'table': table}
+            REGISTRY.set_gauge('network_monitor_poll_interval_seconds', labels, interval)
+            REGISTRY.set_gauge('network_monitor_table_churn_ratio', labels, snapshot.churn.get(table, 0.0))
+            if interval != previous:
+                log.debug("[%s] %s poll interval %.1fs -> %.1fs (churn %.4f)", self.router, table, previous, interval, snapshot.churn.get(table, 0.0))
+
+    def intervals(self):
+        return {table: rate.interval for table, rate in self.rates.items()}
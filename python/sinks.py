@@ -0,0 +1,316 @@
+"""
+Output Sinks Module
+Write the merged device inventory in machine readable form: NDJSON, CSV or a Prometheus text endpoint
+Every sink walks the inventory once and serializes one device at a time, so nothing proportional
+to the inventory size is built up besides the inventory itself
+"""
+
+from datetime import datetime, timezone
+from mikrotik.exceptions import *
+from mikrotik.metrics import REGISTRY
+import logging as log
+import threading
+import json
+import csv
+import sys
+import time
+import os
+
+# Column order for CSV, also the order of the keys written first in every NDJSON object
+REPORT_FIELDS = (
+    'polled_at',
+    'router',
+    'ip_address',
+    'mac_address',
+    'hostname',
+    'interface',
+    'dhcp_status',
+    'arp_status',
+    'last_seen',
+    'dynamic',
+    'static_lease',
+    'bridge',
+    'bridge_interface',
+    'bridge_status',
+    'on_bridge',
+    'bridge_local',
+    'comment',
+    'conflicts',
+    'reachable',
+    'vendor',
+    'dns_name',
+    'port_rx_bps',
+    'port_tx_bps',
+)
+
+
+def device_rows(inventory, polled_at=None):
+    """
+    Lazily yield get_merged_data() for every device, skipping devices that cannot be reported
+    Args:
+        inventory (dict): (router, MAC) or MAC => NetworkDevice
+        polled_at (str): Timestamp stamped on every row, defaults to now
+    """
+    polled_at = polled_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+    for key, device in inventory.items():
+        try:
+            device_info = device.get_merged_data()
+        except (NoValidIPAddressError, NoValidMacAddressError) as e:
+            log.warning("Skipping device %s in output: %s", key, str(e))
+            continue
+        device_info['polled_at'] = polled_at
+        yield device_info
+
+
+def open_output(path, newline=None):
+    """'-' (or nothing) is stdout, anything else is appended to so daemon polls accumulate"""
+    if not path or path == '-':
+        return sys.stdout, False
+    return open(path, 'a', encoding='utf-8', newline=newline), True
+
+
+class OutputSink:
+    """Base class; write() is called with the full inventory after every poll"""
+    # Only worth creating when the process keeps running between polls
+    DAEMON_ONLY = False
+
+    def write(self, inventory):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class NDJSONSink(OutputSink):
+    """One JSON object per device per poll"""
+    def __init__(self, path=None):
+        log.debug("NDJSONSink.__init__(%s) with path: %s", self, path)
+        self.path = path
+        self.stream, self._owns_stream = open_output(path)
+
+    def write(self, inventory):
+        write = self.stream.write
+        for device_info in device_rows(inventory):
+            row = {field: device_info.pop(field, None) for field in REPORT_FIELDS}
+            row.update(device_info)
+            write(json.dumps(row, separators=(',', ':')))
+            write('\n')
+        self.stream.flush()
+
+    def close(self):
+        if self._owns_stream:
+            self.stream.close()
+
+
+class CSVSink(OutputSink):
+    """
+    One CSV row per device per poll; the header is written once, when the output is empty
+    A file written with other columns (by a version with fewer REPORT_FIELDS) is moved aside first
+    """
+    def __init__(self, path=None):
+        log.debug("CSVSink.__init__(%s) with path: %s", self, path)
+        self.path = path
+        if path and path != '-':
+            self._rotate_mismatched(path)
+        self.stream, self._owns_stream = open_output(path, newline='')
+        self.writer = csv.DictWriter(self.stream, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+        self._needs_header = not self._owns_stream or self.stream.tell() == 0
+
+    @staticmethod
+    def _rotate_mismatched(path):
+        """Rename `path` to PATH.<timestamp> if its header is not REPORT_FIELDS, so new rows never land under other columns"""
+        try:
+            with open(path, encoding='utf-8', newline='') as csv_file:
+                header = next(csv.reader(csv_file), None)
+        except FileNotFoundError:
+            return
+        if header is None or tuple(header) == REPORT_FIELDS:
+            return
+        rotated = base = f"{path}.{time.strftime('%Y%m%d%H%M%S')}"
+        suffix = 1
+        while os.path.exists(rotated):
+            rotated = f"{base}.{suffix}"
+            suffix += 1
+        os.rename(path, rotated)
+        log.warning("[CSV] %s has other columns than this version writes, moved it to %s", path, rotated)
+
+    def write(self, inventory):
+        if self._needs_header:
+            self.writer.writeheader()
+            self._needs_header = False
+        for device_info in device_rows(inventory):
+            self.writer.writerow(device_info)
+        self.stream.flush()
+
+    def close(self):
+        if self._owns_stream:
+            self.stream.close()
+
+
+def prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_labels(**labels):
+    return '{' + ','.join(f'{name}="{prometheus_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class PrometheusSink(OutputSink):
+    """
+    Serves the latest inventory in the Prometheus text exposition format on /metrics
+    write() only swaps the inventory reference; each scrape renders it in one pass straight to the socket
+    """
+    DAEMON_ONLY = True
+
+    def __init__(self, port=9100, host='0.0.0.0'):
+        log.debug("PrometheusSink.__init__(%s) on %s:%s", self, host, port)
+        # Only the daemon serves metrics, so single runs never import the HTTP stack
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        self.inventory = {}
+        self.updated_at = None
+        sink = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.end_headers()
+                sink.render(self.wfile)
+
+            def log_message(self, format, *args):
+                log.debug("[PROMETHEUS] %s - %s", self.address_string(), format % args)
+
+        self.server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="prometheus", daemon=True)
+        self.thread.start()
+        log.info("[PROMETHEUS] Serving metrics on http://%s:%s/metrics", host, self.server.server_address[1])
+
+    def write(self, inventory):
+        self.inventory = inventory
+        self.updated_at = time.time()
+
+    def render(self, stream):
+        # Take one reference so a poll finishing mid-scrape cannot mix two inventories
+        inventory = self.inventory
+        interfaces = {}
+        bridge_ports = {}
+        statuses = {}
+        lines = [
+            "# HELP network_monitor_device_info Device seen on the network, always 1\n",
+            "# TYPE network_monitor_device_info gauge\n",
+        ]
+
+        for device_info in device_rows(inventory):
+            router = device_info['router'] or ''
+            lines.append("network_monitor_device_info%s 1\n" % prometheus_labels(
+                router=router,
+                mac_address=device_info['mac_address'],
+                ip_address=device_info['ip_address'],
+                hostname=device_info['hostname'],
+                interface=device_info['interface'],
+                bridge_port=device_info['bridge_interface'],
+            ))
+            for source in ('dhcp_status', 'arp_status', 'bridge_status'):
+                status_key = (router, source.split('_')[0], device_info[source])
+                statuses[status_key] = statuses.get(status_key, 0) + 1
+            if device_info['reachable'] is not None:
+                status_key = (router, 'probe', 'reachable' if device_info['reachable'] else 'unreachable')
+                statuses[status_key] = statuses.get(status_key, 0) + 1
+            interface_key = (router, device_info['interface'])
+            interfaces[interface_key] = interfaces.get(interface_key, 0) + 1
+            port_key = (router, device_info['bridge'], device_info['bridge_interface'])
+            bridge_ports[port_key] = bridge_ports.get(port_key, 0) + 1
+            # Flush in chunks so a large inventory is never held as one string
+            if len(lines) >= 512:
+                stream.write(''.join(lines).encode())
+                lines.clear()
+
+        lines.append("# HELP network_monitor_devices_by_status Devices per router, table (or active probe) and status\n")
+        lines.append("# TYPE network_monitor_devices_by_status gauge\n")
+        for (router, source, status), count in sorted(statuses.items()):
+            lines.append("network_monitor_devices_by_status%s %s\n" % (prometheus_labels(router=router, source=source, status=status), count))
+
+        lines.append("# HELP network_monitor_interface_devices Devices per router and ARP interface\n")
+        lines.append("# TYPE network_monitor_interface_devices gauge\n")
+        for (router, interface), count in sorted(interfaces.items()):
+            lines.append("network_monitor_interface_devices%s %s\n" % (prometheus_labels(router=router, interface=interface), count))
+
+        lines.append("# HELP network_monitor_bridge_port_devices Devices per router, bridge and bridge port\n")
+        lines.append("# TYPE network_monitor_bridge_port_devices gauge\n")
+        for (router, bridge, port), count in sorted(bridge_ports.items()):
+            lines.append("network_monitor_bridge_port_devices%s %s\n" % (prometheus_labels(router=router, bridge=bridge, port=port), count))
+
+        # Poll stage histograms and API call counters, see mikrotik/metrics.py
+        lines.extend(REGISTRY.render_prometheus(prometheus_labels))
+
+        if self.updated_at is not None:
+            lines.append("# HELP network_monitor_last_update_timestamp_seconds When the inventory was last refreshed\n")
+            lines.append("# TYPE network_monitor_last_update_timestamp_seconds gauge\n")
+            lines.append("network_monitor_last_update_timestamp_seconds %s\n" % self.updated_at)
+        stream.write(''.join(lines).encode())
+
+    def close(self):
+        log.debug("PrometheusSink.close(%s)", self)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+SINK_TYPES = {
+    'ndjson': NDJSONSink,
+    'csv': CSVSink,
+    'prometheus': PrometheusSink,
+}
+# Served by InventoryAPI in inventory_api.py, which builds on this module and is imported on first use
+API_SINK = 'api'
+
+
+def create_sink(spec):
+    """
+    Build a sink from a 'type[:target]' spec
+    Examples: 'ndjson', 'ndjson:-', 'csv:/var/log/devices.csv', 'prometheus:9100', 'prometheus:127.0.0.1:9100', 'api:8080'
+    """
+    kind, _, target = spec.strip().partition(':')
+    kind = kind.lower()
+    if kind == API_SINK:
+        from inventory_api import InventoryAPI
+        host, _, port = target.rpartition(':')
+        return InventoryAPI(port=port or 80, host=host or '0.0.0.0')
+    if kind not in SINK_TYPES:
+        raise ValueError(f"Unknown output sink '{kind}', expected one of: {', '.join([*SINK_TYPES, API_SINK])}")
+    if kind == 'prometheus':
+        host, _, port = target.rpartition(':')
+        return PrometheusSink(port=port or 9100, host=host or '0.0.0.0')
+    return SINK_TYPES[kind](target or None)
+
+
+def create_sinks(specs, daemon=False):
+    sinks = []
+    for spec in specs or []:
+        if not spec.strip():
+            continue
+        kind = spec.strip().partition(':')[0].lower()
+        if not daemon and (kind == API_SINK or SINK_TYPES.get(kind, OutputSink).DAEMON_ONLY):
+            log.warning("Output sink '%s' is only served in daemon mode, ignoring it", spec)
+            continue
+        sinks.append(create_sink(spec))
+    return sinks
+
+
+def write_sinks(sinks, inventory):
+    for sink in sinks:
+        try:
+            sink.write(inventory)
+        except Exception as e:
+            log.error("Error writing to %s: %s", type(sink).__name__, str(e))
+
+
+def close_sinks(sinks):
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as e:
+            log.error("Error closing %s: %s", type(sink).__name__, str(e))
@@ -51,8 +51,16 @@ if [ ! -d "${FULL_PYVENV_LOCATION}" ] || [ "${FORCE_VENV_REBUILD}" = 'TRUE' ]; t
     "${FULL_PYVENV_LOCATION}/bin/python" -m pip install ${QUIET} --upgrade pip
 fi
 
-# shellcheck disable=SC2086
-"${FULL_PYVENV_LOCATION}/bin/python" -m pip install ${QUIET} --requirement "${REPO_ROOT_DIR}/requirements.txt"
+# Records the requirements the virtual environment was last installed from, so an unchanged
+# environment skips pip (and its index lookups) on every run
+REQUIREMENTS_STAMP="${FULL_PYVENV_LOCATION}/.requirements.sha256"
+if [ "$(cat "${REQUIREMENTS_STAMP}" 2>/dev/null)" = "${REQUIREMENTS_SHA}" ] && ! [ "${FORCE_VENV_REBUILD}" = 'TRUE' ] && ! [ "${REFREEZE_REQUIREMENTS}" = 'TRUE' ]; then
+    printf '[INFO]\t[PY_ENV] Requirements already installed, skipping pip\n'
+else
+    # shellcheck disable=SC2086
+    "${FULL_PYVENV_LOCATION}/bin/python" -m pip install ${QUIET} --requirement "${REPO_ROOT_DIR}/requirements.txt" \
+        && printf '%s' "${REQUIREMENTS_SHA}" > "${REQUIREMENTS_STAMP}"
+fi
 
 if [ "${REFREEZE_REQUIREMENTS}" = 'TRUE' ]; then
     printf "[INFO]\t[PY_ENV] Re-Freezing the Requirements file\n"
@@ -60,7 +68,9 @@ if [ "${REFREEZE_REQUIREMENTS}" = 'TRUE' ]; then
 fi
 
 
-"${FULL_PYVENV_LOCATION}/bin/python" -Bu "${REPO_ROOT_DIR}/python/main.py" "${@}"
+# Bytecode is cached inside the virtual environment rather than skipped (-B), so later runs do not
+# recompile every module and the repository stays free of __pycache__ directories
+PYTHONPYCACHEPREFIX="${FULL_PYVENV_LOCATION}/pycache" "${FULL_PYVENV_LOCATION}/bin/python" -u "${REPO_ROOT_DIR}/python/main.py" "${@}"
 
 # shellcheck disable=SC1091
 . "${REPO_ROOT_DIR}/shell/post_run.sh"
\ No newline at end of file